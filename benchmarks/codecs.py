@@ -0,0 +1,80 @@
+"""Compare storage profiles and codecs for the ``rain`` variable on real data.
+
+Reads the first frames of a collected year and writes them with every candidate,
+reporting the compression ratio against uncompressed int64 and the read and write
+throughput in MB/s of uncompressed int64 data.
+
+    python -m benchmarks.codecs /my/data/dir/netcdf/2016.nc [n_frames]
+"""
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import h5netcdf
+import numpy as np
+
+from radolan_scraper import storage
+
+CANDIDATES = [
+    ("legacy", "lzf"),
+    ("compact", "none"),
+    ("compact", "lzf"),
+    ("compact", "gzip:1"),
+    ("compact", "gzip:4"),
+    ("compact", "gzip:9"),
+    ("compact", "zstd:3"),
+    ("compact", "zstd:9"),
+    ("compact", "blosc:5"),
+]
+
+
+def main():
+    sample_path = Path(sys.argv[1])
+    n_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 720
+    with h5netcdf.File(sample_path, "r") as f:
+        # h5netcdf returns the stored integers, without applying a scale factor.
+        rain = f["rain"][:n_frames]
+    raw_mb = rain.astype(np.int64).nbytes / 1e6
+
+    print(
+        f"{'profile':>8} {'codec':>8} {'ratio':>7} {'write MB/s':>11} {'read MB/s':>10}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile_name, codec in CANDIDATES:
+            try:
+                profile = storage.get_profile(profile_name, codec)
+            except ValueError as e:
+                print(f"{profile_name:>8} {codec:>8} skipped: {e}")
+                continue
+            path = Path(tmp_dir) / f"{profile_name}-{codec}.nc"
+            write_seconds = time_write(path, rain, profile)
+            read_seconds = time_read(path)
+            ratio = raw_mb / (path.stat().st_size / 1e6)
+            print(
+                f"{profile_name:>8} {codec:>8} {ratio:>7.1f} "
+                f"{raw_mb / write_seconds:>11.1f} {raw_mb / read_seconds:>10.1f}"
+            )
+            path.unlink()
+
+
+def time_write(path: Path, rain: np.ndarray, profile: storage.StorageProfile) -> float:
+    start = time.perf_counter()
+    with h5netcdf.File(path, "w") as f:
+        f.dimensions["time"] = rain.shape[0]
+        f.dimensions["y"] = rain.shape[1]
+        f.dimensions["x"] = rain.shape[2]
+        rain_var = storage.create_rain_variable(f, profile)
+        rain_var[...] = rain
+    return time.perf_counter() - start
+
+
+def time_read(path: Path) -> float:
+    start = time.perf_counter()
+    with h5netcdf.File(path, "r") as f:
+        f["rain"][...]
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Measure how many frames per second the frame decoders of ``collect`` achieve.
+
+Run with a downloaded month tar, e.g.
+
+    python -m benchmarks.decode /my/data/dir/raw/2016/RW-201601.tar
+"""
+from pathlib import Path
+import sys
+import tarfile
+import time
+
+from radolan_scraper import collect
+
+
+def main():
+    tar_file_path = Path(sys.argv[1])
+    for decoder in collect.DECODERS:
+        n_frames, seconds = time_decoder(tar_file_path, decoder)
+        print(
+            f"{decoder:>10}: {n_frames} frames in {seconds:.1f}s, "
+            f"{n_frames / seconds:.1f} frames/s"
+        )
+
+
+def time_decoder(tar_file_path: Path, decoder: str):
+    n_frames = 0
+    bounding_boxes = set()
+    start = time.perf_counter()
+    with tarfile.open(tar_file_path) as tf_month:
+        for day_member in tf_month:
+            member = tf_month.extractfile(day_member)
+            _, times = collect.collect_day(member, bounding_boxes, decoder)
+            n_frames += len(times)
+
+    return n_frames, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
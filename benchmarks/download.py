@@ -0,0 +1,52 @@
+"""Measure the download throughput of ``scrape`` against a local stand-in server.
+
+Run with the number of files and their size in MB, e.g.
+
+    python -m benchmarks.download 24 40
+"""
+import asyncio
+from datetime import datetime
+import os
+from pathlib import Path
+import sys
+import tempfile
+
+from benchmarks.dwd_server import DWDServer, publish
+from radolan_scraper import scrape
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server_root = Path(tmp_dir) / "server"
+        data = os.urandom(size_mb * 1024**2)
+        for i in range(n_files):
+            year, month = 2006 + i // 12, i % 12 + 1
+            publish(server_root, year, f"RW-{year}{month:02}.tar", data, datetime.now())
+        years = range(2006, 2006 + (n_files + 11) // 12)
+
+        for limit_per_host in (1, 4, scrape.LIMIT_PER_HOST):
+            data_path = Path(tmp_dir) / f"raw_{limit_per_host}"
+            stats = asyncio.run(
+                time_download(server_root, data_path, years, limit_per_host)
+            )
+            print(
+                f"{limit_per_host:>3} connections: {stats.n_bytes / 1024**2:.0f} MB "
+                f"in {stats.seconds:.1f}s, {stats.mb_per_s:.1f} MB/s"
+            )
+
+
+async def time_download(server_root, data_path, years, limit_per_host):
+    async with DWDServer(server_root) as server:
+        return await scrape.run(
+            asyncio.get_running_loop(),
+            data_path,
+            years,
+            base_url=server.base_url,
+            limit_per_host=limit_per_host,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""A local stand-in for the DWD open data server, used to test and benchmark ``scrape``."""
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import os
+from pathlib import Path
+import threading
+from typing import *
+
+from aiohttp import web
+from yarl import URL
+
+PREFIX = "/climate_environment/CDC/grids_germany/hourly/radolan/historical/asc/"
+
+
+class DWDServer:
+    """Serve the year directories in ``root`` like nginx does on opendata.dwd.de.
+
+    Every request is recorded in ``requests`` as ``(path, range header)``, and the
+    client addresses of all connections in ``peers``. Requests of the file names in
+    ``failing`` are answered with 500 Internal Server Error.
+    """
+
+    def __init__(self, root: Path, failing: Iterable[str] = ()):
+        self.root = root
+        self.failing = set(failing)
+        self.requests: List[Tuple[str, Optional[str]]] = []
+        self.peers: Set[Tuple[str, int]] = set()
+        self.app = web.Application()
+        self.app.router.add_get(PREFIX + "{year}", self.redirect)
+        self.app.router.add_get(PREFIX + "{year}/", self.listing)
+        self.app.router.add_get(PREFIX + "{year}/{name}", self.file)
+        self.runner = None
+        self.base_url = None
+
+    async def __aenter__(self) -> "DWDServer":
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = URL(f"http://127.0.0.1:{port}{PREFIX}")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.runner.cleanup()
+
+    def record(self, request: web.Request):
+        self.requests.append((request.path, request.headers.get("Range")))
+        self.peers.add(request.transport.get_extra_info("peername"))
+
+    async def redirect(self, request: web.Request) -> web.Response:
+        # Like nginx, redirect directory requests to the path with a slash.
+        raise web.HTTPMovedPermanently(request.path + "/")
+
+    async def listing(self, request: web.Request) -> web.Response:
+        self.record(request)
+        year_dir = self.root / request.match_info["year"]
+        lines = ['<html><body><pre><a href="../">../</a>']
+        for path in sorted(year_dir.glob("*.tar")):
+            stat = path.stat()
+            modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+            lines.append(
+                f'<a href="{path.name}">{path.name}</a>'
+                f"{' ' * 38}{modified:%d-%b-%Y %H:%M}{stat.st_size:>20}"
+            )
+        lines.append("</pre></body></html>")
+        return web.Response(text="\n".join(lines), content_type="text/html")
+
+    async def file(self, request: web.Request) -> web.StreamResponse:
+        self.record(request)
+        path = self.root / request.match_info["year"] / request.match_info["name"]
+        if path.name in self.failing:
+            raise web.HTTPInternalServerError()
+        if not path.exists():
+            raise web.HTTPNotFound()
+        # FileResponse answers range requests with 206 Partial Content.
+        return web.FileResponse(path)
+
+
+@contextmanager
+def serve_in_thread(root: Path) -> Iterator[DWDServer]:
+    """Run a server in a background thread, for clients with their own event loop."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = DWDServer(root)
+    asyncio.run_coroutine_threadsafe(server.__aenter__(), loop).result()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.__aexit__(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def publish(root: Path, year: int, name: str, data: bytes, modified: datetime) -> Path:
+    """Put a file on the server with the given modification time."""
+    path = root / str(year) / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    mtime = modified.replace(tzinfo=timezone.utc).timestamp()
+    os.utime(path, (mtime, mtime))
+    return path
@@ -0,0 +1,214 @@
+"""Time each stage of the pipeline on a synthetic archive and compare to a baseline.
+
+Every stage runs in a fresh process, so that its peak resident memory can be
+measured on its own. The results are written as JSON and, given a baseline from an
+earlier run, stages that got slower or use more memory than the tolerance allows
+are reported and make the run fail. No network access is needed.
+
+    python -m benchmarks.suite --scale small --output results.json
+    python -m benchmarks.suite --scale small --baseline results.json
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import json
+from pathlib import Path
+import resource
+import sys
+import tempfile
+import time
+from typing import *
+
+from benchmarks import synthetic
+from radolan_scraper import add_coordinate_grid
+from radolan_scraper import collect
+from radolan_scraper import combine
+from radolan_scraper import extract
+from radolan_scraper import frame_store
+from radolan_scraper import storage
+
+
+class Scale(NamedTuple):
+    months: Tuple[date, ...]
+    days_per_month: Optional[int]
+    hours_per_day: int
+
+
+SCALES = {
+    "tiny": Scale((date(2016, 1, 1),), 2, 24),
+    "small": Scale((date(2016, 1, 1),), None, 24),
+    "medium": Scale((date(2015, 12, 1), date(2016, 1, 1), date(2016, 2, 1)), None, 24),
+}
+
+
+class StageResult(NamedTuple):
+    seconds: float
+    frames_per_s: float
+    mb_per_s: float
+    peak_rss_mb: float
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=tuple(SCALES), default="tiny")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        help="Keep the synthetic archive here and reuse it in later runs.",
+    )
+    parser.add_argument("--output", type=Path, help="Write the results to this file.")
+    parser.add_argument("--baseline", type=Path, help="Results of an earlier run.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative loss of throughput or growth of memory.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or Path(tmp_dir)
+        results = run(data_dir, SCALES[args.scale], args.seed, args.workers)
+
+    for stage, result in results.items():
+        print(
+            f"{stage:>20}: {result.seconds:7.2f}s {result.frames_per_s:8.1f} frames/s "
+            f"{result.mb_per_s:8.1f} MB/s {result.peak_rss_mb:8.1f} MB peak RSS"
+        )
+    report = {
+        "scale": args.scale,
+        "seed": args.seed,
+        "workers": args.workers,
+        "stages": {stage: result._asdict() for stage, result in results.items()},
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["scale"] != args.scale:
+            print(f"Warning: the baseline was measured at scale {baseline['scale']}")
+        regressions = compare(report["stages"], baseline["stages"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+def run(
+    data_dir: Path, scale: Scale, seed: int = 0, n_workers: int = 4
+) -> Dict[str, StageResult]:
+    """Generate the archive below ``data_dir`` if needed and time every stage."""
+    raw_dir = data_dir / "raw"
+    tar_files = [
+        raw_dir / str(month.year) / f"RW-{month:%Y%m}.tar" for month in scale.months
+    ]
+    if not all(tar_file.exists() for tar_file in tar_files):
+        synthetic.generate_archive(
+            raw_dir, scale.months, scale.days_per_month, scale.hours_per_day, seed
+        )
+    n_frames = scale.hours_per_day * sum(
+        synthetic.count_days(month, scale.days_per_month) for month in scale.months
+    )
+
+    out_dir = data_dir / "out"
+    out_dir.mkdir(exist_ok=True)
+    years = sorted({month.year for month in scale.months})
+    year_files = [out_dir / f"{year}.nc" for year in years]
+    combined = out_dir / "combined.nc"
+    compact = storage.PROFILES["compact"]
+
+    # Each stage is measured by the size of the files it reads, which earlier
+    # stages have written by the time it runs.
+    stages = {
+        "collect": (collect_years, (raw_dir, year_files, 1), tar_files),
+        "collect_parallel": (
+            collect_years,
+            (raw_dir, year_files, n_workers),
+            tar_files,
+        ),
+        "combine": (combine.run, (combined, year_files, compact), year_files),
+        "add_coordinate_grid": (add_coordinate_grid.run, (combined,), [combined]),
+        "extract": (
+            extract.run,
+            (out_dir / "extracted", tar_files, n_workers),
+            tar_files,
+        ),
+        "frame_store": (
+            frame_store.write,
+            (out_dir / "frames.npy", tar_files, "native", n_workers),
+            tar_files,
+        ),
+    }
+    results = {}
+    for stage, (function, args, inputs) in stages.items():
+        n_bytes = sum(path.stat().st_size for path in inputs)
+        seconds, peak_rss = run_stage(function, *args)
+        results[stage] = StageResult(
+            seconds=seconds,
+            frames_per_s=n_frames / seconds,
+            mb_per_s=n_bytes / 1024**2 / seconds,
+            peak_rss_mb=peak_rss / 1024,
+        )
+    return results
+
+
+def collect_years(raw_dir: Path, year_files: Sequence[Path], n_workers: int) -> None:
+    for year_file in year_files:
+        collect.run(
+            year_file,
+            raw_dir / year_file.stem,
+            n_workers=n_workers,
+            profile=storage.PROFILES["compact"],
+        )
+
+
+def run_stage(function: Callable, *args) -> Tuple[float, int]:
+    """Run ``function`` in a new process and return its duration and peak RSS in kB."""
+    with ProcessPoolExecutor(1) as executor:
+        return executor.submit(measure, function, *args).result()
+
+
+def measure(function: Callable, *args) -> Tuple[float, int]:
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    # Stages with a process pool of their own have joined their workers by now,
+    # so these are included in the children.
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return seconds, peak_rss
+
+
+def compare(
+    stages: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[str]:
+    """Describe every stage that lost throughput or gained memory beyond ``tolerance``."""
+    regressions = []
+    for stage, result in stages.items():
+        if stage not in baseline:
+            continue
+        before = baseline[stage]
+        if result["frames_per_s"] < before["frames_per_s"] * (1 - tolerance):
+            regressions.append(
+                f"{stage} dropped from {before['frames_per_s']:.1f} "
+                f"to {result['frames_per_s']:.1f} frames/s"
+            )
+        if result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{stage} grew from {before['peak_rss_mb']:.1f} "
+                f"to {result['peak_rss_mb']:.1f} MB peak RSS"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    main()
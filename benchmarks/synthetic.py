@@ -0,0 +1,154 @@
+"""Generate a synthetic RADOLAN archive with the layout of the DWD server.
+
+Each month is a ``raw/YYYY/RW-YYYYMM.tar`` holding one ``RW-YYYYMMDD.tar.gz`` per day
+with one ``RW_YYYYMMDD-HH50.asc`` per hour. The frames have the header of the RW
+product. Cells outside of a fixed radar coverage are missing, and rain falls from a
+few moving cells, so that most values are zero, as in the real data.
+
+    python -m benchmarks.synthetic /tmp/radolan/raw 2016-01 2016-03
+"""
+from datetime import date, datetime, timedelta
+import gzip
+import io
+from pathlib import Path
+import sys
+import tarfile
+from typing import *
+
+import numpy as np
+
+SHAPE = (900, 900)
+HEADER = (
+    "ncols         900\n"
+    "nrows         900\n"
+    "xllcorner     -523462\n"
+    "yllcorner     -4658645\n"
+    "cellsize      1000\n"
+    "NODATA_value  -1\n"
+)
+MAX_VALUE = 4095
+# Text of each value from -1 to MAX_VALUE, to format frames without a Python loop
+# per value.
+_VALUE_TEXT = np.array(
+    [str(i).encode() for i in range(-1, MAX_VALUE + 1)], dtype=object
+)
+
+
+def main():
+    raw_dir = Path(sys.argv[1])
+    first = datetime.strptime(sys.argv[2], "%Y-%m").date()
+    last = (
+        datetime.strptime(sys.argv[3], "%Y-%m").date() if len(sys.argv) > 3 else first
+    )
+    for tar_file in generate_archive(raw_dir, iter_months(first, last)):
+        print(tar_file)
+
+
+def iter_months(first: date, last: date) -> Iterator[date]:
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = (month + timedelta(days=31)).replace(day=1)
+
+
+def generate_archive(
+    raw_dir: Path,
+    months: Iterable[date],
+    days_per_month: Optional[int] = None,
+    hours_per_day: int = 24,
+    seed: int = 0,
+) -> List[Path]:
+    """Write month tars below ``raw_dir`` and return their paths.
+
+    ``days_per_month`` and ``hours_per_day`` limit the number of frames, to
+    scale the archive down.
+    """
+    rng = np.random.RandomState(seed)
+    coverage = make_coverage(rng)
+    storm = Storm(rng)
+    tar_files = []
+    for month in months:
+        tar_file = raw_dir / str(month.year) / f"RW-{month:%Y%m}.tar"
+        tar_file.parent.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(tar_file, "w") as month_tar:
+            day = month
+            n_days = 0
+            while day.month == month.month and n_days != days_per_month:
+                frames = (storm.next_frame(coverage) for _ in range(hours_per_day))
+                add_member(month_tar, f"RW-{day:%Y%m%d}.tar.gz", make_day(day, frames))
+                day += timedelta(days=1)
+                n_days += 1
+        tar_files.append(tar_file)
+    return tar_files
+
+
+def count_days(month: date, days_per_month: Optional[int] = None) -> int:
+    next_month = (month.replace(day=1) + timedelta(days=31)).replace(day=1)
+    n_days = (next_month - month.replace(day=1)).days
+    return n_days if days_per_month is None else min(days_per_month, n_days)
+
+
+def make_day(day: date, frames: Iterable[np.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(mode="w", fileobj=buffer) as day_tar:
+        for hour, frame in enumerate(frames):
+            add_member(day_tar, f"RW_{day:%Y%m%d}-{hour:02d}50.asc", to_asc(frame))
+    # A fixed time in the gzip header keeps the archive reproducible.
+    return gzip.compress(buffer.getvalue(), compresslevel=6, mtime=0)
+
+
+def add_member(tar_file: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar_file.addfile(info, io.BytesIO(data))
+
+
+def to_asc(frame: np.ndarray) -> bytes:
+    text = _VALUE_TEXT[np.clip(frame, -1, MAX_VALUE) + 1]
+    body = b"\n".join(b" ".join(row) for row in text)
+    return HEADER.encode() + body + b"\n"
+
+
+def make_coverage(rng: np.random.RandomState, n_radars: int = 17) -> np.ndarray:
+    """Cells within 150 km of randomly placed radars."""
+    y, x = np.mgrid[0 : SHAPE[0], 0 : SHAPE[1]]
+    covered = np.zeros(SHAPE, dtype=bool)
+    for ry, rx in rng.uniform(150, 750, size=(n_radars, 2)):
+        covered |= (y - ry) ** 2 + (x - rx) ** 2 < 150**2
+    return covered
+
+
+class Storm:
+    """Rain cells that drift across the grid and change their intensity."""
+
+    def __init__(self, rng: np.random.RandomState, n_cells: int = 12):
+        self.rng = rng
+        self.position = rng.uniform(0, 900, size=(n_cells, 2))
+        self.velocity = rng.normal(0, 8, size=(n_cells, 2))
+        self.radius = rng.uniform(15, 60, size=n_cells)
+        self.intensity = rng.uniform(5, 80, size=n_cells)
+        # The grid is coarsened for the smooth part of the field.
+        self.coarse = np.mgrid[0 : SHAPE[0] : 10, 0 : SHAPE[1] : 10] + 5
+
+    def next_frame(self, coverage: np.ndarray) -> np.ndarray:
+        self.position = (self.position + self.velocity) % 900
+        self.intensity = np.clip(
+            self.intensity * self.rng.lognormal(0, 0.2, size=len(self.intensity)),
+            1,
+            200,
+        )
+        y, x = self.coarse
+        field = np.zeros(y.shape)
+        for (cy, cx), radius, intensity in zip(
+            self.position, self.radius, self.intensity
+        ):
+            field += intensity * np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / radius**2)
+        field = np.kron(field, np.ones((10, 10)))
+        noise = self.rng.gamma(2, 0.5, size=SHAPE)
+        frame = np.where(field > 2, field * noise, 0).astype(np.int64)
+        frame[~coverage] = -1
+        return frame
+
+
+if __name__ == "__main__":
+    main()
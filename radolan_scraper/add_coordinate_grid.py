@@ -1,80 +1,146 @@
 """Add the multidimensional coordinates to the netcdf file."""
+import hashlib
+import logging
 from pathlib import Path
 from typing import *
 
 import h5netcdf
 import numpy as np
 
+from radolan_scraper import radolan_grid
+
+logger = logging.getLogger(__name__)
+
+# Width of a single value in the coordinate definition files.
+FIELD_WIDTH = 8
+
 
 def main():
     base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
-    metadata_dir = Path(__file__).parents[1] / "metadata"
     add_grid_to = base_data_dir / "netcdf" / "combined.nc"
-    run(
-        add_grid_to, metadata_dir / "phi_center.txt", metadata_dir / "lambda_center.txt"
-    )
+    run(add_grid_to)
 
 
 def run(
-    add_grid_to: Path, latitude_definitions: Path, longitude_definitions: Path
+    add_grid_to: Path,
+    latitude_definitions: Optional[Path] = None,
+    longitude_definitions: Optional[Path] = None,
 ) -> None:
+    """Add the coordinates of the grid cells and their bounds to ``add_grid_to``.
 
+    Without the definition files, the coordinates are computed from the RADOLAN
+    projection for the shape of the ``rain`` variable.
+    """
     with h5netcdf.File(add_grid_to, "a") as f:
+        shape = f["rain"].shape[1:]
+        if latitude_definitions is None or longitude_definitions is None:
+            grid = radolan_grid.get_grid(shape)
+        else:
+            xc = parse_longitude_definitions(longitude_definitions, shape)
+            yc = parse_latitude_definitions(latitude_definitions, shape)
+            grid = radolan_grid.Grid(xc, yc, get_cell_bounds(xc), get_cell_bounds(yc))
+        write_grid(f, grid)
+
+
+def write_grid(f: h5netcdf.File, grid: radolan_grid.Grid) -> None:
+    """Write the cell centers and the cell bounds, replacing existing ones."""
+    if "nv" not in f.dimensions:
+        f.dimensions["nv"] = 4
+
+    xc_var = write_variable(f, "xc", ("y", "x"), grid.xc)
+    xc_var.attrs["long_name"] = "longitude of grid cell center"
+    xc_var.attrs["units"] = "degrees_east"
+    xc_var.attrs["bounds"] = "xv"
+
+    yc_var = write_variable(f, "yc", ("y", "x"), grid.yc)
+    yc_var.attrs["long_name"] = "latitude of grid cell center"
+    yc_var.attrs["units"] = "degrees_north"
+    yc_var.attrs["bounds"] = "yv"
+
+    xv_var = write_variable(f, "xv", ("y", "x", "nv"), grid.xv)
+    xv_var.attrs["units"] = "degrees_east"
+    yv_var = write_variable(f, "yv", ("y", "x", "nv"), grid.yv)
+    yv_var.attrs["units"] = "degrees_north"
+
+    rain_var = f["rain"]
+    rain_var.attrs["coordinates"] = "yc xc"
+
 
-        try:
-            xc_var = f.create_variable(
-                "xc",
-                dimensions=("y", "x"),
-                data=parse_longitude_definitions(longitude_definitions).flatten(),
-            )
-            xc_var.attrs["long_name"] = "longitude of grid cell center"
-            xc_var.attrs["units"] = "degrees_east"
-            xc_var.attrs["bounds"] = "xv"
-        except ValueError:
-            xc_var = f["xc"]
-            xc_var[...] = parse_longitude_definitions(longitude_definitions)
-
-        try:
-            yc_var = f.create_variable(
-                "yc",
-                dimensions=("y", "x"),
-                data=parse_latitude_definitions(latitude_definitions).flatten(),
-            )
-            yc_var.attrs["long_name"] = "latitude of grid cell center"
-            yc_var.attrs["units"] = "degrees_north"
-            yc_var.attrs["bounds"] = "yv"
-        except ValueError:
-            yc_var = f["yc"]
-            yc_var[...] = parse_latitude_definitions(latitude_definitions)
-
-        rain_var = f["rain"]
-        rain_var.attrs["coordinates"] = "yc xc"
-
-
-def parse_longitude_definitions(coord_definition_path) -> np.array:
-    import itertools
-
-    with open(coord_definition_path) as f:
-        return np.fromiter(
-            map(
-                float,
-                itertools.chain.from_iterable(
-                    chunk_str(line, 8) for line in f.readlines()
-                ),
-            ),
-            float,
-        ).reshape(900, 900)
-
-
-def parse_latitude_definitions(coord_definition_path) -> np.array:
-    return parse_longitude_definitions(coord_definition_path)[::-1]
-
-
-def chunk_str(iterable: Iterable, n: int) -> Iterable[str]:
-    """Collect data into fixed-length chunks or blocks"""
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx"
-    args = [iter(iterable)] * n
-    return map(lambda x: "".join(map(str, x)), zip(*args))
+def write_variable(
+    f: h5netcdf.File, name: str, dimensions: Tuple[str, ...], data: np.ndarray
+) -> h5netcdf.Variable:
+    if name in f.variables:
+        var = f[name]
+        var[...] = data
+        return var
+    return f.create_variable(name, dimensions=dimensions, data=data)
+
+
+def parse_longitude_definitions(
+    coord_definition_path, shape: Tuple[int, int] = (900, 900)
+) -> np.array:
+    return parse_definitions(coord_definition_path, shape)
+
+
+def parse_latitude_definitions(
+    coord_definition_path, shape: Tuple[int, int] = (900, 900)
+) -> np.array:
+    return parse_definitions(coord_definition_path, shape)
+
+
+def parse_definitions(coord_definition_path, shape: Tuple[int, int]) -> np.array:
+    # The definitions start with the southernmost row, the data with the northernmost.
+    return load_definitions(Path(coord_definition_path)).reshape(shape)[::-1]
+
+
+def load_definitions(coord_definition_path: Path) -> np.ndarray:
+    """Parse a coordinate definition file, using a cached binary copy if possible.
+
+    The copy is stored next to the file and keyed on the hash of its content, so
+    a changed file is parsed again.
+    """
+    data = coord_definition_path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    cache_path = coord_definition_path.with_name(
+        f"{coord_definition_path.name}.{digest}.npy"
+    )
+    try:
+        return np.load(cache_path)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    values = parse_fixed_width(data)
+    try:
+        np.save(cache_path, values)
+    except OSError as e:
+        logger.debug(f"Could not cache {coord_definition_path}: {e}")
+    return values
+
+
+def parse_fixed_width(data: bytes, width: int = FIELD_WIDTH) -> np.ndarray:
+    """Parse lines of values that are ``width`` characters wide each.
+
+    Characters at the end of a line that do not fill a whole field are ignored.
+    """
+    lines = data.splitlines()
+    fields = b"".join(line[: len(line) // width * width] for line in lines)
+    return np.frombuffer(fields, dtype=f"S{width}").astype(np.float64)
+
+
+def get_cell_bounds(centers: np.ndarray) -> np.ndarray:
+    """Estimate the four corners of each cell from the cell centers.
+
+    Each inner corner is the mean of the four surrounding centers, the corners
+    on the edge are extrapolated linearly. The first row of ``centers`` is the
+    northernmost one, and the corners are ordered as by ``radolan_grid.to_bounds``,
+    anticlockwise on the map as CF expects for ``bounds`` of shape (y, x, 4).
+    """
+    # Extend the centers by one cell on each side.
+    padded = np.pad(centers, 1, mode="reflect", reflect_type="odd")
+    corners = (
+        padded[:-1, :-1] + padded[:-1, 1:] + padded[1:, :-1] + padded[1:, 1:]
+    ) / 4
+    return radolan_grid.to_bounds(corners)
 
 
 if __name__ == "__main__":
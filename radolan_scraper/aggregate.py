@@ -0,0 +1,234 @@
+"""Aggregate the hourly frames of the combined netcdf file to days, months and years.
+
+A single pass over ``combined.nc`` writes the sum and the maximum of each period,
+e.g. ``rain_daily_sum`` and ``rain_daily_max``, together with the number of valid
+hours that went into them, e.g. ``rain_daily_count``. Missing values are skipped,
+and periods without any valid hour are stored as missing. Frames are assigned to
+periods by the date of their timestamp. Running the aggregation again on an
+existing file only adds the frames later than the last aggregated one.
+"""
+import logging
+from pathlib import Path
+from typing import *
+
+import cf_units
+import h5netcdf
+import numpy as np
+
+from radolan_scraper import storage
+
+logger = logging.getLogger(__name__)
+
+# Name, dimension and numpy datetime unit of each level.
+LEVELS = (("daily", "day", "D"), ("monthly", "month", "M"), ("yearly", "year", "Y"))
+
+CHUNKS = (16, 100, 100)
+
+PERIOD_UNITS = "days since 1970-01-01 00:00:00"
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    netcdf_dir = base_data_dir / "netcdf"
+    run(netcdf_dir / "combined.nc", netcdf_dir / "aggregates.nc")
+
+
+class Level:
+    """Accumulates the hours of the current period of one level.
+
+    Finished periods are written in blocks of whole chunks along time.
+    """
+
+    def __init__(self, f: h5netcdf.File, name: str, dim: str, unit: str):
+        self.f = f
+        self.dim = dim
+        self.unit = unit
+        self.sum_var = f[f"rain_{name}_sum"]
+        self.max_var = f[f"rain_{name}_max"]
+        self.count_var = f[f"rain_{name}_count"]
+        self.fill_value = self.sum_var.attrs["_FillValue"]
+        shape = self.sum_var.shape[1:]
+        self.sum = np.zeros(shape, dtype=np.int64)
+        self.max = np.zeros(shape, dtype=np.int64)
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.pending = []
+
+        # The last stored period may be incomplete, so it is continued.
+        self.index = len(f[dim])
+        self.key = None
+        if self.index > 0:
+            self.index -= 1
+            self.key = np.datetime64(int(f[dim][self.index]), "D").astype(f"M8[{unit}]")
+            self.count[...] = self.count_var[self.index]
+            valid = self.count > 0
+            self.sum[valid] = self.sum_var[self.index][valid]
+            self.max[valid] = self.max_var[self.index][valid]
+
+    def add(self, time: np.datetime64, sums, maxima, counts) -> None:
+        key = time.astype(f"M8[{self.unit}]")
+        if key != self.key:
+            if self.key is not None:
+                self.finish_period()
+            self.key = key
+        has_values = counts > 0
+        first = has_values & (self.count == 0)
+        self.max[first] = maxima[first]
+        np.maximum(self.max, maxima, out=self.max, where=has_values)
+        self.sum += sums
+        self.count += counts
+
+    def finish_period(self) -> None:
+        missing = self.count == 0
+        self.pending.append(
+            (
+                self.key.astype("M8[D]").astype(np.int64),
+                np.where(missing, self.fill_value, self.sum),
+                np.where(missing, self.fill_value, self.max),
+                self.count.copy(),
+            )
+        )
+        self.sum[...] = 0
+        self.max[...] = 0
+        self.count[...] = 0
+        if len(self.pending) == CHUNKS[0]:
+            self.write()
+
+    def write(self) -> None:
+        if not self.pending:
+            return
+        start = self.index
+        end = start + len(self.pending)
+        if end > len(self.f[self.dim]):
+            self.f.resize_dimension(self.dim, end)
+        keys, sums, maxima, counts = zip(*self.pending)
+        self.f[self.dim][start:end] = keys
+        self.sum_var[start:end] = np.stack(sums)
+        self.max_var[start:end] = np.stack(maxima)
+        self.count_var[start:end] = np.stack(counts)
+        self.index = end
+        self.pending = []
+
+    def close(self) -> None:
+        """Write all finished periods and the current, possibly incomplete one."""
+        if self.key is not None:
+            self.finish_period()
+        self.write()
+
+
+def run(aggregate_from: Path, aggregate_to: Path, memory_limit: int = 1024**3) -> int:
+    """Aggregate ``aggregate_from`` into ``aggregate_to``, see the module docstring.
+
+    Returns the number of aggregated frames.
+    """
+    with h5netcdf.File(aggregate_from, "r") as src:
+        rain = src["rain"]
+        time_unit = cf_units.Unit(
+            src["time"].attrs["units"], calendar=cf_units.CALENDAR_STANDARD
+        )
+        times = np.array(time_unit.num2pydate(src["time"][...]), dtype="M8[m]")
+        fill_value = rain.attrs.get("_FillValue", storage.FILL_VALUE)
+
+        append = aggregate_to.exists()
+        with h5netcdf.File(aggregate_to, "a" if append else "w") as dst:
+            if append:
+                if "last_time" not in dst.attrs:
+                    raise ValueError(
+                        f"An earlier update of {aggregate_to} did not finish, "
+                        "delete it to aggregate from scratch."
+                    )
+                last_time = np.datetime64(dst.attrs["last_time"], "m")
+                start = int(np.searchsorted(times, last_time, side="right"))
+            else:
+                create_variables(dst, src)
+                start = 0
+            if start == len(times):
+                logger.info("All frames are aggregated already")
+                return 0
+            # Marks the file as incomplete until the update finished.
+            if "last_time" in dst.attrs:
+                del dst.attrs["last_time"]
+
+            levels = [Level(dst, name, dim, unit) for name, dim, unit in LEVELS]
+            t_chunk = (rain.chunks or rain.shape)[0]
+            frame_bytes = np.prod(rain.shape[1:]) * 2 * np.dtype(np.int64).itemsize
+            block = max(memory_limit // frame_bytes // t_chunk, 1) * t_chunk
+            logger.info(f"Aggregating {len(times) - start} frames")
+            for aligned_start in range(start // t_chunk * t_chunk, len(times), block):
+                block_start = max(aligned_start, start)
+                block_end = min(aligned_start + block, len(times))
+                aggregate_block(
+                    rain[block_start:block_end],
+                    times[block_start:block_end],
+                    fill_value,
+                    levels,
+                )
+            for level in levels:
+                level.close()
+            dst.attrs["last_time"] = str(times[-1])
+    return len(times) - start
+
+
+def aggregate_block(
+    frames: np.ndarray, times: np.ndarray, fill_value: int, levels: Sequence[Level]
+) -> None:
+    """Add the frames of each day in a block of frames to all levels."""
+    days = times.astype("M8[D]")
+    bounds = np.flatnonzero(days[1:] != days[:-1]) + 1
+    for day_start, day_end in zip(
+        np.concatenate([[0], bounds]), np.concatenate([bounds, [len(days)]])
+    ):
+        day_frames = frames[day_start:day_end]
+        valid = day_frames != fill_value
+        sums = np.where(valid, day_frames, 0).sum(axis=0, dtype=np.int64)
+        maxima = np.where(valid, day_frames, np.iinfo(day_frames.dtype).min).max(axis=0)
+        counts = valid.sum(axis=0, dtype=np.int32)
+        for level in levels:
+            level.add(times[day_start], sums, maxima, counts)
+
+
+def create_variables(dst: h5netcdf.File, src: h5netcdf.File) -> None:
+    n_rows, n_cols = src["rain"].shape[1:]
+    dst.dimensions["y"] = n_rows
+    dst.dimensions["x"] = n_cols
+    for name in ("x", "y", "xc", "yc"):
+        if name in src.variables:
+            var = dst.create_variable(
+                name, dimensions=src[name].dimensions, data=src[name][...]
+            )
+            var.attrs.update(
+                {k: v for k, v in src[name].attrs.items() if k != "bounds"}
+            )
+    coordinates = "yc xc" if "xc" in src.variables else None
+
+    scale_factor = src["rain"].attrs.get("scale_factor")
+    chunks = tuple(min(c, s) for c, s in zip(CHUNKS, (CHUNKS[0], n_rows, n_cols)))
+    for name, dim, _ in LEVELS:
+        # Periods are unlimited, so later frames can be added.
+        dst.dimensions[dim] = None
+        period_var = dst.create_variable(dim, dimensions=(dim,), dtype=np.int64)
+        period_var.attrs["units"] = PERIOD_UNITS
+        period_var.attrs["long_name"] = f"start of the {dim}"
+        for statistic, units in (("sum", "mm"), ("max", "mm/h")):
+            var = dst.create_variable(
+                f"rain_{name}_{statistic}",
+                dimensions=(dim, "y", "x"),
+                dtype=np.int32,
+                chunks=chunks,
+                compression="lzf",
+                shuffle=True,
+            )
+            var.attrs["units"] = units
+            var.attrs["_FillValue"] = np.int32(storage.FILL_VALUE)
+            if scale_factor is not None:
+                var.attrs["scale_factor"] = scale_factor
+            if coordinates is not None:
+                var.attrs["coordinates"] = coordinates
+        count_var = dst.create_variable(
+            f"rain_{name}_count",
+            dimensions=(dim, "y", "x"),
+            dtype=np.int16,
+            chunks=chunks,
+            compression="lzf",
+            shuffle=True,
+        )
+        count_var.attrs["long_name"] = f"number of valid hours in the {dim}"
@@ -0,0 +1,279 @@
+"""Index the nested tar files downloaded by ``scrape``.
+
+Every month ``RW-YYYYMM.tar`` contains one ``RW-YYYYMMDD.tar.gz`` per day, which in
+turn contains one ``RW_YYYYMMDD-HHMM.asc`` per hour. Finding a single hour means
+scanning the month tar and inflating the whole day, so the layout of each month is
+stored next to it in ``RW-YYYYMM.tar.index.json``. The index records where each
+day member starts in the month tar and where each hour starts in the inflated day,
+and is rebuilt when the size or modification time of the month tar changes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import gzip
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import tarfile
+import tempfile
+from typing import *
+from typing.io import IO
+
+from radolan_scraper import metrics
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+class HourEntry(NamedTuple):
+    name: str
+    # Offset and size of the ascii file within the inflated day tar.
+    offset: int
+    size: int
+    time: datetime
+
+
+class DayEntry(NamedTuple):
+    name: str
+    # Offset and size of the compressed day tar within the month tar.
+    offset: int
+    size: int
+    hours: Tuple[HourEntry, ...] = ()
+
+    @property
+    def n_frames(self) -> int:
+        return len(self.hours)
+
+    @property
+    def times(self) -> List[datetime]:
+        return [hour.time for hour in self.hours]
+
+
+class MonthIndex(NamedTuple):
+    size: int
+    mtime_ns: int
+    days: Tuple[DayEntry, ...]
+
+    @property
+    def n_frames(self) -> int:
+        return sum(day.n_frames for day in self.days)
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    tar_files = sorted((base_data_dir / "raw").rglob("*.tar"))
+    indices = get_all(tar_files)
+    logger.info(f"Indexed {sum(i.n_frames for i in indices)} frames")
+
+
+def index_path(tar_file: Path) -> Path:
+    return tar_file.with_name(tar_file.name + ".index.json")
+
+
+def get(tar_file: Path) -> MonthIndex:
+    """Load the index of a month tar file, building it if necessary."""
+    month_index = load(tar_file)
+    if month_index is None:
+        month_index = build(tar_file)
+    return month_index
+
+
+def get_all(tar_files: Iterable[Path], n_workers: int = 4) -> List[MonthIndex]:
+    """Load the indices of many month tar files, building missing ones in parallel."""
+    with ProcessPoolExecutor(n_workers) as executor:
+        return list(executor.map(get, tar_files))
+
+
+def count_frames(tar_files: Iterable[Path], n_workers: int = 4) -> int:
+    return sum(month_index.n_frames for month_index in get_all(tar_files, n_workers))
+
+
+def load(tar_file: Path) -> Optional[MonthIndex]:
+    """Load the stored index, or return ``None`` if it is missing or outdated."""
+    try:
+        with open(index_path(tar_file)) as f:
+            stored = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    stat = tar_file.stat()
+    if (
+        stored.get("version") != INDEX_VERSION
+        or stored["size"] != stat.st_size
+        or stored["mtime_ns"] != stat.st_mtime_ns
+    ):
+        return None
+
+    days = tuple(
+        DayEntry(
+            day["name"],
+            day["offset"],
+            day["size"],
+            tuple(
+                HourEntry(
+                    hour["name"],
+                    hour["offset"],
+                    hour["size"],
+                    datetime.strptime(hour["time"], "%Y-%m-%dT%H:%M:%S"),
+                )
+                for hour in day["hours"]
+            ),
+        )
+        for day in stored["days"]
+    )
+    return MonthIndex(stored["size"], stored["mtime_ns"], days)
+
+
+def save(tar_file: Path, days: Sequence[DayEntry]) -> MonthIndex:
+    stat = tar_file.stat()
+    month_index = MonthIndex(stat.st_size, stat.st_mtime_ns, tuple(days))
+    stored = {
+        "version": INDEX_VERSION,
+        "size": month_index.size,
+        "mtime_ns": month_index.mtime_ns,
+        "days": [
+            {
+                "name": day.name,
+                "offset": day.offset,
+                "size": day.size,
+                "hours": [
+                    {
+                        "name": hour.name,
+                        "offset": hour.offset,
+                        "size": hour.size,
+                        "time": hour.time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    }
+                    for hour in day.hours
+                ],
+            }
+            for day in month_index.days
+        ],
+    }
+    # Write to a temporary file first, so that an interrupted write never
+    # leaves a truncated index behind. Each writer gets its own temporary file,
+    # as several processes may index the same month tar at the same time.
+    path = index_path(tar_file)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return month_index
+
+
+def build(tar_file: Path) -> MonthIndex:
+    logger.debug(f"Building index for {tar_file}")
+    return save(tar_file, [day for day, _ in iter_days(tar_file, use_index=False)])
+
+
+def list_day_members(tar_file: Path) -> List[DayEntry]:
+    """List the day members of a month tar without inflating them.
+
+    The returned entries are sorted by date and have no hours.
+    """
+    with tarfile.open(tar_file) as tf_month:
+        days = [
+            DayEntry(member.name, member.offset_data, member.size)
+            for member in tf_month
+            if member.isfile()
+        ]
+    return sorted(days, key=lambda day: day_time(day.name))
+
+
+def iter_days(
+    tar_file: Path, use_index: bool = True, after: Optional[datetime] = None
+) -> Iterator[Tuple[DayEntry, bytes]]:
+    """Yield each day of a month tar in order, together with the inflated day tar.
+
+    Without a valid index, the index is built along the way and stored once all
+    days were read, so every day is inflated only once in either case. Days that
+    have no hours later than ``after`` are skipped without inflating them.
+    """
+    month_index = load(tar_file) if use_index else None
+    if month_index is not None:
+        with open(tar_file, "rb") as raw:
+            for day in month_index.days:
+                if has_hours_after(day, after):
+                    yield day, read_day(raw, day)
+        return
+
+    days = []
+    complete = True
+    with open(tar_file, "rb") as raw:
+        for day in list_day_members(tar_file):
+            if not has_hours_after(day, after):
+                complete = False
+                continue
+            day_bytes = read_day(raw, day)
+            day = day._replace(hours=index_hours(day_bytes))
+            days.append(day)
+            yield day, day_bytes
+    if use_index and complete:
+        save(tar_file, days)
+
+
+def has_hours_after(day: DayEntry, after: Optional[datetime]) -> bool:
+    """Check if ``day`` may contain hours later than ``after``.
+
+    Days without indexed hours are judged by the date in their name.
+    """
+    if after is None:
+        return True
+    if day.hours:
+        return day.hours[-1].time > after
+    return day_time(day.name) + timedelta(days=1) > after
+
+
+def read_day(raw: IO[bytes], day: DayEntry) -> bytes:
+    """Read and inflate a single day tar from an open month tar."""
+    raw.seek(day.offset)
+    data = raw.read(day.size)
+    return inflate_day(data)
+
+
+def inflate_day(data: bytes) -> bytes:
+    day_metrics = metrics.current()
+    day_metrics.add("bytes_read", len(data))
+    with day_metrics.timer("gunzip"):
+        return gzip.decompress(data)
+
+
+def estimate_frames(tar_file: Path) -> int:
+    """Number of frames in a month tar, guessed from its days if it has no index."""
+    month_index = load(tar_file)
+    if month_index is None:
+        return 24 * len(list_day_members(tar_file))
+    return month_index.n_frames
+
+
+def index_hours(day_bytes: bytes) -> Tuple[HourEntry, ...]:
+    with tarfile.open(fileobj=io.BytesIO(day_bytes)) as day_tar_file:
+        hours = [
+            HourEntry(
+                member.name, member.offset_data, member.size, hour_time(member.name)
+            )
+            for member in day_tar_file
+            if member.isfile()
+        ]
+    return tuple(sorted(hours, key=lambda hour: hour.time))
+
+
+def hour_bytes(day_bytes: bytes, hour: HourEntry) -> bytes:
+    return day_bytes[hour.offset : hour.offset + hour.size]
+
+
+def day_time(name: str) -> datetime:
+    return datetime.strptime(name, "RW-%Y%m%d.tar.gz")
+
+
+def hour_time(name: str) -> datetime:
+    return datetime.strptime(name, "RW_%Y%m%d-%H%M.asc")
+
+
+if __name__ == "__main__":
+    main()
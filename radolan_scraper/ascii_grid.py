@@ -0,0 +1,98 @@
+"""Decode RADOLAN frames stored in the ESRI ASCII grid format.
+
+The RW product is distributed as one ``RW_YYYYMMDD-HHMM.asc`` file per hour with a
+short header followed by ``nrows`` lines of ``ncols`` integers each. Going through
+``rasterio`` costs a GDAL dataset open for every frame, so this module parses the
+header by hand and lets numpy parse the body in bulk.
+"""
+from typing import *
+
+import numpy as np
+
+
+class Header(NamedTuple):
+    ncols: int
+    nrows: int
+    xllcorner: float
+    yllcorner: float
+    cellsize: float
+    nodata_value: float
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.nrows, self.ncols
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """Bounds as (left, bottom, right, top), like ``rasterio`` reports them."""
+        return (
+            self.xllcorner,
+            self.yllcorner,
+            self.xllcorner + self.ncols * self.cellsize,
+            self.yllcorner + self.nrows * self.cellsize,
+        )
+
+
+_HEADER_FIELDS = {
+    b"ncols": "ncols",
+    b"nrows": "nrows",
+    b"xllcorner": "xllcorner",
+    b"yllcorner": "yllcorner",
+    b"cellsize": "cellsize",
+    b"nodata_value": "nodata_value",
+}
+
+
+def parse_header(data: bytes) -> Tuple[Header, int]:
+    """Parse the header of an ESRI ASCII grid.
+
+    Returns the header and the offset at which the body starts.
+    """
+    values = {}
+    offset = 0
+    while len(values) < len(_HEADER_FIELDS):
+        line_end = data.find(b"\n", offset)
+        if line_end == -1:
+            raise ValueError("Incomplete ESRI ASCII header.")
+        key, _, value = data[offset:line_end].strip().partition(b" ")
+        try:
+            field = _HEADER_FIELDS[key.lower()]
+        except KeyError:
+            raise ValueError(f"Unexpected ESRI ASCII header field {key!r}.")
+        values[field] = value.strip()
+        offset = line_end + 1
+
+    header = Header(
+        ncols=int(values["ncols"]),
+        nrows=int(values["nrows"]),
+        xllcorner=float(values["xllcorner"]),
+        yllcorner=float(values["yllcorner"]),
+        cellsize=float(values["cellsize"]),
+        nodata_value=float(values["nodata_value"]),
+    )
+    return header, offset
+
+
+def read_frame(
+    data: bytes, out: Optional[np.ndarray] = None, dtype=np.int32
+) -> Tuple[np.ndarray, Header]:
+    """Decode a single frame.
+
+    If ``out`` is given, the values are written into it and it must have the shape
+    declared in the header. Otherwise a new array of ``dtype`` is allocated.
+    """
+    header, offset = parse_header(data)
+    if out is None:
+        out = np.empty(header.shape, dtype=dtype)
+    elif out.shape != header.shape:
+        raise ValueError(
+            f"Frame of shape {header.shape} does not fit into buffer of shape {out.shape}."
+        )
+
+    values = np.fromstring(data[offset:], dtype=out.dtype, sep=" ")
+    if values.size != out.size:
+        raise ValueError(
+            f"Expected {out.size} values, but the frame contains {values.size}."
+        )
+    out[...] = values.reshape(out.shape)
+    return out, header
@@ -0,0 +1,292 @@
+"""Per pixel statistics over the full record of the combined netcdf file.
+
+The ``rain`` cube is too large to be loaded at once, so it is split into spatial
+tiles that are processed in a process pool. Each worker streams its tile in time
+blocks that are aligned to the chunks and updates per pixel accumulators:
+
+* a histogram of the values, which serves as a quantile sketch. Its bins are exact
+  for small values and grow by 2% above, so quantiles have a relative error of at
+  most 2%.
+* the number of valid hours above each threshold,
+* the longest spell of consecutive dry hours. Missing values and gaps in time end
+  a spell.
+
+The results are written back as 2-D variables, e.g. ``rain_p99`` or
+``rain_hours_above_10mm``.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import logging
+from pathlib import Path
+from typing import *
+
+import cf_units
+import h5netcdf
+import numpy as np
+
+from radolan_scraper import storage
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.95, 0.99)
+# Thresholds in mm/h.
+THRESHOLDS = (0.1, 1.0, 10.0)
+# Approximate edge length of the tiles in cells.
+TILE_SIZE = 128
+
+# Lower edges of the histogram bins in stored units. Values below 128 have their
+# own bin, larger ones share bins that are 2% wide.
+BIN_EDGES = np.unique(
+    np.concatenate(
+        [np.arange(128), np.floor(128 * 1.02 ** np.arange(1, 300)).astype(np.int64)]
+    )
+)
+BIN_EDGES = BIN_EDGES[BIN_EDGES <= np.iinfo(np.int16).max]
+
+
+class PixelStatistics:
+    """Accumulators of the statistics of a tile of pixels."""
+
+    def __init__(self, shape: Tuple[int, int], thresholds: Sequence[float]):
+        self.shape = shape
+        self.thresholds = np.asarray(thresholds)
+        self.histogram = np.zeros(shape + (len(BIN_EDGES),), dtype=np.int32)
+        self.exceedances = np.zeros((len(thresholds),) + shape, dtype=np.int32)
+        self.n_frames = 0
+        # Whether the first frame does not follow the previous period by one hour.
+        self.starts_with_gap = True
+        # Dry spells at the start and the end of the frames added so far.
+        self.leading_dry_spell = np.zeros(shape, dtype=np.int32)
+        self.dry_spell = np.zeros(shape, dtype=np.int32)
+        self.longest_dry_spell = np.zeros(shape, dtype=np.int32)
+
+    @property
+    def valid_hours(self) -> np.ndarray:
+        return self.histogram.sum(axis=-1)
+
+    def update(self, frames: np.ndarray, valid: np.ndarray, gaps: np.ndarray) -> None:
+        """Add consecutive frames. ``gaps`` marks frames that do not follow the
+        previous frame by one hour."""
+        bins = np.searchsorted(BIN_EDGES, frames[valid], side="right") - 1
+        pixels = np.broadcast_to(
+            np.arange(np.prod(self.shape)).reshape(self.shape), frames.shape
+        )[valid]
+        self.histogram += (
+            np.bincount(pixels * len(BIN_EDGES) + bins, minlength=self.histogram.size)
+            .reshape(self.histogram.shape)
+            .astype(np.int32)
+        )
+
+        for i, threshold in enumerate(self.thresholds):
+            self.exceedances[i] += ((frames > threshold) & valid).sum(axis=0)
+
+        # The dry spell at each frame is its distance to the last frame that ended
+        # a spell. Wet or missing frames end a spell at themselves, gaps just before
+        # themselves. Without such a frame in the block the spell of the previous
+        # block goes on.
+        dry = valid & (frames == 0)
+        index = np.arange(len(frames), dtype=np.int32).reshape(-1, 1, 1)
+        last_end = np.where(dry, -1 - self.dry_spell, index)
+        last_end[gaps] = np.where(dry[gaps], index[gaps] - 1, index[gaps])
+        np.maximum.accumulate(last_end, axis=0, out=last_end)
+        dry_spell = index - last_end
+        np.maximum(
+            self.longest_dry_spell, dry_spell.max(axis=0), out=self.longest_dry_spell
+        )
+        # Frames whose spell started with the first frame of all are a prefix of
+        # the block, and only extend the leading spell if it is still running.
+        is_leading = dry_spell == index + 1 + self.dry_spell
+        self.leading_dry_spell += np.where(
+            self.leading_dry_spell == self.n_frames, is_leading.sum(axis=0), 0
+        ).astype(np.int32)
+        self.dry_spell = dry_spell[-1]
+        if self.n_frames == 0:
+            self.starts_with_gap = bool(gaps[0])
+        self.n_frames += len(frames)
+
+    def merge(self, other: "PixelStatistics") -> None:
+        """Add the statistics of the frames that directly follow these frames.
+
+        The histograms and counts are added. A dry spell at the end of these frames
+        is joined with one at the start of ``other``, unless there is a gap between
+        them.
+        """
+        self.histogram += other.histogram
+        self.exceedances += other.exceedances
+
+        joins = not other.starts_with_gap
+        joined = self.dry_spell + other.leading_dry_spell if joins else 0
+        np.maximum(self.longest_dry_spell, joined, out=self.longest_dry_spell)
+        np.maximum(
+            self.longest_dry_spell, other.longest_dry_spell, out=self.longest_dry_spell
+        )
+        if joins or self.n_frames == 0:
+            self.leading_dry_spell += np.where(
+                self.leading_dry_spell == self.n_frames, other.leading_dry_spell, 0
+            ).astype(np.int32)
+        self.dry_spell = np.where(
+            joins & (other.dry_spell == other.n_frames),
+            self.dry_spell + other.n_frames,
+            other.dry_spell,
+        ).astype(np.int32)
+        if self.n_frames == 0:
+            self.starts_with_gap = other.starts_with_gap
+        self.n_frames += other.n_frames
+
+    def quantile(self, q: float) -> np.ndarray:
+        """Lower bin edge of the ``q`` quantile of each pixel, -1 without values."""
+        cumulative = self.histogram.cumsum(axis=-1)
+        total = cumulative[..., -1]
+        rank = np.ceil(q * total)[..., np.newaxis]
+        index = (cumulative < np.maximum(rank, 1)).sum(axis=-1)
+        return np.where(total > 0, BIN_EDGES[np.minimum(index, len(BIN_EDGES) - 1)], -1)
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    run(base_data_dir / "netcdf" / "combined.nc")
+
+
+def run(
+    path: Path,
+    quantiles: Sequence[float] = QUANTILES,
+    thresholds: Sequence[float] = THRESHOLDS,
+    n_workers: int = 4,
+    memory_limit: int = 512 * 1024**2,
+) -> None:
+    """Compute the statistics of ``rain`` in ``path`` and add them to ``path``.
+
+    ``memory_limit`` bounds the frames read at once by each worker.
+    """
+    with h5netcdf.File(path, "r") as f:
+        rain = f["rain"]
+        shape = rain.shape
+        chunks = rain.chunks or shape
+        scale_factor = rain.attrs.get("scale_factor")
+        time_unit = cf_units.Unit(
+            f["time"].attrs["units"], calendar=cf_units.CALENDAR_STANDARD
+        )
+        times = np.array(time_unit.num2pydate(f["time"][...]), dtype="M8[m]")
+
+    # Thresholds in the units in which the values are stored, rounded to undo the
+    # error of the float32 scale factor.
+    stored_thresholds = np.round(np.asarray(thresholds) / (scale_factor or 1), 6)
+    tiles = list(get_tiles(shape[1:], chunks[1:]))
+    logger.info(f"Computing statistics of {shape} in {len(tiles)} tiles")
+
+    results = {}
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = [
+            executor.submit(
+                compute_tile,
+                path,
+                tile,
+                times,
+                stored_thresholds,
+                quantiles,
+                memory_limit,
+            )
+            for tile in tiles
+        ]
+        for tile, future in zip(tiles, futures):
+            for name, values in future.result().items():
+                if name not in results:
+                    results[name] = np.empty(shape[1:], dtype=values.dtype)
+                results[name][tile] = values
+
+    with h5netcdf.File(path, "a") as f:
+        write_results(f, results, quantiles, thresholds, scale_factor)
+
+
+def get_tiles(
+    shape: Tuple[int, int], chunks: Tuple[int, int]
+) -> Iterator[Tuple[slice, slice]]:
+    """Split the grid into tiles made of whole chunks, about ``TILE_SIZE`` wide."""
+    tile_shape = [max(TILE_SIZE // c, 1) * c for c in chunks]
+    for y0, x0 in itertools.product(
+        range(0, shape[0], tile_shape[0]), range(0, shape[1], tile_shape[1])
+    ):
+        yield (
+            slice(y0, min(y0 + tile_shape[0], shape[0])),
+            slice(x0, min(x0 + tile_shape[1], shape[1])),
+        )
+
+
+def compute_tile(
+    path: Path,
+    tile: Tuple[slice, slice],
+    times: np.ndarray,
+    thresholds: np.ndarray,
+    quantiles: Sequence[float],
+    memory_limit: int,
+) -> Dict[str, np.ndarray]:
+    """Stream a tile through the accumulators inside a worker process."""
+    tile_shape = tuple(s.stop - s.start for s in tile)
+    gaps = np.ones(len(times), dtype=bool)
+    gaps[1:] = np.diff(times) != np.timedelta64(60, "m")
+
+    with h5netcdf.File(path, "r") as f:
+        rain = f["rain"]
+        fill_value = rain.attrs.get("_FillValue", storage.FILL_VALUE)
+        t_chunk = (rain.chunks or rain.shape)[0]
+        frame_bytes = np.prod(tile_shape) * np.dtype(rain.dtype).itemsize
+        block = max(memory_limit // frame_bytes // t_chunk, 1) * t_chunk
+
+        stats = PixelStatistics(tile_shape, thresholds)
+        for start in range(0, len(times), block):
+            end = min(start + block, len(times))
+            frames = rain[start:end, tile[0], tile[1]]
+            block_stats = PixelStatistics(tile_shape, thresholds)
+            block_stats.update(frames, frames != fill_value, gaps[start:end])
+            stats.merge(block_stats)
+
+    results = {f"p{q * 100:g}": stats.quantile(q).astype(np.int32) for q in quantiles}
+    for i in range(len(thresholds)):
+        results[f"exceedances_{i}"] = stats.exceedances[i]
+    results["longest_dry_spell"] = stats.longest_dry_spell
+    results["valid_hours"] = stats.valid_hours.astype(np.int32)
+    return results
+
+
+def write_results(
+    f: h5netcdf.File,
+    results: Dict[str, np.ndarray],
+    quantiles: Sequence[float],
+    thresholds: Sequence[float],
+    scale_factor: Optional[float],
+) -> None:
+    def write(name, data, attrs):
+        if name in f.variables:
+            var = f[name]
+            var[...] = data
+        else:
+            var = f.create_variable(name, dimensions=("y", "x"), data=data)
+        var.attrs.update(attrs)
+        if "xc" in f.variables:
+            var.attrs["coordinates"] = "yc xc"
+
+    for q in quantiles:
+        attrs = {
+            "long_name": f"{q * 100:g}th percentile of the hourly values",
+            "units": "mm/h",
+            "_FillValue": np.int32(storage.FILL_VALUE),
+        }
+        if scale_factor is not None:
+            attrs["scale_factor"] = scale_factor
+        write(f"rain_p{q * 100:g}", results[f"p{q * 100:g}"], attrs)
+    for i, threshold in enumerate(thresholds):
+        write(
+            f"rain_hours_above_{threshold:g}mm",
+            results[f"exceedances_{i}"],
+            {"long_name": f"number of hours with more than {threshold:g} mm"},
+        )
+    write(
+        "rain_longest_dry_spell",
+        results["longest_dry_spell"],
+        {"long_name": "longest spell of dry hours", "units": "hours"},
+    )
+    write(
+        "rain_valid_hours",
+        results["valid_hours"],
+        {"long_name": "number of hours with a valid value"},
+    )
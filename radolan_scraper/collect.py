@@ -2,14 +2,27 @@
 from typing import *
 from typing.io import IO
 from pathlib import Path
-import tarfile
 import rasterio
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
 import h5netcdf
 import cf_units
 from concurrent.futures import ProcessPoolExecutor
+import collections
+import contextlib
+import functools
+import io
+import json
 import logging
+import os
+
+from yarl import URL
+
+from radolan_scraper import archive_index
+from radolan_scraper import ascii_grid
+from radolan_scraper import metrics
+from radolan_scraper import scrape
+from radolan_scraper import storage
 
 logger = logging.getLogger(__name__)
 
@@ -23,111 +36,487 @@ def main():
     run(collect_to, raw_data_path)
 
 
-def run(collect_to: Path, tar_file_path: Path) -> None:
-    tar_files = sorted(list((tar_file_path).rglob("*.tar")))
-    logger.info(f"Start counting frames")
-    n_frames = get_number_of_frames(tar_files)
-    logger.info(f"Collecting {n_frames} radar frames")
-    offset = "minutes since 1970-01-01 00:00:00"
-    time_unit = cf_units.Unit(offset, calendar=cf_units.CALENDAR_STANDARD)
-    x_size = 900
-    y_size = 900
-
-    with h5netcdf.File(collect_to, "w") as f:
-        # Dimensions.
-        f.dimensions["time"] = n_frames
-        f.dimensions["x"] = x_size
-        f.dimensions["y"] = y_size
-
-        # Coordinate variables.
-        time_var = f.create_variable("time", dimensions=("time",), dtype=int)
-        time_var.attrs["units"] = time_unit.name
-
-        f.create_variable("x", dimensions=("x",), data=np.arange(x_size))
-        f.create_variable("y", dimensions=("y",), data=np.arange(y_size))
-
-        # Data variables.
-        rain_var = f.create_variable(
-            "rain",
-            dimensions=("time", "y", "x"),
-            dtype=int,
-            chunks=True,
-            compression="lzf",
+DECODERS = ("native", "rasterio")
+
+TIME_UNIT = cf_units.Unit(
+    "minutes since 1970-01-01 00:00:00", calendar=cf_units.CALENDAR_STANDARD
+)
+X_SIZE = 900
+Y_SIZE = 900
+
+
+def run(
+    collect_to: Path,
+    tar_file_path: Path,
+    decoder: str = "native",
+    n_workers: int = 1,
+    max_days_in_flight: Optional[int] = None,
+    profile: storage.StorageProfile = storage.PROFILES["legacy"],
+    append: bool = False,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> None:
+    """Collect all frames below ``tar_file_path`` into ``collect_to``.
+
+    ``tar_file_path`` is a directory of month tars or a single month tar. With
+    ``append``, an existing ``collect_to`` is extended by the frames later than
+    the last one it contains. Otherwise the frames are collected into a part file,
+    which resumes after the last checkpoint if a previous run was interrupted, see
+    ``open_for_collecting``. ``on_progress`` is called with the number of frames
+    in the file and the expected number of all frames after every day, and once
+    more at the end when both are known.
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder {decoder}, choose one of {DECODERS}.")
+    if tar_file_path.is_file():
+        tar_files = [tar_file_path]
+    else:
+        tar_files = sorted(list((tar_file_path).rglob("*.tar")))
+    logger.info(f"Collecting radar frames from {len(tar_files)} tar files")
+
+    with open_for_collecting(collect_to, profile, append) as (f, after, on_written):
+        if n_workers > 1:
+            days = collect_year_parallel(
+                tar_files, decoder, n_workers, max_days_in_flight, after
+            )
+        else:
+            days = collect_year(tar_files, decoder, after)
+
+        end = len(f["time"])
+        if on_progress is not None:
+            n_frames = sum(archive_index.estimate_frames(t) for t in tar_files)
+        for rain, time in days:
+            if time:
+                end = append_frames(f, rain, time)
+                on_written(end, time[-1])
+            if on_progress is not None:
+                on_progress(end, max(end, n_frames))
+        if on_progress is not None:
+            on_progress(end, end)
+        logger.info(f"Collected {end} radar frames")
+
+
+def run_streaming(
+    collect_to: Path,
+    year: int,
+    decoder: str = "native",
+    profile: storage.StorageProfile = storage.PROFILES["legacy"],
+    append: bool = False,
+    raw_data_path: Optional[Path] = None,
+    base_url: URL = scrape.BASE_URL,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> None:
+    """Collect the frames of ``year`` into ``collect_to`` while downloading them.
+
+    The month tars are decoded straight from the HTTP responses and are only
+    stored below ``raw_data_path`` if it is given. The days have to be stored in
+    chronological order within the month tars, as they are on the DWD server.
+    ``on_progress`` is called like in ``run``, expecting a frame for every hour
+    of the year.
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder {decoder}, choose one of {DECODERS}.")
+
+    with open_for_collecting(collect_to, profile, append) as (f, after, on_written):
+        bounding_boxes = set()
+        last_day = None
+        n_frames = 24 * (datetime(year + 1, 1, 1) - datetime(year, 1, 1)).days
+
+        def collect_member(name: str, member: IO[bytes]) -> None:
+            nonlocal last_day
+            day = archive_index.day_time(name)
+            if last_day is not None and day <= last_day:
+                raise ValueError(
+                    f"{name} is not in chronological order, "
+                    "collect from downloaded tar files instead."
+                )
+            last_day = day
+            if not archive_index.has_hours_after(
+                archive_index.DayEntry(name, 0, 0), after
+            ):
+                return
+            rain, time = collect_day(member, bounding_boxes, decoder, after)
+            if time:
+                end = append_frames(f, rain, time)
+                on_written(end, time[-1])
+                if on_progress is not None:
+                    on_progress(end, max(end, n_frames))
+
+        def has_frames_after(entry: scrape.ListingEntry) -> bool:
+            if after is None:
+                return True
+            month = datetime.strptime(entry.name, "RW-%Y%m.tar")
+            next_month = (month + timedelta(days=31)).replace(day=1)
+            return next_month > after
+
+        scrape.stream_year_in_loop(
+            year, collect_member, raw_data_path, base_url, keep=has_frames_after
         )
-        rain_var.attrs["units"] = "mm/h"
+        logger.info(f"Collected {len(f['time'])} radar frames")
+
+
+class Checkpoint(NamedTuple):
+    n_frames: int
+    # None for a file without frames.
+    last_time: Optional[datetime]
+
+
+@contextlib.contextmanager
+def open_for_collecting(
+    collect_to: Path, profile: storage.StorageProfile, append: bool
+) -> Iterator[
+    Tuple[h5netcdf.File, Optional[datetime], Callable[[int, datetime], None]]
+]:
+    """Open the file to collect frames into.
+
+    Yields the file, the time of its last frame and a function to call with the
+    number of frames and the last time after every written day, which checkpoints
+    the file. Unless an existing ``collect_to`` is appended to, the frames are
+    written to a part file. An interrupted run leaves the part file and its
+    checkpoint behind, and the next run continues after the checkpointed frames.
+    The part file is only moved to ``collect_to`` once all frames were written, so
+    ``collect_to`` never looks complete before it is.
+
+    An append writes to ``collect_to`` in place. It is checkpointed before the
+    first frame is added, and the next run drops the frames of an interrupted
+    append after its checkpoint, which may be incomplete.
+    """
+    if append and collect_to.exists():
+        checkpoint = None
+        if get_checkpoint_path(collect_to).exists():
+            checkpoint = load_checkpoint(collect_to)
+            if checkpoint is None:
+                raise ValueError(
+                    f"The checkpoint of an interrupted append to {collect_to} does "
+                    "not match its frames."
+                )
+        with h5netcdf.File(collect_to, "a") as f:
+            if checkpoint is not None:
+                logger.info(
+                    f"Dropping the frames of an interrupted append to {collect_to}"
+                )
+                f.resize_dimension("time", checkpoint.n_frames)
+            after = prepare_file(f, profile, append=True)
+            on_written = functools.partial(save_checkpoint, f, collect_to)
+            on_written(len(f["time"]), after)
+            yield f, after, on_written
+        get_checkpoint_path(collect_to).unlink()
+        return
+
+    write_to = get_part_path(collect_to)
+    checkpoint = load_checkpoint(write_to)
+    if checkpoint is None and write_to.exists():
+        logger.info(f"Discarding {write_to} without a valid checkpoint")
+    with h5netcdf.File(write_to, "a" if checkpoint else "w") as f:
+        if checkpoint is not None:
+            logger.info(f"Resuming {write_to} after {checkpoint.last_time}")
+            # Drop frames written after the checkpoint.
+            f.resize_dimension("time", checkpoint.n_frames)
+        after = prepare_file(f, profile, append=checkpoint is not None)
+        yield f, after, functools.partial(save_checkpoint, f, write_to)
+    os.replace(write_to, collect_to)
+    get_checkpoint_path(write_to).unlink()
+    # An append to an earlier version of the file can not be resumed anymore.
+    get_checkpoint_path(collect_to).unlink(missing_ok=True)
+
+
+def get_part_path(collect_to: Path) -> Path:
+    return collect_to.with_name(collect_to.name + ".part")
+
+
+def get_checkpoint_path(path: Path) -> Path:
+    return path.with_name(path.name + ".checkpoint.json")
+
+
+def load_checkpoint(path: Path) -> Optional[Checkpoint]:
+    """Load the checkpoint of a file, or ``None`` if it can not be resumed."""
+    try:
+        with open(get_checkpoint_path(path)) as f:
+            stored = json.load(f)
+        last_time = stored["last_time"]
+        checkpoint = Checkpoint(
+            stored["n_frames"],
+            None
+            if last_time is None
+            else datetime.strptime(last_time, "%Y-%m-%dT%H:%M:%S"),
+        )
+        with h5netcdf.File(path, "r") as f:
+            time = f["time"]
+            if len(time) < checkpoint.n_frames:
+                return None
+            if checkpoint.n_frames and int(time[checkpoint.n_frames - 1]) != int(
+                TIME_UNIT.date2num(checkpoint.last_time)
+            ):
+                return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return checkpoint
+
+
+def save_checkpoint(
+    f: h5netcdf.File, path: Path, n_frames: int, last_time: Optional[datetime]
+) -> None:
+    """Make the frames written to ``f`` at ``path`` durable and record them."""
+    with metrics.current().timer("checkpoint"):
+        f.flush()
+        with open(path, "rb") as raw:
+            os.fsync(raw.fileno())
+        checkpoint_path = get_checkpoint_path(path)
+        tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump(
+                {
+                    "n_frames": n_frames,
+                    "last_time": None
+                    if last_time is None
+                    else last_time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                checkpoint_file,
+            )
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_path, checkpoint_path)
+
 
-        rain_var.attrs["_FillValue"] = -1
-        start = 0
-        end = 0
-        for rain, time in collect_year(tar_files):
-            end += len(time)
-            write_to_netcdf(f, rain, time_unit.date2num(time), start, end)
-            start = end
+def prepare_file(
+    f: h5netcdf.File, profile: storage.StorageProfile, append: bool
+) -> Optional[datetime]:
+    """Create the variables of a new file, or check an existing one.
 
+    Returns the time of the last frame in an existing file.
+    """
+    if not append:
+        create_variables(f, TIME_UNIT, X_SIZE, Y_SIZE, profile)
+        return None
+    storage.check_compatible(f["rain"], profile)
+    after = get_last_time(f, TIME_UNIT)
+    logger.info(f"Appending radar frames after {after}")
+    return after
 
-def get_number_of_frames(tar_files: List[Path]) -> int:
 
-    with ProcessPoolExecutor(4) as executor:
-        tasks = executor.map(get_number_of_frames_for_single_tar_file, tar_files)
+def append_frames(
+    f: h5netcdf.File, rain: Sequence[np.ndarray], time: List[datetime]
+) -> int:
+    """Append frames to the end of ``f`` and return its new length."""
+    frame_metrics = metrics.current()
+    start = len(f["time"])
+    end = start + len(time)
+    with frame_metrics.timer("date2num"):
+        time_data = TIME_UNIT.date2num(time)
+    with frame_metrics.timer("hdf5_write"):
+        f.resize_dimension("time", end)
+        write_to_netcdf(f, rain, time_data, start, end)
+    frame_metrics.add("frames", len(time))
+    rain_var = f["rain"]
+    frame_size = int(np.prod(rain_var.shape[1:])) * rain_var.dtype.itemsize
+    # Bytes handed to HDF5 before compression, in the stored data type.
+    frame_metrics.add("bytes_written", len(time) * frame_size)
+    return end
 
-    return sum(tasks)
 
+def create_variables(
+    f: h5netcdf.File,
+    time_unit: cf_units.Unit,
+    x_size: int,
+    y_size: int,
+    profile: storage.StorageProfile,
+) -> None:
+    # Dimensions. Time is unlimited and grows with every collected day,
+    # so the archives only need to be decompressed once.
+    f.dimensions["time"] = None
+    f.dimensions["x"] = x_size
+    f.dimensions["y"] = y_size
+
+    # Coordinate variables.
+    time_var = f.create_variable("time", dimensions=("time",), dtype=int)
+    time_var.attrs["units"] = time_unit.name
 
-def get_number_of_frames_for_single_tar_file(tar_file: Path) -> int:
-    n_frames = 0
-    with tarfile.open(tar_file) as tf_month:
-        for day_member in tf_month:
-            member = tf_month.extractfile(day_member)
-            with tarfile.open(mode="r:gz", fileobj=member) as day_tar_file:
-                n_frames += len(day_tar_file.getmembers())
+    f.create_variable("x", dimensions=("x",), data=np.arange(x_size))
+    f.create_variable("y", dimensions=("y",), data=np.arange(y_size))
 
-    return n_frames
+    # Data variables.
+    storage.create_rain_variable(f, profile)
+
+
+def get_last_time(f: h5netcdf.File, time_unit: cf_units.Unit) -> Optional[datetime]:
+    """Return the last timestamp stored in ``f``, if any."""
+    if f["time"]._h5ds.maxshape[0] is not None:
+        raise ValueError(
+            "Can not append, the time dimension of the file is not unlimited."
+        )
+    n_frames = len(f["time"])
+    if n_frames == 0:
+        return None
+    last_time = time_unit.num2date(int(f["time"][n_frames - 1]))
+    return datetime(*last_time.timetuple()[:6])
 
 
 def collect_year(
-    tar_files: List[Path]
-) -> Generator[Tuple[List[np.ndarray], List[datetime]], None, None]:
+    tar_files: List[Path], decoder: str = "native", after: Optional[datetime] = None
+) -> Generator[Tuple[Sequence[np.ndarray], List[datetime]], None, None]:
+    """Decode the days in timestamp order, skipping frames up to ``after``."""
     # Helper to check that all rasters have the same bounding box
     # and the same mask.
     bounding_boxes = set()
     for tar_file_path in tar_files:
-        with tarfile.open(tar_file_path) as tf_month:
-            day_members = sorted(
-                tf_month.getnames(),
-                key=lambda x: datetime.strptime(x, "RW-%Y%m%d.tar.gz"),
-            )
-            for day_member in day_members:
-                member = tf_month.extractfile(day_member)
-                if member is not None:
-                    yield collect_day(member, bounding_boxes)
-                else:
-                    raise RuntimeError()
+        for day, day_bytes in archive_index.iter_days(tar_file_path, after=after):
+            hours = hours_after(day.hours, after)
+            yield decode_day(day_bytes, hours, bounding_boxes, decoder)
+
+
+def collect_year_parallel(
+    tar_files: List[Path],
+    decoder: str = "native",
+    n_workers: int = 4,
+    max_days_in_flight: Optional[int] = None,
+    after: Optional[datetime] = None,
+) -> Generator[Tuple[Sequence[np.ndarray], List[datetime]], None, None]:
+    """Decode the days in a process pool and yield them in timestamp order.
+
+    At most ``max_days_in_flight`` decoded days are held in memory at any time,
+    so a slow writer blocks the workers instead of piling up frames.
+    """
+    if max_days_in_flight is None:
+        max_days_in_flight = 2 * n_workers
+    if max_days_in_flight < 1:
+        raise ValueError("At least one day has to be allowed in flight.")
+
+    bounding_boxes = set()
+    # Days of months without a valid index, collected to store their index.
+    unindexed_days = {}
+
+    def merge_next():
+        tar_file_path, is_last_day, future = in_flight.popleft()
+        arrs, times, day, day_bounding_boxes, day_metrics = future.result()
+        metrics.current().merge(day_metrics)
+        bounding_boxes.update(day_bounding_boxes)
+        assert len(bounding_boxes) <= 1, "Non matching bounding boxes."
+        if tar_file_path in unindexed_days:
+            unindexed_days[tar_file_path].append(day)
+            if is_last_day:
+                archive_index.save(tar_file_path, unindexed_days.pop(tar_file_path))
+        return arrs, times
+
+    with ProcessPoolExecutor(n_workers) as executor:
+        in_flight = collections.deque()
+        for tar_file_path in tar_files:
+            month_index = archive_index.load(tar_file_path)
+            if month_index is None:
+                days = archive_index.list_day_members(tar_file_path)
+            else:
+                days = month_index.days
+            all_days = len(days)
+            days = [day for day in days if archive_index.has_hours_after(day, after)]
+            if month_index is None and len(days) == all_days:
+                unindexed_days[tar_file_path] = []
+            for i, day in enumerate(days):
+                if len(in_flight) == max_days_in_flight:
+                    yield merge_next()
+                future = executor.submit(
+                    collect_day_from_tar, tar_file_path, day, decoder, after
+                )
+                in_flight.append((tar_file_path, i == len(days) - 1, future))
+        while in_flight:
+            yield merge_next()
+
+
+def collect_day_from_tar(
+    tar_file_path: Path,
+    day: archive_index.DayEntry,
+    decoder: str = "native",
+    after: Optional[datetime] = None,
+) -> Tuple[
+    Sequence[np.ndarray], List[datetime], archive_index.DayEntry, set, Dict[str, Any]
+]:
+    """Decode a single day of a month tar file inside a worker process.
+
+    Besides the decoded day, the index entry of the day is returned, with its
+    hours filled in if they were not known yet, and the metrics of decoding it.
+    """
+    day_metrics = metrics.reset()
+    bounding_boxes = set()
+    with open(tar_file_path, "rb") as raw:
+        day_bytes = archive_index.read_day(raw, day)
+    if not day.hours:
+        day = day._replace(hours=archive_index.index_hours(day_bytes))
+    hours = hours_after(day.hours, after)
+    arrs, times = decode_day(day_bytes, hours, bounding_boxes, decoder)
+    return arrs, times, day, bounding_boxes, day_metrics.snapshot()
+
+
+def hours_after(
+    hours: Sequence[archive_index.HourEntry], after: Optional[datetime]
+) -> Sequence[archive_index.HourEntry]:
+    if after is None:
+        return hours
+    return [hour for hour in hours if hour.time > after]
 
 
 def collect_day(
-    member: IO[bytes], bounding_boxes: set
-) -> Tuple[List[np.ndarray], List[datetime]]:
+    member: IO[bytes],
+    bounding_boxes: set,
+    decoder: str = "native",
+    after: Optional[datetime] = None,
+) -> Tuple[Sequence[np.ndarray], List[datetime]]:
+    day_bytes = archive_index.inflate_day(member.read())
+    hours = hours_after(archive_index.index_hours(day_bytes), after)
+    return decode_day(day_bytes, hours, bounding_boxes, decoder)
+
+
+def decode_day(
+    day_bytes: bytes,
+    hours: Sequence[archive_index.HourEntry],
+    bounding_boxes: set,
+    decoder: str = "native",
+) -> Tuple[Sequence[np.ndarray], List[datetime]]:
+    """Decode the hours of an inflated day tar, given their index entries."""
+    if decoder == "native":
+        return decode_day_native(day_bytes, hours, bounding_boxes)
+
+    day_metrics = metrics.current()
     arrs = []
     times = []
-    with tarfile.open(mode="r:gz", fileobj=member) as day_tar_file:
-        hour_members = sorted(
-            day_tar_file.getnames(),
-            key=lambda x: datetime.strptime(x, "RW_%Y%m%d-%H%M.asc"),
-        )
-
-        for hour_asc_file_name in hour_members:
-            timestamp = datetime.strptime(hour_asc_file_name, "RW_%Y%m%d-%H%M.asc")
-            logger.debug(f"Collecting frame at from {timestamp}")
-            times.append(timestamp)
-            hour_member = day_tar_file.getmember(hour_asc_file_name)
-            with rasterio.open(day_tar_file.extractfile(hour_member)) as raster:
+    for hour in hours:
+        logger.debug(f"Collecting frame at from {hour.time}")
+        times.append(hour.time)
+        data = archive_index.hour_bytes(day_bytes, hour)
+        with rasterio.open(io.BytesIO(data)) as raster:
+            with day_metrics.timer("check_bounding_box"):
                 check_bounding_box(bounding_boxes, raster.bounds)
+            with day_metrics.timer("decode"):
                 arr = raster.read(1)
-                arrs.append(arr)
+            arrs.append(arr)
+
+    return arrs, times
+
 
+def decode_day_native(
+    day_bytes: bytes, hours: Sequence[archive_index.HourEntry], headers: set
+) -> Tuple[Sequence[np.ndarray], List[datetime]]:
+    day_metrics = metrics.current()
+    arrs = None
+    times = []
+    for i, hour in enumerate(hours):
+        logger.debug(f"Collecting frame at from {hour.time}")
+        times.append(hour.time)
+        data = archive_index.hour_bytes(day_bytes, hour)
+        if arrs is None:
+            header, _ = ascii_grid.parse_header(data)
+            arrs = np.empty((len(hours),) + header.shape, dtype=np.int32)
+        with day_metrics.timer("decode"):
+            _, header = ascii_grid.read_frame(data, out=arrs[i])
+        with day_metrics.timer("check_bounding_box"):
+            check_header(headers, header)
+
+    if arrs is None:
+        return [], times
     return arrs, times
 
 
+def check_header(headers: Set[ascii_grid.Header], header: ascii_grid.Header) -> None:
+    headers.add(header)
+    assert len(headers) == 1, "Non matching bounding boxes."
+
+
 def check_bounding_box(
     bboxes: Set[rasterio.coords.BoundingBox], bbox: rasterio.coords.BoundingBox
 ) -> None:
@@ -4,11 +4,18 @@ from typing.io import IO
 from pathlib import Path
 import numpy as np
 import h5netcdf
+import h5py
 import cf_units
 import logging
+import os
+
+from radolan_scraper import metrics
+from radolan_scraper import storage
 
 logger = logging.getLogger(__name__)
 
+COMBINE_MODES = ("copy", "virtual")
+
 
 def main():
     base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
@@ -18,42 +25,158 @@ def main():
     run(collect_to, files_to_combine)
 
 
-def run(combine_to: Path, files_to_combine: Iterable[Path]) -> None:
+def run(
+    combine_to: Path,
+    files_to_combine: Iterable[Path],
+    profile: storage.StorageProfile = storage.PROFILES["legacy"],
+    mode: str = "copy",
+    append: bool = False,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> None:
+    """Combine the yearly files into ``combine_to``.
+
+    With ``append``, an existing ``combine_to`` is only extended by the frames
+    later than the last one it contains. Frames that are already contained are
+    skipped in any case, so overlapping files are combined correctly.
+    ``on_progress`` is called with the number of frames in ``combine_to`` and the
+    number of frames in all yearly files after every yearly file.
+    """
+    if mode not in COMBINE_MODES:
+        raise ValueError(f"Unknown mode {mode}, choose one of {COMBINE_MODES}.")
+    files_to_combine = list(files_to_combine)
+    if mode == "virtual":
+        # Mapping the files is cheap, so the virtual file is always rewritten.
+        run_virtual(combine_to, files_to_combine, profile)
+        return
+
     total_shape = get_shape(files_to_combine)
-    logger.info(f"Creating a dataset of shape {total_shape}")
+    # Using the chunks of the yearly files allows to copy chunks without
+    # decompressing them.
+    chunks = get_chunks(files_to_combine)
     offset = "minutes since 1970-01-01 00:00:00"
     time_unit = cf_units.Unit(offset, calendar=cf_units.CALENDAR_STANDARD)
-    x_size = total_shape[1]
-    y_size = total_shape[2]
-    with h5netcdf.File(combine_to, "w") as f:
-        # Dimensions.
-        f.dimensions["time"] = total_shape[0]
-        f.dimensions["y"] = y_size
-        f.dimensions["x"] = x_size
-
-        # Coordinate variables.
-        time_var = f.create_variable("time", dimensions=("time",), dtype=int)
-        time_var.attrs["units"] = time_unit.name
-
-        f.create_variable("x", dimensions=("x",), data=np.arange(x_size))
-        f.create_variable("y", dimensions=("y",), data=np.arange(y_size))
-
-        # Data variables.
-        rain_var = f.create_variable(
-            "rain", dimensions=("time", "y", "x"), dtype=int, compression="lzf"
-        )
-        rain_var.attrs["units"] = "mm/h"
-        rain_var.attrs["_FillValue"] = -1
+    y_size = total_shape[1]
+    x_size = total_shape[2]
+    append = append and combine_to.exists()
+    with h5netcdf.File(combine_to, "a" if append else "w") as f:
+        if append:
+            storage.check_compatible(f["rain"], profile)
+            if f["time"]._h5ds.maxshape[0] is not None:
+                raise ValueError(
+                    f"Can not append to {combine_to}, its time dimension is "
+                    "not unlimited."
+                )
+        else:
+            logger.info(
+                f"Creating a dataset of shape {total_shape} with chunks {chunks}"
+            )
+            # Dimensions. Time is unlimited, so that new data can be appended.
+            f.dimensions["time"] = None
+            f.dimensions["y"] = y_size
+            f.dimensions["x"] = x_size
+
+            # Coordinate variables.
+            time_var = f.create_variable("time", dimensions=("time",), dtype=int)
+            time_var.attrs["units"] = time_unit.name
+
+            f.create_variable("x", dimensions=("x",), data=np.arange(x_size))
+            f.create_variable("y", dimensions=("y",), data=np.arange(y_size))
+
+            # Data variables.
+            storage.create_rain_variable(f, profile, chunks=chunks)
 
-        start = 0
-        end = 0
+        combine_metrics = metrics.current()
+        start = len(f["time"])
+        last_time = f["time"][start - 1] if start > 0 else None
         for year_netcdf in files_to_combine:
+            if on_progress is not None:
+                on_progress(start, max(start, total_shape[0]))
             logger.info(f"Processing {year_netcdf}")
             with h5netcdf.File(year_netcdf, "r") as year_netcdf_file:
-                end += len(year_netcdf_file["time"])
-                logger.info(f"Writing to [{start}:{end}]")
-                write_to_netcdf(f, year_netcdf_file, start, end)
+                storage.check_compatible(year_netcdf_file["rain"], profile)
+                year_time = year_netcdf_file["time"][...]
+                # Skip the frames up to the last one already written.
+                first = 0
+                if last_time is not None:
+                    first = int(np.searchsorted(year_time, last_time, side="right"))
+                if first == len(year_time):
+                    logger.info(f"No new frames in {year_netcdf}")
+                    continue
+                end = start + len(year_time) - first
+                logger.info(f"Writing [{first}:] to [{start}:{end}]")
+                with combine_metrics.timer("hdf5_copy"):
+                    f.resize_dimension("time", end)
+                    write_to_netcdf(f, year_netcdf_file, start, end, first)
+                combine_metrics.add("frames", end - start)
+                combine_metrics.add("bytes_read", year_netcdf.stat().st_size)
                 start = end
+                last_time = year_time[-1]
+        if on_progress is not None:
+            on_progress(start, max(start, total_shape[0]))
+
+
+def run_virtual(
+    combine_to: Path,
+    files_to_combine: List[Path],
+    profile: storage.StorageProfile = storage.PROFILES["legacy"],
+) -> None:
+    """Combine the files as HDF5 virtual datasets instead of copying the data.
+
+    ``time`` and ``rain`` of the combined file map onto the variables of the yearly
+    files, which are referenced relative to ``combine_to`` and thus have to be
+    kept next to it.
+    """
+    total_shape = get_shape(files_to_combine)
+    logger.info(f"Creating a virtual dataset of shape {total_shape}")
+    time_layout = None
+    rain_layout = None
+    start = 0
+    end = 0
+    for year_netcdf in files_to_combine:
+        with h5netcdf.File(year_netcdf, "r") as year_netcdf_file:
+            year_time_var = year_netcdf_file["time"]
+            year_rain_var = year_netcdf_file["rain"]
+            storage.check_compatible(year_rain_var, profile)
+            if rain_layout is None:
+                time_layout = h5py.VirtualLayout(
+                    shape=(total_shape[0],), dtype=year_time_var.dtype
+                )
+                rain_layout = h5py.VirtualLayout(
+                    shape=total_shape, dtype=year_rain_var.dtype
+                )
+                time_attrs = dict(year_time_var.attrs)
+                rain_attrs = dict(year_rain_var.attrs)
+            elif year_rain_var.dtype != rain_layout.dtype:
+                raise ValueError(f"{year_netcdf} stores rain as {year_rain_var.dtype}.")
+
+            end += year_rain_var.shape[0]
+            logger.info(f"Mapping {year_netcdf} to [{start}:{end}]")
+            source_name = os.path.relpath(year_netcdf, combine_to.parent)
+            time_layout[start:end] = h5py.VirtualSource(
+                source_name, "time", shape=year_time_var.shape
+            )
+            rain_layout[start:end] = h5py.VirtualSource(
+                source_name, "rain", shape=year_rain_var.shape
+            )
+            start = end
+
+    # Virtual datasets need at least the HDF5 1.10 file format.
+    with h5py.File(combine_to, "w", libver="latest") as f:
+        time_var = f.create_virtual_dataset("time", time_layout)
+        rain_var = f.create_virtual_dataset(
+            "rain", rain_layout, fillvalue=storage.FILL_VALUE
+        )
+        y_var = f.create_dataset("y", data=np.arange(total_shape[1]))
+        x_var = f.create_dataset("x", data=np.arange(total_shape[2]))
+
+        # Dimension scales make the datasets netcdf dimensions and variables.
+        dims = [("time", time_var), ("y", y_var), ("x", x_var)]
+        for i, (name, dim_var) in enumerate(dims):
+            dim_var.make_scale(name)
+            rain_var.dims[i].attach_scale(dim_var)
+
+        time_var.attrs.update(time_attrs)
+        rain_var.attrs.update(rain_attrs)
 
 
 def get_shape(files_to_combine: Iterable[Path]) -> Tuple[int, int, int]:
@@ -63,25 +186,95 @@ def get_shape(files_to_combine: Iterable[Path]) -> Tuple[int, int, int]:
             shapes.append(year_netcdf_file["rain"].shape)
 
     shapes_arr = np.array(shapes)
-    assert np.equal.reduce(shapes_arr[:, 1]), "Not all data have equal sizes in y"
-    assert np.equal.reduce(shapes_arr[:, 2]), "Not all data have equal sizes in x"
+    y_sizes, x_sizes = shapes_arr[:, 1], shapes_arr[:, 2]
+    assert (y_sizes == y_sizes[0]).all(), "Not all data have equal sizes in y"
+    assert (x_sizes == x_sizes[0]).all(), "Not all data have equal sizes in x"
     time_size = shapes_arr[:, 0].sum()
     return (time_size, shapes_arr[0, 1], shapes_arr[0, 2])
 
 
+def get_chunks(files_to_combine: Iterable[Path]) -> Optional[Tuple[int, int, int]]:
+    """Return the chunk shape shared by all files, or ``None`` if they differ."""
+    chunks = set()
+    for year_netcdf in files_to_combine:
+        with h5netcdf.File(year_netcdf, "r") as year_netcdf_file:
+            chunks.add(year_netcdf_file["rain"].chunks)
+
+    if len(chunks) == 1:
+        return chunks.pop()
+    return None
+
+
 def write_to_netcdf(
-    f: h5netcdf.File, year_netcdf_file: h5netcdf.File, start: int, end: int
+    f: h5netcdf.File,
+    year_netcdf_file: h5netcdf.File,
+    start: int,
+    end: int,
+    first: int = 0,
+) -> None:
+    """Write the frames of ``year_netcdf_file`` from ``first`` on to ``[start:end]``."""
+    # Coordinate variables.
+    f["time"][start:end] = year_netcdf_file["time"][first:]
+    # Data variables.
+    dst = f["rain"]._h5ds
+    src = year_netcdf_file["rain"]._h5ds
+    if can_copy_chunks(src, dst, start, first):
+        logger.debug("Copying compressed chunks")
+        copy_chunks(src, dst, start, first)
+    else:
+        logger.debug("Copying decompressed blocks")
+        copy_blocks(src, dst, start, end, first)
+
+
+def can_copy_chunks(
+    src: h5py.Dataset, dst: h5py.Dataset, start: int, first: int = 0
+) -> bool:
+    """Check if the stored chunks of ``src`` can be used as they are in ``dst``."""
+    return (
+        src.chunks is not None
+        and src.chunks == dst.chunks
+        and src.dtype == dst.dtype
+        and src.shape[1:] == dst.shape[1:]
+        and start % dst.chunks[0] == 0
+        and first % src.chunks[0] == 0
+        and get_filters(src) == get_filters(dst)
+    )
+
+
+def get_filters(dataset: h5py.Dataset) -> List[Tuple[int, Tuple[int, ...]]]:
+    plist = dataset.id.get_create_plist()
+    filters = []
+    for i in range(plist.get_nfilters()):
+        code, _, values, _ = plist.get_filter(i)
+        filters.append((code, tuple(values)))
+    return filters
+
+
+def copy_chunks(
+    src: h5py.Dataset, dst: h5py.Dataset, start: int, first: int = 0
+) -> None:
+    """Copy the compressed chunks of ``src`` from ``first`` on byte by byte to ``dst``."""
+    for i in range(src.id.get_num_chunks()):
+        chunk_offset = src.id.get_chunk_info(i).chunk_offset
+        if chunk_offset[0] < first:
+            continue
+        filter_mask, data = src.id.read_direct_chunk(chunk_offset)
+        dst_offset = (chunk_offset[0] - first + start,) + tuple(chunk_offset[1:])
+        dst.id.write_direct_chunk(dst_offset, data, filter_mask)
+
+
+def copy_blocks(
+    src: h5py.Dataset, dst: h5py.Dataset, start: int, end: int, first: int = 0
 ) -> None:
-    n_frames = len(year_netcdf_file["time"])
-    chunk_size = 100
-    n_chunks = n_frames // chunk_size
-    chunks = np.linspace(0, n_frames, n_chunks, dtype=int)
-    for left, right in zip(chunks[:-1], chunks[1:]):
-        logger.debug(f"Processing chunk [{left}:{right}]")
-        # Coordinate variables.
-        f["time"][start + left : start + right] = year_netcdf_file["time"][left:right]
-        # Data variables.
-        f["rain"][start + left : start + right] = year_netcdf_file["rain"][left:right]
+    """Copy ``src[first:]`` to ``dst[start:end]`` in blocks aligned to ``dst`` chunks."""
+    chunk_size = dst.chunks[0] if dst.chunks is not None else 1
+    block_size = max(1, 100 // chunk_size) * chunk_size
+    left = start
+    while left < end:
+        right = min((left // block_size + 1) * block_size, end)
+        logger.debug(f"Processing block [{left}:{right}]")
+        dst[left:right] = src[left - start + first : right - start + first]
+        left = right
 
 
 if __name__ == "__main__":
@@ -3,56 +3,73 @@
 Can be dangerous, because it creates an a very high number of files. 
 Prefer ``collect`` to combine the data into a single file.
 """
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import re
-import tarfile
+from typing import *
 
 from tqdm import tqdm
 
+from radolan_scraper import archive_index
+
 
 def main():
     base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
     extract_to = base_data_dir / "extracted"
     raw_data = base_data_dir / "raw"
-    tar_files = raw_data.rglob("*.tar")
-
-    run_with_progress(lambda x: extract_month(extract_to, x), tar_files)
-    clean_up(extract_to)
+    tar_files = list(raw_data.rglob("*.tar"))
 
-
-def run_with_progress(f, items_to_process):
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        results = list(
-            tqdm(executor.map(f, items_to_process), total=len(items_to_process))
+    with tqdm(total=len(tar_files)) as progress_bar:
+        run(
+            extract_to,
+            tar_files,
+            on_progress=lambda n_done, n_months: progress_bar.update(1),
         )
-    return results
 
 
-def extract_month(extract_to: Path, filepath: Path):
+def run(
+    extract_to: Path,
+    tar_files: Sequence[Path],
+    n_workers: int = 4,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """Extract the month tars in a process pool, one month per task.
+
+    ``on_progress`` is called with the number of finished and of all months
+    whenever a month is done. Returns the number of extracted files.
+    """
+    n_files = 0
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = [
+            executor.submit(extract_month, extract_to, tar_file)
+            for tar_file in tar_files
+        ]
+        for i, future in enumerate(as_completed(futures)):
+            n_files += future.result()
+            if on_progress is not None:
+                on_progress(i + 1, len(futures))
+    return n_files
+
+
+def extract_month(extract_to: Path, filepath: Path) -> int:
+    """Write the hours of a month tar to ``extract_to/MM/DD/``.
+
+    The day members are inflated in memory, so no intermediate ``.tar.gz`` files
+    are written. Returns the number of extracted files.
+    """
     month = re.match(r"RW-20\d\d(\d\d).tar", filepath.name).groups(0)[0]
     new_dir = extract_to / month
-    new_dir.mkdir(parents=True, exist_ok=True)
-
-    with tarfile.open(filepath) as tf:
-        tf.extractall(new_dir)
-
-    extract_days(new_dir)
-
-
-def clean_up(dir_path: Path):
-    for file_path in dir_path.rglob("*.tar.gz"):
-        file_path.unlink()
-
 
-def extract_days(dir_path: Path):
-    tar_files = dir_path.rglob("*.tar.gz")
-    for tar_file in tar_files:
-        day = re.match(r"RW-20\d\d\d\d(\d\d).tar.gz", tar_file.name).groups(0)[0]
-        new_dir = new_dir = tar_file.parent / day
-        new_dir.mkdir(parents=True, exist_ok=True)
-        with tarfile.open(tar_file, "r:gz") as tf:
-            tf.extractall(new_dir)
+    n_files = 0
+    for day, day_bytes in archive_index.iter_days(filepath):
+        day_number = re.match(r"RW-20\d\d\d\d(\d\d).tar.gz", day.name).groups(0)[0]
+        day_dir = new_dir / day_number
+        day_dir.mkdir(parents=True, exist_ok=True)
+        for hour in day.hours:
+            with open(day_dir / hour.name, "wb") as f:
+                f.write(archive_index.hour_bytes(day_bytes, hour))
+        n_files += len(day.hours)
+    return n_files
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+"""Store decoded frames as plain arrays that can be memory mapped.
+
+The ascii files written by ``extract`` have to be parsed again on every read and the
+netcdf files have to be decompressed. A frame store instead keeps the frames of a
+year in a single ``.npy`` file of shape ``(n_frames, 900, 900)`` with 16 bit
+integers in tenths of a millimeter, next to a ``.times.npy`` file with the time of
+each frame. ``load`` maps the frames into memory, so slicing single hours only
+reads the bytes of those hours from disk.
+"""
+from datetime import datetime
+import io
+import logging
+import os
+from pathlib import Path
+from typing import *
+
+import numpy as np
+
+from radolan_scraper import collect
+
+logger = logging.getLogger(__name__)
+
+DTYPE = np.int16
+
+
+class FrameStore(NamedTuple):
+    frames: np.ndarray
+    times: np.ndarray
+
+    def index_of(self, time: datetime) -> int:
+        """Index of the frame at ``time``, raising ``KeyError`` if there is none."""
+        i = int(np.searchsorted(self.times, np.datetime64(time, "m")))
+        if i == len(self.times) or self.times[i] != np.datetime64(time, "m"):
+            raise KeyError(f"No frame at {time}.")
+        return i
+
+    def frame_at(self, time: datetime) -> np.ndarray:
+        return self.frames[self.index_of(time)]
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    year = "2016"
+    store_to = base_data_dir / "frames" / f"{year}.npy"
+    store_to.parent.mkdir(parents=True, exist_ok=True)
+    write(store_to, sorted((base_data_dir / "raw" / year).rglob("*.tar")))
+
+
+def times_path(store_path: Path) -> Path:
+    return store_path.with_suffix(".times.npy")
+
+
+def write(
+    store_to: Path,
+    tar_files: Sequence[Path],
+    decoder: str = "native",
+    n_workers: int = 1,
+) -> int:
+    """Decode all frames of ``tar_files`` into a frame store at ``store_to``.
+
+    The frames are appended to the file as the days are decoded, so every day is
+    inflated only once, even for month tars without an index. The ``.npy`` header
+    is written last, once the number of frames is known. Returns the number of
+    stored frames.
+    """
+    tar_files = sorted(tar_files)
+    logger.info(f"Storing the frames of {len(tar_files)} tar files in {store_to}")
+    if n_workers > 1:
+        days = collect.collect_year_parallel(tar_files, decoder, n_workers)
+    else:
+        days = collect.collect_year(tar_files, decoder)
+
+    # Write to temporary files first, so that an interrupted run never leaves a
+    # store with missing frames behind.
+    tmp_store = store_to.with_name(store_to.name + ".tmp")
+    tmp_times = store_to.with_name(times_path(store_to).name + ".tmp")
+    header_size = len(get_header(2**40))
+    times = []
+    try:
+        with open(tmp_store, "wb") as f:
+            f.seek(header_size)
+            for rain, time in days:
+                if time:
+                    f.write(to_stored(np.asarray(rain)).data)
+                    times.extend(time)
+            header = get_header(len(times))
+            if len(header) != header_size:
+                raise ValueError(f"The header for {len(times)} frames does not fit.")
+            f.seek(0)
+            f.write(header)
+    except BaseException:
+        tmp_store.unlink()
+        raise
+
+    with open(tmp_times, "wb") as f:
+        np.save(f, np.array(times, dtype="datetime64[m]"))
+    os.replace(tmp_times, times_path(store_to))
+    os.replace(tmp_store, store_to)
+    return len(times)
+
+
+def get_header(n_frames: int) -> bytes:
+    """The ``.npy`` header of a store with ``n_frames`` frames.
+
+    The header is padded to a multiple of 64 bytes, which is the same for any
+    realistic number of frames, so the space for it can be reserved up front.
+    """
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header,
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(DTYPE)),
+            "fortran_order": False,
+            "shape": (n_frames, collect.Y_SIZE, collect.X_SIZE),
+        },
+    )
+    return header.getvalue()
+
+
+def to_stored(rain: np.ndarray) -> np.ndarray:
+    """Convert decoded frames to ``DTYPE``, which holds every valid RW value.
+
+    RW values are at most 4095 tenths of a millimeter and missing cells are -1, so
+    anything outside of ``DTYPE`` is a decoding error rather than rain. The frames
+    must have the shape written into the header by ``get_header``.
+    """
+    if rain.shape[1:] != (collect.Y_SIZE, collect.X_SIZE):
+        raise ValueError(
+            f"Frames of shape {rain.shape[1:]} do not match the store, which holds "
+            f"frames of {(collect.Y_SIZE, collect.X_SIZE)}."
+        )
+    info = np.iinfo(DTYPE)
+    if rain.size and (rain.min() < info.min or rain.max() > info.max):
+        raise ValueError(
+            f"Frames with values from {rain.min()} to {rain.max()} do not fit "
+            f"into {np.dtype(DTYPE)}."
+        )
+    return np.ascontiguousarray(rain, dtype=DTYPE)
+
+
+def load(store_path: Path) -> FrameStore:
+    """Map the frames of a store into memory, without reading them."""
+    return FrameStore(
+        frames=np.load(store_path, mmap_mode="r"), times=np.load(times_path(store_path))
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Measure where the time of a stage goes.
+
+The stage modules time their steps, like inflating the day tars or writing to HDF5,
+and count frames and bytes in the ``Metrics`` of the current process, see
+``current``. Worker processes send a ``snapshot`` of their metrics back with their
+results, which is merged into the metrics of the parent. At the end of a task, the
+metrics are written as JSON and in the Prometheus text format, which the node
+exporter can pick up from its textfile directory.
+"""
+import collections
+import contextlib
+import json
+import os
+from pathlib import Path
+import resource
+import time
+from typing import *
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = collections.Counter()
+        self.counts = collections.Counter()
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def add(self, name: str, value: int = 1) -> None:
+        self.counts[name] += value
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add the timers and counts of a snapshot taken in another process."""
+        self.seconds.update(snapshot["seconds"])
+        self.counts.update(snapshot["counts"])
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "elapsed_seconds": self.elapsed,
+            "peak_rss_bytes": get_peak_rss(),
+            "seconds": dict(self.seconds),
+            "counts": dict(self.counts),
+        }
+
+    def summary(self) -> str:
+        """Describe the throughput and the largest timers in a single line."""
+        elapsed = self.elapsed
+        parts = [f"{self.counts['frames'] / elapsed:.1f} frames/s"]
+        for name, seconds in self.seconds.most_common(3):
+            parts.append(f"{name} {seconds:.0f}s")
+        parts.append(f"peak RSS {get_peak_rss() / 1024**2:.0f} MB")
+        return ", ".join(parts)
+
+
+_current = Metrics()
+
+
+def current() -> Metrics:
+    return _current
+
+
+def reset() -> Metrics:
+    """Start measuring from scratch, e.g. at the start of a task or a worker job."""
+    global _current
+    _current = Metrics()
+    return _current
+
+
+def get_peak_rss() -> int:
+    """Peak resident memory in bytes of this process or any finished child."""
+    # ru_maxrss is given in kilobytes on Linux.
+    return 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def write_json(path: Path, snapshot: Dict[str, Any]) -> None:
+    write_atomically(path, json.dumps(snapshot, indent=2))
+
+
+def write_prometheus(path: Path, snapshot: Dict[str, Any], task: str) -> None:
+    """Write ``snapshot`` in the Prometheus text format with a ``task`` label."""
+    label = f'{{task="{task}"}}'
+    lines = [
+        "# TYPE radolan_task_elapsed_seconds gauge",
+        f"radolan_task_elapsed_seconds{label} {snapshot['elapsed_seconds']}",
+        "# TYPE radolan_task_peak_rss_bytes gauge",
+        f"radolan_task_peak_rss_bytes{label} {snapshot['peak_rss_bytes']}",
+        "# TYPE radolan_task_step_seconds gauge",
+    ]
+    for name, seconds in sorted(snapshot["seconds"].items()):
+        lines.append(
+            f'radolan_task_step_seconds{{task="{task}",step="{name}"}} {seconds}'
+        )
+    for name, count in sorted(snapshot["counts"].items()):
+        lines.append(f"# TYPE radolan_task_{name}_total counter")
+        lines.append(f"radolan_task_{name}_total{label} {count}")
+    write_atomically(path, "\n".join(lines) + "\n")
+
+
+def write_atomically(path: Path, text: str) -> None:
+    # The node exporter may read the file at any time, so it must never see a
+    # partially written one.
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
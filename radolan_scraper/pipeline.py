@@ -1,20 +1,30 @@
-from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
+import argparse
+import cProfile
+from datetime import date
+import functools
 import logging
 import logging.config
 import os
 from pathlib import Path
+from typing import *
 
 import luigi
 import yaml
 from dotenv import load_dotenv
-
-import add_coordinate_grid
-import collect
-import combine
-import extract
-import logging_example
-import scrape
+from yarl import URL
+
+from radolan_scraper import add_coordinate_grid
+from radolan_scraper import aggregate
+from radolan_scraper import climatology
+from radolan_scraper import collect
+from radolan_scraper import combine
+from radolan_scraper import extract
+from radolan_scraper import frame_store
+from radolan_scraper import metrics
+from radolan_scraper import rechunk
+from radolan_scraper import regrid
+from radolan_scraper import scrape
+from radolan_scraper import storage
 
 
 def setup_logging(default_path="logging.yaml"):
@@ -35,49 +45,278 @@ def get_base_data_dir():
         raise ValueError("BASE_DATA_DIR not configured in environment.")
 
 
-class ScrapeRadolan(luigi.Task):
+class StorageConfig(luigi.Config):
+    """How the ``rain`` variable is stored, see ``storage.PROFILES``."""
+
+    profile = luigi.ChoiceParameter(choices=list(storage.PROFILES), default="legacy")
+    # Overrides the codec of the profile, e.g. gzip:6 or zstd:3.
+    codec = luigi.Parameter(default="")
+
+    def get_profile(self):
+        return storage.get_profile(self.profile, self.codec)
+
+
+class ScrapeConfig(luigi.Config):
+    """Where the month tars are listed and downloaded from."""
+
+    base_url = luigi.Parameter(default=str(scrape.BASE_URL))
+
+
+class StreamingConfig(luigi.Config):
+    """Collect the yearly files straight from the DWD server, see ``collect.run_streaming``."""
+
+    enabled = luigi.BoolParameter(default=False)
+    # Also store the month tars below raw/ while streaming them.
+    store_raw = luigi.BoolParameter(default=False)
+
+
+class ParallelismConfig(luigi.Config):
+    """How many tasks of each kind run at the same time.
+
+    The limits are declared as luigi resources: every ``ScrapeRadolanMonth`` holds
+    one ``scrape``, every ``CollectRadolanMonth`` one ``cpu`` per decode worker,
+    and tasks writing yearly or combined files one ``disk``. Resources set in the
+    ``[resources]`` section of the luigi configuration take precedence.
+    """
+
+    # Months downloaded at the same time.
+    scrape_workers = luigi.IntParameter(default=scrape.LIMIT_PER_HOST)
+    # Cores used for collecting, defaults to all of them.
+    collect_workers = luigi.IntParameter(default=0)
+    # Tasks writing large files at the same time.
+    disk_writers = luigi.IntParameter(default=2)
+
+    def get_resources(self):
+        return {
+            "scrape": self.scrape_workers,
+            "cpu": self.collect_workers or os.cpu_count(),
+            "disk": self.disk_writers,
+        }
+
+    def get_workers(self):
+        """Enough luigi workers to use all resources at the same time."""
+        return sum(self.get_resources().values())
+
+
+def configure_resources():
+    config = luigi.configuration.get_config()
+    if not config.has_section("resources"):
+        config.add_section("resources")
+    for name, amount in ParallelismConfig().get_resources().items():
+        if not config.has_option("resources", name):
+            config.set("resources", name, str(amount))
+
+
+class MetricsConfig(luigi.Config):
+    """Where the metrics of every task are written, see ``metrics``."""
+
+    # Defaults to metrics/ below the base data directory.
+    directory = luigi.Parameter(default="")
+    # Also dump the cProfile statistics of every task.
+    profile = luigi.BoolParameter(default=False)
+
+    def get_directory(self):
+        return (
+            Path(self.directory) if self.directory else get_base_data_dir() / "metrics"
+        )
+
+
+# Profilers of the running tasks, by task id.
+_profilers = {}
+
+
+@luigi.Task.event_handler(luigi.Event.START)
+def start_metrics(task):
+    metrics.reset()
+    if MetricsConfig().profile:
+        _profilers[task.task_id] = profiler = cProfile.Profile()
+        profiler.enable()
+
+
+@luigi.Task.event_handler(luigi.Event.SUCCESS)
+@luigi.Task.event_handler(luigi.Event.FAILURE)
+def export_metrics(task, *args):
+    metrics_dir = MetricsConfig().get_directory()
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    profiler = _profilers.pop(task.task_id, None)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(metrics_dir / f"{task.task_id}.pstats")
+    snapshot = metrics.current().snapshot()
+    metrics.write_json(metrics_dir / f"{task.task_id}.json", snapshot)
+    metrics.write_prometheus(
+        metrics_dir / f"{task.task_id}.prom", snapshot, task.task_family
+    )
+
+
+def report_frames(task: luigi.Task, n_done: int, n_frames: int):
+    task.set_progress_percentage(100 * n_done / n_frames if n_frames else 100)
+    task.set_status_message(
+        f"{n_done} / {n_frames} frames, {metrics.current().summary()}"
+    )
+
+
+@functools.lru_cache()
+def get_months(year: int, base_url: str) -> Dict[date, scrape.ListingEntry]:
+    """The months of ``year`` that are published, with their entries in the listing.
+
+    The listing is fetched once per process, as luigi asks for the requirements of
+    a task more than once.
+    """
+    return scrape.list_months_in_loop(year, URL(base_url))
+
+
+def scrape_months(year) -> List["ScrapeRadolanMonth"]:
+    return [
+        ScrapeRadolanMonth(month)
+        for month in get_months(int(year), ScrapeConfig().base_url)
+    ]
+
+
+class ScrapeRadolan(luigi.WrapperTask):
+    """Download all published months of ``year``.
+
+    A year is only complete when each of its months is, so an interrupted download
+    is picked up again.
+    """
+
     year = luigi.Parameter()
 
+    def requires(self):
+        return scrape_months(self.year)
+
+
+class ScrapeRadolanMonth(luigi.Task):
+    month = luigi.MonthParameter()
+
+    @property
+    def resources(self):
+        return {"scrape": 1}
+
     def output(self):
-        return luigi.LocalTarget(get_base_data_dir() / "raw" / str(self.year))
+        return luigi.LocalTarget(
+            get_base_data_dir()
+            / "raw"
+            / str(self.month.year)
+            / f"RW-{self.month:%Y%m}.tar"
+        )
 
     def run(self):
-        data_path = Path(self.output().path)
-        data_path.mkdir(parents=True, exist_ok=True)
-        scrape.run_in_loop(data_path, [self.year])
+        # With the entry of the month in the listing, an interrupted download is
+        # resumed and the file is checked against the listed size.
+        base_url = ScrapeConfig().base_url
+        scrape.download_months_in_loop(
+            get_base_data_dir() / "raw",
+            [self.month],
+            URL(base_url),
+            listing=get_months(self.month.year, base_url),
+        )
 
 
 class ExtractTarFiles(luigi.Task):
     year = luigi.Parameter()
+    workers = luigi.IntParameter(default=4)
 
     def requires(self):
-        return ScrapeRadolan(self.year)
+        return scrape_months(self.year)
 
     def output(self):
         return luigi.LocalTarget(get_base_data_dir() / "extracted" / str(self.year))
 
     def run(self):
         extract_to = Path(self.output().path)
-        tar_files = list(Path(self.input().path).rglob("*.tar"))
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            futures = [
-                executor.submit(
-                    lambda x: extract.extract_month(extract_to, x), tar_file
-                )
-                for tar_file in tar_files
-            ]
-            for i, _ in enumerate(concurrent.futures.as_completed(futures)):
-                progress_percentage = i / len(tar_files)
-                self.set_progress_percentage(progress_percentage)
-                self.set_status_message("Progress: %d / 100" % progress_percentage)
-        extract.clean_up(extract_to)
+        tar_files = [Path(input_.path) for input_ in self.input()]
+        extract.run(extract_to, tar_files, self.workers, self.report_progress)
+
+    def report_progress(self, n_done: int, n_months: int):
+        self.set_progress_percentage(100 * n_done / n_months)
+        self.set_status_message(f"Extracted {n_done} / {n_months} months")
+
+
+class CreateFrameStore(luigi.Task):
+    """Decode a year into a memory mappable ``.npy`` file, see ``frame_store``."""
+
+    year = luigi.Parameter()
+    decoder = luigi.ChoiceParameter(choices=collect.DECODERS, default="native")
+    decode_workers = luigi.IntParameter(default=1)
+
+    def requires(self):
+        return scrape_months(self.year)
+
+    def output(self):
+        return luigi.LocalTarget(get_base_data_dir() / "frames" / f"{self.year}.npy")
+
+    def run(self):
+        store_to = Path(self.output().path)
+        store_to.parent.mkdir(parents=True, exist_ok=True)
+        tar_files = [Path(input_.path) for input_ in self.input()]
+        frame_store.write(store_to, tar_files, self.decoder, self.decode_workers)
+
+
+class CollectRadolanMonth(luigi.Task):
+    """Collect a single month into a shard, from which the yearly file is built.
+
+    A failed month only requires this month to be collected again.
+    """
+
+    month = luigi.MonthParameter()
+    decoder = luigi.ChoiceParameter(choices=collect.DECODERS, default="native")
+    decode_workers = luigi.IntParameter(default=1)
+    # 0 keeps up to twice as many decoded days in memory as there are workers.
+    max_days_in_flight = luigi.IntParameter(default=0)
+
+    @property
+    def resources(self):
+        return {"cpu": self.decode_workers}
+
+    def requires(self):
+        return ScrapeRadolanMonth(self.month)
+
+    def output(self):
+        return luigi.LocalTarget(
+            get_base_data_dir()
+            / "netcdf"
+            / "months"
+            / str(self.month.year)
+            / f"{self.month:%Y-%m}.nc"
+        )
+
+    def run(self):
+        collect_to = Path(self.output().path)
+        collect_to.parent.mkdir(parents=True, exist_ok=True)
+        # collect resumes an interrupted run and moves the file into place at the
+        # end, so it writes to the output directly.
+        collect.run(
+            collect_to,
+            Path(self.input().path),
+            self.decoder,
+            self.decode_workers,
+            self.max_days_in_flight or None,
+            StorageConfig().get_profile(),
+            on_progress=functools.partial(report_frames, self),
+        )
 
 
 class CreateNetCDFFromTarFiles(luigi.Task):
     year = luigi.Parameter()
+    decoder = luigi.ChoiceParameter(choices=collect.DECODERS, default="native")
+    decode_workers = luigi.IntParameter(default=1)
+    # 0 keeps up to twice as many decoded days in memory as there are workers.
+    max_days_in_flight = luigi.IntParameter(default=0)
+
+    @property
+    def resources(self):
+        return {"disk": 1}
 
     def requires(self):
-        return ScrapeRadolan(self.year)
+        if StreamingConfig().enabled:
+            return []
+        return [
+            CollectRadolanMonth(
+                month, self.decoder, self.decode_workers, self.max_days_in_flight
+            )
+            for month in get_months(int(self.year), ScrapeConfig().base_url)
+        ]
 
     def output(self):
         return luigi.LocalTarget(get_base_data_dir() / "netcdf" / f"{self.year}.nc")
@@ -85,11 +324,43 @@ class CreateNetCDFFromTarFiles(luigi.Task):
     def run(self):
         collect_to = Path(self.output().path)
         collect_to.parent.mkdir(parents=True, exist_ok=True)
-        collect.run(collect_to, Path(self.input().path))
+        streaming = StreamingConfig()
+        if streaming.enabled:
+            collect.run_streaming(
+                collect_to,
+                int(self.year),
+                self.decoder,
+                StorageConfig().get_profile(),
+                raw_data_path=(
+                    get_base_data_dir() / "raw" if streaming.store_raw else None
+                ),
+                base_url=URL(ScrapeConfig().base_url),
+                on_progress=functools.partial(report_frames, self),
+            )
+            return
+
+        shards = [Path(input_.path) for input_ in self.input()]
+        with self.output().temporary_path() as temporary_path:
+            combine.run(
+                Path(temporary_path),
+                shards,
+                StorageConfig().get_profile(),
+                on_progress=functools.partial(report_frames, self),
+            )
+        # The yearly file holds all frames of the shards now, and keeping them
+        # would double the disk space of the year.
+        for shard in shards:
+            shard.unlink()
 
 
 class CombineNetCDFFiles(luigi.Task):
     years = luigi.ListParameter()
+    # "virtual" maps combined.nc onto the yearly files instead of copying them.
+    mode = luigi.ChoiceParameter(choices=combine.COMBINE_MODES, default="copy")
+
+    @property
+    def resources(self):
+        return {"disk": 1}
 
     def requires(self):
         return [CreateNetCDFFromTarFiles(year) for year in self.years]
@@ -100,35 +371,222 @@ class CombineNetCDFFiles(luigi.Task):
     def run(self):
         combine_to = Path(self.output().path)
         combine_to.parent.mkdir(parents=True, exist_ok=True)
-        combine.run(combine_to, [Path(input_.path) for input_ in self.input()])
+        combine.run(
+            combine_to,
+            [Path(input_.path) for input_ in self.input()],
+            StorageConfig().get_profile(),
+            self.mode,
+            on_progress=functools.partial(report_frames, self),
+        )
+
+
+class UpdateCombinedNetCDFFile(luigi.Task):
+    """Bring combined.nc up to date through ``month``.
+
+    Only the frames later than the last one in the yearly files and in
+    combined.nc are collected and appended, so a monthly update costs time
+    proportional to the new data.
+    """
+
+    month = luigi.MonthParameter()
+    first_year = luigi.IntParameter(default=2005)
+
+    def requires(self):
+        return [
+            ScrapeRadolanMonth(month)
+            for month in iter_months(date(self.first_year, 1, 1), self.month)
+        ]
+
+    def output(self):
+        return luigi.LocalTarget(
+            get_base_data_dir()
+            / "netcdf"
+            / f"_combined_through_{self.month:%Y-%m}.luigi"
+        )
+
+    def run(self):
+        netcdf_dir = get_base_data_dir() / "netcdf"
+        netcdf_dir.mkdir(parents=True, exist_ok=True)
+        profile = StorageConfig().get_profile()
+        year_files = []
+        for year in range(self.first_year, self.month.year + 1):
+            year_file = netcdf_dir / f"{year}.nc"
+            raw_data_path = get_base_data_dir() / "raw" / str(year)
+            collect.run(year_file, raw_data_path, profile=profile, append=True)
+            year_files.append(year_file)
+        combine.run(netcdf_dir / "combined.nc", year_files, profile, append=True)
+        # Write a sentinel file to mark the task as done.
+        with self.output().open("w") as _:
+            pass
+
+
+def iter_months(first: date, last: date):
+    month = date(first.year, first.month, 1)
+    while month <= last:
+        yield month
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+class RechunkCombinedNetCDFFile(luigi.Task):
+    """Write copies of the combined file, chunked for time series or map access."""
+
+    years = luigi.ListParameter()
+    chunks = luigi.TupleParameter(default=rechunk.TIME_SERIES_CHUNKS)
+    map_layout = luigi.BoolParameter()
+    memory_limit_mb = luigi.IntParameter(default=2048)
+
+    def requires(self):
+        return CombineNetCDFFiles(self.years)
+
+    def layouts(self):
+        layouts = [tuple(self.chunks)]
+        if self.map_layout:
+            layouts.append(rechunk.MAP_CHUNKS)
+        return layouts
+
+    def output(self):
+        return [
+            luigi.LocalTarget(
+                get_base_data_dir()
+                / "netcdf"
+                / f"combined_{'x'.join(map(str, chunks))}.nc"
+            )
+            for chunks in self.layouts()
+        ]
+
+    def run(self):
+        for chunks, target in zip(self.layouts(), self.output()):
+            with target.temporary_path() as rechunk_to:
+                rechunk.run(
+                    Path(self.input().path),
+                    Path(rechunk_to),
+                    chunks,
+                    StorageConfig().get_profile(),
+                    self.memory_limit_mb * 1024**2,
+                )
 
 
 class AddCoordinateGridToCombinedNetCDFFile(luigi.Task):
     years = luigi.ListParameter()
 
     def requires(self):
-        return CombineNetCDFFiles(years)
+        return CombineNetCDFFiles(self.years)
 
     def output(self):
         return luigi.LocalTarget(get_base_data_dir() / "netcdf" / f"_grid_added.luigi")
 
     def run(self):
-        metadata_dir = Path(__file__).parents[1] / "metadata"
-        latitude_definitions = metadata_dir / "phi_center.txt"
-        longitude_definitions = metadata_dir / "lambda_center.txt"
-
         add_grid_to = Path(self.input().path)
-        add_coordinate_grid.run(
-            add_grid_to, latitude_definitions, longitude_definitions
+        add_coordinate_grid.run(add_grid_to)
+        # Write a sentinel file to mark the task as done.
+        with self.output().open("w") as _:
+            pass
+
+
+class AggregateCombinedNetCDFFile(luigi.Task):
+    """Daily, monthly and yearly sums and maxima of combined.nc, see ``aggregate``."""
+
+    years = luigi.ListParameter()
+
+    def requires(self):
+        return AddCoordinateGridToCombinedNetCDFFile(self.years)
+
+    def output(self):
+        return luigi.LocalTarget(get_base_data_dir() / "netcdf" / "aggregates.nc")
+
+    def run(self):
+        aggregate_from = get_base_data_dir() / "netcdf" / "combined.nc"
+        with self.output().temporary_path() as temporary_path:
+            aggregate.run(aggregate_from, Path(temporary_path))
+
+
+class UpdateAggregates(luigi.Task):
+    """Add the frames appended by ``UpdateCombinedNetCDFFile`` to aggregates.nc."""
+
+    month = luigi.MonthParameter()
+    first_year = luigi.IntParameter(default=2005)
+
+    def requires(self):
+        return UpdateCombinedNetCDFFile(self.month, self.first_year)
+
+    def output(self):
+        return luigi.LocalTarget(
+            get_base_data_dir()
+            / "netcdf"
+            / f"_aggregated_through_{self.month:%Y-%m}.luigi"
         )
+
+    def run(self):
+        netcdf_dir = get_base_data_dir() / "netcdf"
+        aggregate.run(netcdf_dir / "combined.nc", netcdf_dir / "aggregates.nc")
         # Write a sentinel file to mark the task as done.
         with self.output().open("w") as _:
             pass
 
 
+class ComputeClimatology(luigi.Task):
+    """Add per pixel percentiles, exceedance counts and dry spells to combined.nc."""
+
+    years = luigi.ListParameter()
+    workers = luigi.IntParameter(default=4)
+
+    def requires(self):
+        return AddCoordinateGridToCombinedNetCDFFile(self.years)
+
+    def output(self):
+        return luigi.LocalTarget(get_base_data_dir() / "netcdf" / "_climatology.luigi")
+
+    def run(self):
+        combined = get_base_data_dir() / "netcdf" / "combined.nc"
+        climatology.run(combined, n_workers=self.workers)
+        # Write a sentinel file to mark the task as done.
+        with self.output().open("w") as _:
+            pass
+
+
+class RegridCombinedNetCDFFile(luigi.Task):
+    """Regrid combined.nc onto a regular longitude/latitude grid, see ``regrid``."""
+
+    years = luigi.ListParameter()
+    method = luigi.ChoiceParameter(choices=regrid.METHODS, default="bilinear")
+    resolution = luigi.FloatParameter(default=regrid.GERMANY.resolution)
+    workers = luigi.IntParameter(default=4)
+
+    def requires(self):
+        return CombineNetCDFFiles(self.years)
+
+    def output(self):
+        return luigi.LocalTarget(
+            get_base_data_dir()
+            / "netcdf"
+            / f"combined_latlon_{self.method}_{self.resolution:g}.nc"
+        )
+
+    def run(self):
+        target = regrid.GERMANY._replace(resolution=self.resolution)
+        with self.output().temporary_path() as temporary_path:
+            regrid.run(
+                Path(self.input().path),
+                Path(temporary_path),
+                target,
+                self.method,
+                self.workers,
+            )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Dump the cProfile statistics of every task next to its metrics.",
+    )
+    args = parser.parse_args()
+    if args.profile:
+        luigi.configuration.get_config().set("MetricsConfig", "profile", "true")
     load_dotenv()
     setup_logging()
     years = list((range(2005, 2019)))
-    tasks = [AddCoordinateGridToCombinedNetCDFFile(years)]
-    luigi.build(tasks, local_scheduler=True, workers=1)
+    tasks = [AggregateCombinedNetCDFFile(years)]
+    configure_resources()
+    luigi.build(tasks, local_scheduler=True, workers=ParallelismConfig().get_workers())
@@ -0,0 +1,173 @@
+"""Extract time series of many points from the combined netcdf file at once.
+
+Points are mapped to their nearest grid cell through a KD-tree over the ``xc``/``yc``
+cell centers, built once per file. The points are then grouped by the chunks of
+``rain`` they fall into, and every chunk is read exactly once for all of its points,
+so the cost grows with the number of distinct chunks instead of the number of points.
+"""
+from datetime import datetime
+import itertools
+import logging
+from pathlib import Path
+from typing import *
+
+import h5netcdf
+import numpy as np
+from scipy.spatial import cKDTree
+
+from radolan_scraper import radolan_grid
+from radolan_scraper import reader
+
+logger = logging.getLogger(__name__)
+
+
+class PointSeries(NamedTuple):
+    time: np.ndarray
+    lon: np.ndarray
+    lat: np.ndarray
+    # Grid cell of each point, -1 for points outside of the grid.
+    row: np.ndarray
+    col: np.ndarray
+    # Values in mm/h of shape (time, point), NaN where missing.
+    rain: np.ndarray
+
+
+class PointIndex:
+    """Find the grid cell nearest to a longitude and latitude."""
+
+    def __init__(self, lon: np.ndarray, lat: np.ndarray):
+        self.shape = lon.shape
+        self.tree = cKDTree(to_unit_vectors(lon.ravel(), lat.ravel()))
+
+    def lookup(
+        self, lon: np.ndarray, lat: np.ndarray, max_distance: float = 1.0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the row and column of the nearest cell center for each point.
+
+        Points more than ``max_distance`` km away from any center are outside of
+        the grid and get -1 as their row and column.
+        """
+        distance, index = self.tree.query(
+            to_unit_vectors(np.asarray(lon), np.asarray(lat)),
+            distance_upper_bound=max_distance / radolan_grid.EARTH_RADIUS,
+        )
+        outside = ~np.isfinite(distance)
+        index[outside] = 0
+        row, col = np.unravel_index(index, self.shape)
+        row[outside] = -1
+        col[outside] = -1
+        return row, col
+
+
+def to_unit_vectors(lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+    """Points on the unit sphere, whose distances grow with the distance on Earth."""
+    lon = np.radians(lon)
+    lat = np.radians(lat)
+    return np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1
+    )
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    stations = np.loadtxt(base_data_dir / "stations.csv", delimiter=",", ndmin=2)
+    series = extract(
+        base_data_dir / "netcdf" / "combined.nc", stations[:, 0], stations[:, 1]
+    )
+    write_netcdf(base_data_dir / "netcdf" / "stations.nc", series)
+
+
+def extract(
+    path: Path,
+    lon: Sequence[float],
+    lat: Sequence[float],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    memory_limit: int = 512 * 1024**2,
+) -> PointSeries:
+    """Extract the time series of the points at ``lon`` and ``lat``.
+
+    Only frames with ``start <= time < end`` are read, if given. Blocks of at
+    most ``memory_limit`` bytes are read at once.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    with reader.Reader(path, cache_bytes=0) as r:
+        row, col = PointIndex(*r.grid).lookup(lon, lat)
+        time_slice = r.time_slice(start, end)
+        rain = read_points(r.rain, row, col, time_slice, memory_limit)
+        rain = r.decode(rain)
+        rain[:, row < 0] = np.nan
+        time = np.array(
+            r.time_unit.num2pydate(r.times[time_slice]), dtype="M8[m]"
+        ).reshape(-1)
+    return PointSeries(time, lon, lat, row, col, rain)
+
+
+def read_points(
+    rain_var: h5netcdf.Variable,
+    row: np.ndarray,
+    col: np.ndarray,
+    time_slice: slice,
+    memory_limit: int,
+) -> np.ndarray:
+    """Read the values at the cells ``row`` and ``col``, one chunk at a time."""
+    n_times, n_rows, n_cols = rain_var.shape
+    t_chunk, y_chunk, x_chunk = rain_var.chunks or rain_var.shape
+    out = np.empty((time_slice.stop - time_slice.start, len(row)), rain_var.dtype)
+
+    inside = np.flatnonzero(row >= 0)
+    groups = {}
+    for point, chunk in zip(
+        inside, zip(row[inside] // y_chunk, col[inside] // x_chunk)
+    ):
+        groups.setdefault(chunk, []).append(point)
+    logger.info(f"Reading {len(inside)} points from {len(groups)} chunk columns")
+
+    # Read as many whole chunks along time at once as fit into the memory limit.
+    itemsize = np.dtype(rain_var.dtype).itemsize
+    t_block = (
+        max(memory_limit // (y_chunk * x_chunk * itemsize) // t_chunk, 1) * t_chunk
+    )
+    first = time_slice.start // t_chunk * t_chunk
+    for (cy, cx), points in groups.items():
+        points = np.array(points)
+        ys = slice(cy * y_chunk, min((cy + 1) * y_chunk, n_rows))
+        xs = slice(cx * x_chunk, min((cx + 1) * x_chunk, n_cols))
+        for t0 in range(first, time_slice.stop, t_block):
+            t_start = max(t0, time_slice.start)
+            t_stop = min(t0 + t_block, time_slice.stop)
+            block = rain_var[t_start:t_stop, ys, xs]
+            out[t_start - time_slice.start : t_stop - time_slice.start, points] = block[
+                :, row[points] - ys.start, col[points] - xs.start
+            ]
+    return out
+
+
+def write_netcdf(write_to: Path, series: PointSeries) -> None:
+    with h5netcdf.File(write_to, "w") as f:
+        f.dimensions["time"] = len(series.time)
+        f.dimensions["point"] = len(series.lon)
+
+        time_var = f.create_variable(
+            "time",
+            dimensions=("time",),
+            data=series.time.astype("M8[m]").astype(np.int64),
+        )
+        time_var.attrs["units"] = "minutes since 1970-01-01 00:00:00"
+        lon_var = f.create_variable("lon", dimensions=("point",), data=series.lon)
+        lon_var.attrs["units"] = "degrees_east"
+        lat_var = f.create_variable("lat", dimensions=("point",), data=series.lat)
+        lat_var.attrs["units"] = "degrees_north"
+        f.create_variable("row", dimensions=("point",), data=series.row)
+        f.create_variable("col", dimensions=("point",), data=series.col)
+
+        rain_var = f.create_variable(
+            "rain",
+            dimensions=("time", "point"),
+            data=series.rain,
+            chunks=(min(len(series.time), 8760) or 1, 1),
+            compression="lzf",
+        )
+        rain_var.attrs["units"] = "mm/h"
+        rain_var.attrs["coordinates"] = "lat lon"
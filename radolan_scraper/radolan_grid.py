@@ -0,0 +1,95 @@
+"""Compute the coordinates of the RADOLAN grids from their projection.
+
+RADOLAN products use a polar stereographic projection of a sphere with a radius of
+6370.04 km, true at 60°N and centered on 10°E. The grids have cells of 1 km x 1 km,
+and differ only in their size and the position of their lower left corner.
+Computing the coordinates makes the grid available for every product size,
+without the ``phi_center.txt`` and ``lambda_center.txt`` metadata files.
+"""
+from typing import *
+
+import numpy as np
+
+EARTH_RADIUS = 6370.04
+STANDARD_PARALLEL = 60.0
+REFERENCE_LONGITUDE = 10.0
+
+# Lower left corner in km of the grids by their shape, as (nrows, ncols).
+GRID_ORIGINS = {
+    (900, 900): (-523.4622, -4658.6447),
+    (1100, 900): (-443.4622, -4758.6447),
+    (1500, 1400): (-673.4622, -5008.6447),
+}
+
+
+class Grid(NamedTuple):
+    # Longitudes and latitudes of the cell centers, of shape (nrows, ncols).
+    xc: np.ndarray
+    yc: np.ndarray
+    # Longitudes and latitudes of the cell corners, of shape (nrows, ncols, 4).
+    xv: np.ndarray
+    yv: np.ndarray
+
+
+def get_grid(shape: Tuple[int, int] = (900, 900)) -> Grid:
+    """Compute the coordinates of the grid with ``shape`` as (nrows, ncols).
+
+    The first row is the northernmost one, as in the ascii files. The corners
+    of each cell run anticlockwise in longitude and latitude, starting in the
+    south west, as CF expects for ``bounds``.
+    """
+    x, y = get_projected_corners(shape)
+    corner_lon, corner_lat = to_lonlat(x, y)
+    center_lon, center_lat = to_lonlat(
+        (x[:-1, :-1] + x[1:, 1:]) / 2, (y[:-1, :-1] + y[1:, 1:]) / 2
+    )
+    return Grid(
+        xc=center_lon, yc=center_lat, xv=to_bounds(corner_lon), yv=to_bounds(corner_lat)
+    )
+
+
+def get_projected_corners(shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Projected coordinates in km of the cell corners, of shape (nrows + 1, ncols + 1)."""
+    try:
+        x0, y0 = GRID_ORIGINS[tuple(shape)]
+    except KeyError:
+        raise ValueError(
+            f"Unknown RADOLAN grid of shape {shape}, choose one of {tuple(GRID_ORIGINS)}."
+        )
+    nrows, ncols = shape
+    return np.meshgrid(x0 + np.arange(ncols + 1), y0 + np.arange(nrows, -1, -1))
+
+
+def to_lonlat(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert projected coordinates in km to longitudes and latitudes."""
+    scale = (EARTH_RADIUS * (1 + np.sin(np.radians(STANDARD_PARALLEL)))) ** 2
+    r2 = x**2 + y**2
+    lat = np.degrees(np.arcsin((scale - r2) / (scale + r2)))
+    lon = np.degrees(np.arctan2(x, -y)) + REFERENCE_LONGITUDE
+    return lon, lat
+
+
+def to_xy(lon: np.ndarray, lat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Convert longitudes and latitudes to projected coordinates in km."""
+    lat = np.radians(lat)
+    lon = np.radians(np.asarray(lon) - REFERENCE_LONGITUDE)
+    r = (
+        EARTH_RADIUS
+        * (1 + np.sin(np.radians(STANDARD_PARALLEL)))
+        / (1 + np.sin(lat))
+        * np.cos(lat)
+    )
+    return r * np.sin(lon), -r * np.cos(lon)
+
+
+def to_bounds(corners: np.ndarray) -> np.ndarray:
+    """Turn an array of shape (n + 1, m + 1) into cell bounds of shape (n, m, 4).
+
+    The first row of ``corners`` is the northernmost one. The corners of each cell
+    are ordered south west, south east, north east and north west, which is
+    anticlockwise on the map.
+    """
+    return np.stack(
+        [corners[1:, :-1], corners[1:, 1:], corners[:-1, 1:], corners[:-1, :-1]],
+        axis=-1,
+    )
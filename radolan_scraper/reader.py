@@ -0,0 +1,201 @@
+"""Read subsets of the combined netcdf file by time range and region.
+
+``Reader`` turns a datetime range into a slice of the ``time`` dimension by binary
+search, and a longitude/latitude box into slices of ``y`` and ``x`` through the
+``xc``/``yc`` grid. Only the chunks of ``rain`` that intersect a query are read,
+and decoded chunks are kept in a cache with a byte budget, so repeated queries of
+the same region and window are served from memory.
+"""
+import collections
+from datetime import datetime
+import itertools
+import logging
+from pathlib import Path
+from typing import *
+
+import cf_units
+import h5netcdf
+import numpy as np
+
+from radolan_scraper import radolan_grid
+
+logger = logging.getLogger(__name__)
+
+
+class BoundingBox(NamedTuple):
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+
+class Subset(NamedTuple):
+    time: np.ndarray
+    y: slice
+    x: slice
+    rain: np.ndarray
+
+
+class ChunkCache:
+    """Least recently used cache of decoded chunks, limited to ``max_bytes``."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks = collections.OrderedDict()
+
+    def get(self, key: Hashable, load: Callable[[], np.ndarray]) -> np.ndarray:
+        try:
+            chunk = self._chunks[key]
+        except KeyError:
+            self.misses += 1
+            chunk = load()
+            self.put(key, chunk)
+            return chunk
+        self.hits += 1
+        self._chunks.move_to_end(key)
+        return chunk
+
+    def put(self, key: Hashable, chunk: np.ndarray) -> None:
+        if chunk.nbytes > self.max_bytes:
+            return
+        self._chunks[key] = chunk
+        self.n_bytes += chunk.nbytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self._chunks.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+
+
+class Reader:
+    """Query ``rain`` in a combined netcdf file, see the module docstring."""
+
+    def __init__(self, path: Path, cache_bytes: int = 512 * 1024**2):
+        self.file = h5netcdf.File(path, "r")
+        self.rain = self.file["rain"]
+        time_var = self.file["time"]
+        self.time_unit = cf_units.Unit(
+            time_var.attrs["units"], calendar=cf_units.CALENDAR_STANDARD
+        )
+        self.times = time_var[...]
+        self.cache = ChunkCache(cache_bytes)
+        self._grid = None
+
+    def __enter__(self) -> "Reader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    @property
+    def grid(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Longitudes and latitudes of the cell centers."""
+        if self._grid is None:
+            if "xc" in self.file.variables and "yc" in self.file.variables:
+                self._grid = self.file["xc"][...], self.file["yc"][...]
+            else:
+                grid = radolan_grid.get_grid(self.rain.shape[1:])
+                self._grid = grid.xc, grid.yc
+        return self._grid
+
+    def time_slice(self, start: Optional[datetime], end: Optional[datetime]) -> slice:
+        """Slice of the frames with ``start <= time < end``, unbounded for ``None``."""
+        first, last = 0, len(self.times)
+        if start is not None:
+            first = int(np.searchsorted(self.times, self.time_unit.date2num(start)))
+        if end is not None:
+            last = int(np.searchsorted(self.times, self.time_unit.date2num(end)))
+        return slice(first, max(first, last))
+
+    def bbox_slices(self, bbox: BoundingBox) -> Tuple[slice, slice]:
+        """Slices of ``y`` and ``x`` that cover all cell centers within ``bbox``."""
+        lon, lat = self.grid
+        inside = (
+            (lon >= bbox.min_lon)
+            & (lon <= bbox.max_lon)
+            & (lat >= bbox.min_lat)
+            & (lat <= bbox.max_lat)
+        )
+        rows = np.flatnonzero(inside.any(axis=1))
+        cols = np.flatnonzero(inside.any(axis=0))
+        if rows.size == 0:
+            raise ValueError(f"{bbox} does not contain any grid cell.")
+        return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+    def query(
+        self,
+        start: datetime,
+        end: datetime,
+        bbox: Optional[BoundingBox] = None,
+        decode: bool = True,
+    ) -> Subset:
+        """Read the frames with ``start <= time < end``, within ``bbox`` if given.
+
+        With ``decode``, the values are converted to mm/h as float32, with missing
+        values as NaN. Otherwise they are returned as stored.
+        """
+        time_slice = self.time_slice(start, end)
+        if bbox is None:
+            y_slice, x_slice = slice(0, self.rain.shape[1]), slice(
+                0, self.rain.shape[2]
+            )
+        else:
+            y_slice, x_slice = self.bbox_slices(bbox)
+        rain = self.read((time_slice, y_slice, x_slice))
+        if decode:
+            rain = self.decode(rain)
+        time = np.array(
+            self.time_unit.num2pydate(self.times[time_slice]), dtype="M8[m]"
+        )
+        return Subset(time, y_slice, x_slice, rain)
+
+    def read(self, selection: Tuple[slice, slice, slice]) -> np.ndarray:
+        """Read a block of ``rain`` chunk by chunk, through the cache."""
+        shape = self.rain.shape
+        selection = tuple(
+            slice(*s.indices(size)[:2]) for s, size in zip(selection, shape)
+        )
+        out = np.empty(
+            tuple(max(s.stop - s.start, 0) for s in selection), dtype=self.rain.dtype
+        )
+        chunks = self.rain.chunks
+        if chunks is None or out.size == 0:
+            out[...] = self.rain[selection]
+            return out
+
+        chunk_ranges = [
+            range(s.start // c, (s.stop - 1) // c + 1)
+            for s, c in zip(selection, chunks)
+        ]
+        for index in itertools.product(*chunk_ranges):
+            chunk_start = [i * c for i, c in zip(index, chunks)]
+            chunk = self.cache.get(index, lambda: self.read_chunk(chunk_start))
+            # Intersection of the chunk with the selection, in both coordinates.
+            src = []
+            dst = []
+            for s, c0, c in zip(selection, chunk_start, chunk.shape):
+                lo, hi = max(s.start, c0), min(s.stop, c0 + c)
+                src.append(slice(lo - c0, hi - c0))
+                dst.append(slice(lo - s.start, hi - s.start))
+            out[tuple(dst)] = chunk[tuple(src)]
+        return out
+
+    def read_chunk(self, chunk_start: Sequence[int]) -> np.ndarray:
+        chunk = tuple(
+            slice(c0, min(c0 + c, size))
+            for c0, c, size in zip(chunk_start, self.rain.chunks, self.rain.shape)
+        )
+        return self.rain[chunk]
+
+    def decode(self, rain: np.ndarray) -> np.ndarray:
+        attrs = self.rain.attrs
+        decoded = rain.astype(np.float32)
+        if "_FillValue" in attrs:
+            decoded[rain == attrs["_FillValue"]] = np.nan
+        if "scale_factor" in attrs:
+            decoded *= np.float32(attrs["scale_factor"])
+        return decoded
@@ -0,0 +1,155 @@
+"""Rewrite the combined netcdf file with a chunk layout suited for its access pattern.
+
+Reading a long time series of a single pixel from a file chunked per frame touches
+every chunk of the file. This module copies the ``rain`` cube into a new file with a
+chosen chunk shape, e.g. ``(8760, 32, 32)`` for time series or ``(1, 900, 900)``
+for maps. The cube is copied in blocks that are aligned to the new chunks and never
+exceed a given memory limit, so it does not need to fit into memory.
+"""
+import itertools
+import logging
+from pathlib import Path
+from typing import *
+
+import h5netcdf
+import numpy as np
+
+from radolan_scraper import storage
+
+logger = logging.getLogger(__name__)
+
+TIME_SERIES_CHUNKS = (8760, 32, 32)
+MAP_CHUNKS = (1, 900, 900)
+
+# Window shapes of typical reads, as (time, y, x).
+ACCESS_PATTERNS = {
+    "point time series": (None, 1, 1),
+    "single map": (1, None, None),
+    "month of a 100x100 region": (720, 100, 100),
+}
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    rechunk_from = base_data_dir / "netcdf" / "combined.nc"
+    rechunk_to = base_data_dir / "netcdf" / "combined_8760x32x32.nc"
+    run(rechunk_from, rechunk_to, TIME_SERIES_CHUNKS)
+
+
+def run(
+    rechunk_from: Path,
+    rechunk_to: Path,
+    chunks: Tuple[int, int, int],
+    profile: storage.StorageProfile = storage.PROFILES["legacy"],
+    memory_limit: int = 2 * 1024**3,
+) -> Dict[str, Tuple[float, float]]:
+    """Copy ``rechunk_from`` into ``rechunk_to`` using ``chunks`` for ``rain``.
+
+    Half of ``memory_limit`` bytes is used for the blocks being copied and half for
+    the chunk cache of the source file. Returns the expected read amplification of
+    the source and the new layout for each of the ``ACCESS_PATTERNS``.
+    """
+    with h5netcdf.File(
+        rechunk_from, "r", rdcc_nbytes=memory_limit // 2
+    ) as src, h5netcdf.File(rechunk_to, "w") as dst:
+        src_rain = src["rain"]
+        storage.check_compatible(src_rain, profile)
+        shape = src_rain.shape
+        chunks = tuple(min(c, s) for c, s in zip(chunks, shape))
+
+        amplification = {
+            pattern: (
+                read_amplification(shape, src_rain.chunks or shape, window),
+                read_amplification(shape, chunks, window),
+            )
+            for pattern, window in ACCESS_PATTERNS.items()
+        }
+        for pattern, (before, after) in amplification.items():
+            logger.info(
+                f"Read amplification for {pattern}: {before:.1f} -> {after:.1f}"
+            )
+
+        dimensions = {}
+        for var in src.variables.values():
+            dimensions.update(zip(var.dimensions, var.shape))
+        for name, size in dimensions.items():
+            dst.dimensions[name] = size
+        for name, var in src.variables.items():
+            if name == "rain":
+                continue
+            dst_var = dst.create_variable(
+                name, dimensions=var.dimensions, data=var[...]
+            )
+            dst_var.attrs.update(var.attrs)
+
+        dst_rain = storage.create_rain_variable(dst, profile, chunks=chunks)
+        for key, value in src_rain.attrs.items():
+            if key not in dst_rain.attrs:
+                dst_rain.attrs[key] = value
+
+        block_shape = get_block_shape(
+            shape, chunks, np.dtype(profile.dtype).itemsize, memory_limit // 2
+        )
+        logger.info(f"Rechunking {shape} to {chunks} in blocks of {block_shape}")
+        for block in iter_blocks(shape, block_shape):
+            logger.debug(f"Copying block {block}")
+            dst_rain[block] = src_rain[block]
+
+    return amplification
+
+
+def get_block_shape(
+    shape: Tuple[int, ...], chunks: Tuple[int, ...], itemsize: int, memory_limit: int
+) -> Tuple[int, ...]:
+    """Find the largest block of whole chunks that fits into ``memory_limit`` bytes.
+
+    The block is grown along the last dimension first, so that the source, which is
+    stored frame by frame, is read in long contiguous runs.
+    """
+    block = [min(c, s) for c, s in zip(chunks, shape)]
+    if np.prod(block) * itemsize > memory_limit:
+        raise ValueError(
+            f"A single chunk of {chunks} does not fit into {memory_limit} bytes."
+        )
+    for dim in reversed(range(len(shape))):
+        while block[dim] < shape[dim]:
+            grown = list(block)
+            grown[dim] = min(block[dim] + chunks[dim], shape[dim])
+            if np.prod(grown) * itemsize > memory_limit:
+                break
+            block = grown
+    return tuple(block)
+
+
+def iter_blocks(
+    shape: Tuple[int, ...], block_shape: Tuple[int, ...]
+) -> Iterator[Tuple[slice, ...]]:
+    starts = [range(0, size, block) for size, block in zip(shape, block_shape)]
+    for start in itertools.product(*starts):
+        yield tuple(
+            slice(s, min(s + block, size))
+            for s, block, size in zip(start, block_shape, shape)
+        )
+
+
+def read_amplification(
+    shape: Tuple[int, ...],
+    chunks: Tuple[int, ...],
+    window: Tuple[Optional[int], ...],
+) -> float:
+    """Expected ratio of decoded to requested values when reading ``window``.
+
+    ``None`` in ``window`` stands for the full extent of a dimension. The window is
+    assumed to start at a random position, so it touches on average
+    ``(w - 1) / c + 1`` chunks of size ``c`` along each dimension.
+    """
+    amplification = 1.0
+    for size, chunk, w in zip(shape, chunks, window):
+        w = size if w is None else min(w, size)
+        n_chunks = min((w - 1) / chunk + 1, np.ceil(size / chunk))
+        amplification *= n_chunks * chunk / w
+    return float(amplification)
+
+
+if __name__ == "__main__":
+    main()
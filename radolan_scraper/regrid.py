@@ -0,0 +1,277 @@
+"""Regrid the combined netcdf file onto a regular longitude/latitude grid.
+
+Every target cell is a weighted sum of source cells, so regridding is a product of
+a sparse weight matrix with the frames. The weights are computed once from the
+geometry of the RADOLAN grid, see ``radolan_grid``, and stored next to the output.
+They are then applied to blocks of frames at once, in a process pool.
+
+``bilinear`` interpolates between the four source cell centers around each target
+cell center. ``conservative`` samples each target cell at ``n_samples`` x
+``n_samples`` points and weighs the source cells by the share of samples they
+contain, which approximates the overlap of the cells.
+"""
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import logging
+from pathlib import Path
+from typing import *
+
+import h5netcdf
+import numpy as np
+import scipy.sparse
+
+from radolan_scraper import radolan_grid
+from radolan_scraper import storage
+
+logger = logging.getLogger(__name__)
+
+METHODS = ("bilinear", "conservative")
+
+
+class LatLonGrid(NamedTuple):
+    lon_min: float
+    lat_min: float
+    lon_max: float
+    lat_max: float
+    resolution: float
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (
+            int(round((self.lat_max - self.lat_min) / self.resolution)),
+            int(round((self.lon_max - self.lon_min) / self.resolution)),
+        )
+
+    @property
+    def lon(self) -> np.ndarray:
+        """Longitudes of the cell centers."""
+        return self.lon_min + (np.arange(self.shape[1]) + 0.5) * self.resolution
+
+    @property
+    def lat(self) -> np.ndarray:
+        """Latitudes of the cell centers, from south to north."""
+        return self.lat_min + (np.arange(self.shape[0]) + 0.5) * self.resolution
+
+
+# Covers the 900x900 grid.
+GERMANY = LatLonGrid(2.0, 46.9, 16.0, 55.0, 0.01)
+
+
+def main():
+    base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
+    netcdf_dir = base_data_dir / "netcdf"
+    run(netcdf_dir / "combined.nc", netcdf_dir / "combined_latlon.nc")
+
+
+def run(
+    regrid_from: Path,
+    regrid_to: Path,
+    target: LatLonGrid = GERMANY,
+    method: str = "bilinear",
+    n_workers: int = 4,
+    memory_limit: int = 512 * 1024**2,
+) -> None:
+    """Regrid ``rain`` of ``regrid_from`` onto ``target`` and write it to ``regrid_to``.
+
+    Each worker handles blocks of whole time chunks of at most ``memory_limit``
+    bytes. At most two blocks per worker are held in memory at any time.
+    """
+    with h5netcdf.File(regrid_from, "r") as src:
+        rain = src["rain"]
+        shape = rain.shape
+        t_chunk = (rain.chunks or shape)[0]
+        frame_bytes = np.prod(shape[1:]) * np.dtype(np.float32).itemsize
+        time_attrs = dict(src["time"].attrs)
+        times = src["time"][...]
+
+    weights_path = get_weights_path(regrid_to, shape[1:], target, method)
+    get_weights(weights_path, shape[1:], target, method)
+    block = max(memory_limit // frame_bytes // t_chunk, 1) * t_chunk
+    n_lat, n_lon = target.shape
+    logger.info(
+        f"Regridding {shape[0]} frames onto {target.shape} with {method} weights"
+    )
+
+    with h5netcdf.File(regrid_to, "w") as dst:
+        dst.dimensions["time"] = shape[0]
+        dst.dimensions["lat"] = n_lat
+        dst.dimensions["lon"] = n_lon
+        time_var = dst.create_variable("time", dimensions=("time",), data=times)
+        time_var.attrs.update(time_attrs)
+        lat_var = dst.create_variable("lat", dimensions=("lat",), data=target.lat)
+        lat_var.attrs["units"] = "degrees_north"
+        lon_var = dst.create_variable("lon", dimensions=("lon",), data=target.lon)
+        lon_var.attrs["units"] = "degrees_east"
+        rain_var = dst.create_variable(
+            "rain",
+            dimensions=("time", "lat", "lon"),
+            dtype=np.float32,
+            chunks=(min(t_chunk, shape[0]) or 1, n_lat, n_lon),
+            compression="lzf",
+            shuffle=True,
+            fillvalue=np.float32(np.nan),
+        )
+        rain_var.attrs["units"] = "mm/h"
+        rain_var.attrs["regrid_method"] = method
+
+        with ProcessPoolExecutor(n_workers) as executor:
+            in_flight = collections.deque()
+            for start in range(0, shape[0], block):
+                end = min(start + block, shape[0])
+                if len(in_flight) == 2 * n_workers:
+                    write_block(rain_var, *in_flight.popleft())
+                future = executor.submit(
+                    regrid_block, regrid_from, weights_path, target.shape, start, end
+                )
+                in_flight.append((start, end, future))
+            while in_flight:
+                write_block(rain_var, *in_flight.popleft())
+
+
+def write_block(rain_var: h5netcdf.Variable, start: int, end: int, future) -> None:
+    rain_var[start:end] = future.result()
+    logger.debug(f"Regridded frames {start} to {end}")
+
+
+def regrid_block(
+    regrid_from: Path,
+    weights_path: Path,
+    target_shape: Tuple[int, int],
+    start: int,
+    end: int,
+) -> np.ndarray:
+    """Regrid the frames ``start:end`` inside a worker process."""
+    weights = load_weights(weights_path)
+    with h5netcdf.File(regrid_from, "r") as src:
+        rain = src["rain"]
+        frames = rain[start:end]
+        fill_value = rain.attrs.get("_FillValue", storage.FILL_VALUE)
+        scale_factor = rain.attrs.get("scale_factor")
+    regridded = apply_weights(weights, frames, fill_value, scale_factor)
+    return regridded.reshape((len(frames),) + target_shape)
+
+
+def apply_weights(
+    weights: scipy.sparse.csr_matrix,
+    frames: np.ndarray,
+    fill_value: int,
+    scale_factor: Optional[float] = None,
+    min_coverage: float = 0.5,
+) -> np.ndarray:
+    """Regrid frames of shape (time, y, x) to values in mm/h of shape (time, cells).
+
+    Missing source cells are left out and the remaining weights renormalized.
+    The weights of a target cell within the source grid add up to 1, so target
+    cells whose valid weights add up to less than ``min_coverage`` are NaN, be it
+    due to missing values or because they are partly outside of the source grid.
+    """
+    frames = frames.reshape(len(frames), -1).T
+    valid = frames != fill_value
+    values = weights @ np.where(valid, frames, 0).astype(np.float32)
+    coverage = weights @ valid.astype(np.float32)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        regridded = values / coverage
+    regridded[coverage < min_coverage] = np.nan
+    if scale_factor is not None:
+        regridded *= np.float32(scale_factor)
+    return regridded.T
+
+
+def get_weights_path(
+    regrid_to: Path, source_shape: Tuple[int, int], target: LatLonGrid, method: str
+) -> Path:
+    spec = "_".join(f"{v:g}" for v in target)
+    return regrid_to.with_name(
+        f"weights_{method}_{source_shape[0]}x{source_shape[1]}_{spec}.npz"
+    )
+
+
+def get_weights(
+    weights_path: Path, source_shape: Tuple[int, int], target: LatLonGrid, method: str
+) -> scipy.sparse.csr_matrix:
+    """Load the stored weights, or compute and store them."""
+    if weights_path.exists():
+        return load_weights(weights_path)
+    weights = compute_weights(source_shape, target, method)
+    scipy.sparse.save_npz(weights_path, weights)
+    return weights
+
+
+def load_weights(weights_path: Path) -> scipy.sparse.csr_matrix:
+    """Load the stored weights, reusing them while the file is unchanged."""
+    stat = weights_path.stat()
+    return load_weights_of_version(weights_path, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=1)
+def load_weights_of_version(
+    weights_path: Path, size: int, mtime_ns: int
+) -> scipy.sparse.csr_matrix:
+    return scipy.sparse.load_npz(weights_path).tocsr()
+
+
+def compute_weights(
+    source_shape: Tuple[int, int],
+    target: LatLonGrid,
+    method: str = "bilinear",
+    n_samples: int = 5,
+) -> scipy.sparse.csr_matrix:
+    """Weights of shape (target cells, source cells), rows of the target from south."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, choose one of {METHODS}.")
+    n_rows, n_cols = source_shape
+    n_lat, n_lon = target.shape
+
+    if method == "bilinear":
+        lon, lat = np.meshgrid(target.lon, target.lat)
+        row, col = to_source_index(source_shape, lon, lat)
+        # Indices relative to the cell centers.
+        row, col = row - 0.5, col - 0.5
+        row0, col0 = np.floor(row).astype(int), np.floor(col).astype(int)
+        dy, dx = row - row0, col - col0
+        corners = [
+            (row0, col0, (1 - dy) * (1 - dx)),
+            (row0, col0 + 1, (1 - dy) * dx),
+            (row0 + 1, col0, dy * (1 - dx)),
+            (row0 + 1, col0 + 1, dy * dx),
+        ]
+        inside = (row0 >= 0) & (row0 + 1 < n_rows) & (col0 >= 0) & (col0 + 1 < n_cols)
+    else:
+        offsets = (np.arange(n_samples) + 0.5) / n_samples - 0.5
+        lon = target.lon[np.newaxis, :, np.newaxis, np.newaxis]
+        lat = target.lat[:, np.newaxis, np.newaxis, np.newaxis]
+        sample_lon = lon + offsets[np.newaxis, :] * target.resolution
+        sample_lat = lat + offsets[:, np.newaxis] * target.resolution
+        sample_lon, sample_lat = np.broadcast_arrays(sample_lon, sample_lat)
+        row, col = to_source_index(source_shape, sample_lon, sample_lat)
+        row, col = np.floor(row).astype(int), np.floor(col).astype(int)
+        corners = [(row, col, np.full(row.shape, 1 / n_samples**2))]
+        inside = (row >= 0) & (row < n_rows) & (col >= 0) & (col < n_cols)
+
+    target_index = np.arange(n_lat * n_lon).reshape(n_lat, n_lon)
+    target_index = np.broadcast_to(
+        target_index.reshape(target_index.shape + (1,) * (inside.ndim - 2)),
+        inside.shape,
+    )
+    rows, cols, data = [], [], []
+    for r, c, w in corners:
+        rows.append(target_index[inside])
+        cols.append((r * n_cols + c)[inside])
+        data.append(w[inside])
+    weights = scipy.sparse.coo_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_lat * n_lon, n_rows * n_cols),
+        dtype=np.float32,
+    ).tocsr()
+    weights.sum_duplicates()
+    return weights
+
+
+def to_source_index(
+    source_shape: Tuple[int, int], lon: np.ndarray, lat: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Fractional row and column in the source grid, 0 at the upper left corner."""
+    x0, y0 = radolan_grid.GRID_ORIGINS[tuple(source_shape)]
+    x, y = radolan_grid.to_xy(lon, lat)
+    return y0 + source_shape[0] - y, x - x0
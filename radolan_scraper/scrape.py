@@ -4,9 +4,14 @@ Downloading takes a few minutes and consumes 5G disk space.
 """
 import asyncio
 from contextlib import closing
+from datetime import date, datetime, timezone
+import io
 import logging
+import os
 from pathlib import Path
 import re
+import tarfile
+import time
 from typing import *
 
 import aiohttp
@@ -14,6 +19,17 @@ from yarl import URL
 
 logger = logging.getLogger(__name__)
 
+BASE_URL = URL(
+    "https://opendata.dwd.de/climate_environment/CDC/grids_germany/hourly/radolan/historical/asc/"
+)
+
+# Connections opened to the same host at once.
+LIMIT_PER_HOST = 8
+# Bytes collected before writing them to disk.
+BUFFER_SIZE = 4 * 1024**2
+# Bytes read from a response at once.
+READ_SIZE = 256 * 1024
+
 
 def main():
     base_data_dir = Path(__file__).parents[3] / "data" / "radolan"
@@ -26,60 +42,227 @@ def main():
     logger.info("Finished downlaoding radolan data")
 
 
-def run_in_loop(data_path, years, n_consumers=20):
+def run_in_loop(
+    data_path, years, n_consumers=20, base_url=BASE_URL, limit_per_host=LIMIT_PER_HOST
+):
     with closing(asyncio.get_event_loop()) as loop:
-        loop.run_until_complete(run(loop, data_path, years, n_consumers))
+        loop.run_until_complete(
+            run(loop, data_path, years, n_consumers, base_url, limit_per_host)
+        )
+
+
+def download_months_in_loop(
+    data_path: Path,
+    months: Iterable[date],
+    base_url: URL = BASE_URL,
+    limit_per_host: int = LIMIT_PER_HOST,
+    listing: Optional[Mapping[date, "ListingEntry"]] = None,
+) -> None:
+    """Download the tar files of single months.
+
+    Months with an entry in ``listing`` are checked against it like in ``run``, so
+    up to date files are skipped and interrupted downloads are resumed.
+    """
+    listing = listing or {}
+    downloads = [
+        (get_month_url(month, base_url), listing.get(month)) for month in months
+    ]
+
+    async def download_months():
+        stats = DownloadStats()
+        async with create_session(limit_per_host) as session:
+            await asyncio.gather(
+                *(
+                    download_one(session, data_path, url, entry, stats)
+                    for url, entry in downloads
+                )
+            )
+        stats.log()
+
+    with closing(asyncio.new_event_loop()) as loop:
+        loop.run_until_complete(download_months())
+
+
+def list_months_in_loop(
+    year: int, base_url: URL = BASE_URL
+) -> Dict[date, "ListingEntry"]:
+    """The month tars of ``year`` that are published, from the listing of the year."""
+
+    async def list_months():
+        async with create_session() as session:
+            return extract_listing(await fetch(session, base_url / str(year)))
+
+    with closing(asyncio.new_event_loop()) as loop:
+        entries = loop.run_until_complete(list_months())
+    return {
+        datetime.strptime(entry.name, "RW-%Y%m.tar").date(): entry
+        for entry in sorted(entries)
+    }
+
+
+class DownloadStats:
+    """Count the downloaded bytes to report the aggregate throughput."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.end = None
+        self.n_files = 0
+        self.n_bytes = 0
 
+    @property
+    def seconds(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
 
-async def run(loop, data_path, years, n_consumers=20):
-    base_url = URL(
-        "https://opendata.dwd.de/climate_environment/CDC/grids_germany/hourly/radolan/historical/asc/"
+    @property
+    def mb_per_s(self) -> float:
+        return self.n_bytes / 1024**2 / max(self.seconds, 1e-9)
+
+    def log(self):
+        self.end = time.perf_counter()
+        logger.info(
+            f"Downloaded {self.n_files} files with {self.n_bytes / 1024**2:.1f} MB "
+            f"in {self.seconds:.1f}s, {self.mb_per_s:.1f} MB/s"
+        )
+
+
+def create_session(limit_per_host: int = LIMIT_PER_HOST) -> aiohttp.ClientSession:
+    """Create a session whose connections are reused for all requests."""
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=None)
     )
+
+
+async def run(
+    loop,
+    data_path,
+    years,
+    n_consumers=20,
+    base_url=BASE_URL,
+    limit_per_host=LIMIT_PER_HOST,
+) -> "DownloadStats":
     urls = [base_url / str(year) for year in years]
     queue = asyncio.Queue()
-    # schedule the consumer
-    consumers = []
-    for _ in range(n_consumers):
-        consumer = loop.create_task(consume(queue, data_path))
-        consumers.append(consumer)
-    # run the producer and wait for completion
-    await produce(queue, urls)
-    # wait until the consumer has processed all items
-    await queue.join()
-    # the consumer is still awaiting for an item, cancel it
-    for consumer in consumers:
-        consumer.cancel()
-
-
-async def consume(queue, data_path: Path):
-    while True:
-        item = await queue.get()
+    stats = DownloadStats()
+    errors = []
+    async with create_session(limit_per_host) as session:
+        # schedule the consumer
+        consumers = []
+        for _ in range(n_consumers):
+            consumer = loop.create_task(
+                consume(queue, session, data_path, stats, errors)
+            )
+            consumers.append(consumer)
+        # run the producer and wait for completion
+        await produce(queue, session, urls)
+        # wait until the consumer has processed all items
+        await queue.join()
+        # the consumer is still awaiting for an item, cancel it
+        for consumer in consumers:
+            consumer.cancel()
+    stats.log()
+    if errors:
+        raise RuntimeError(
+            f"{len(errors)} downloads failed, the first with: {errors[0]}"
+        ) from errors[0]
+    return stats
+
 
-        logger.debug(f"Downloading {item}")
-        await download_one(data_path, item)
+async def consume(
+    queue,
+    session,
+    data_path: Path,
+    stats: Optional[DownloadStats],
+    errors: List[Exception],
+):
+    """Download the queued files until cancelled.
 
-        queue.task_done()
+    A failed download is logged and added to ``errors``, so that the remaining
+    files are still downloaded and ``run`` can raise once the queue is done.
+    """
+    while True:
+        url, entry = await queue.get()
+
+        try:
+            logger.debug(f"Downloading {url}")
+            await download_one(session, data_path, url, entry, stats)
+        except Exception as e:
+            logger.error(f"Downloading {url} failed: {e!r}")
+            errors.append(e)
+        finally:
+            queue.task_done()
 
 
-async def produce(queue, urls: List[URL]):
-    for url in urls:
+async def produce(queue, session, urls: List[URL]):
+    async def fetch_listing(url):
         logger.info(f"Extracting links for {url.name}")
-        async with aiohttp.ClientSession() as session:
-            text = await fetch(session, url)
-        filenames = extract_filenames(text)
-        for filename in filenames:
-            await queue.put(url / filename)
+        return url, await fetch(session, url)
+
+    # Fetch the listings of all years at once, so the consumers get busy early.
+    for next_listing in asyncio.as_completed([fetch_listing(url) for url in urls]):
+        url, text = await next_listing
+        for entry in extract_listing(text):
+            await queue.put((url / entry.name, entry))
+
+
+class ListingEntry(NamedTuple):
+    name: str
+    last_modified: datetime
+    size: int
+
+    @property
+    def mtime(self) -> float:
+        # The directory listing shows the modification time in UTC.
+        return self.last_modified.replace(tzinfo=timezone.utc).timestamp()
 
 
 def extract_filenames(table: str) -> List[str]:
     return re.findall(r">(.+\.tar)", table)
 
 
-async def download_one(data_path: Path, url: URL):
+def extract_listing(table: str) -> List[ListingEntry]:
+    """Extract the names, modification times and sizes from a directory listing."""
+    return [
+        ListingEntry(
+            name, datetime.strptime(last_modified, "%d-%b-%Y %H:%M"), int(size)
+        )
+        for name, last_modified, size in re.findall(
+            r">(.+\.tar)</a>\s+(\d\d-\w{3}-\d{4} \d\d:\d\d)\s+(\d+)", table
+        )
+    ]
+
+
+def is_up_to_date(filename: Path, entry: ListingEntry) -> bool:
+    """Check if a downloaded file matches the size and time in the listing."""
+    try:
+        stat = filename.stat()
+    except FileNotFoundError:
+        return False
+    return stat.st_size == entry.size and int(stat.st_mtime) == int(entry.mtime)
+
+
+async def download_one(
+    session,
+    data_path: Path,
+    url: URL,
+    entry: Optional[ListingEntry] = None,
+    stats: Optional[DownloadStats] = None,
+):
     filename = get_filename(data_path, url)
+    if entry is not None and is_up_to_date(filename, entry):
+        logger.debug(f"Skipping {url}, it is up to date")
+        return
+
     filename.parent.mkdir(parents=True, exist_ok=True)
-    async with aiohttp.ClientSession() as session:
-        await stream(session, url, filename)
+    size = entry.size if entry is not None else None
+    mtime = entry.mtime if entry is not None else None
+    n_bytes = await stream(session, url, filename, expected_size=size, mtime=mtime)
+    if entry is not None:
+        # Mark the file with the time of the listing, to recognize it next time.
+        os.utime(filename, (entry.mtime, entry.mtime))
+    if stats is not None:
+        stats.n_files += 1
+        stats.n_bytes += n_bytes
 
 
 async def fetch(session, url):
@@ -87,14 +270,165 @@ async def fetch(session, url):
         return await response.text()
 
 
-async def stream(session, url, filename, chunk_size=20):
+async def stream(
+    session, url, filename, buffer_size=BUFFER_SIZE, expected_size=None, mtime=None
+) -> int:
+    """Download ``url`` to ``filename``, resuming an earlier interrupted download.
+
+    The data is written to a ``.part`` file next to ``filename``, which is only
+    renamed once the download completed. The ``.part`` file is stamped with
+    ``mtime``, the modification time of the file in the listing. If a ``.part``
+    file with the same stamp already exists, only the missing bytes are requested.
+    Other ``.part`` files may belong to an earlier version of the file and are
+    discarded. The body is collected into blocks of ``buffer_size`` bytes, which
+    are written in a thread to keep the event loop free. Returns the number of
+    downloaded bytes.
+    """
+    loop = asyncio.get_running_loop()
+    part_filename = filename.with_name(filename.name + ".part")
+    offset = 0
+    if part_filename.exists():
+        if mtime is not None and int(part_filename.stat().st_mtime) == int(mtime):
+            offset = part_filename.stat().st_size
+        else:
+            logger.info(f"Discarding {part_filename} of another version of {url}")
+            part_filename.unlink()
+    n_bytes = 0
+    if expected_size is None or offset < expected_size:
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            # The server may ignore the range and send the whole file.
+            mode = "ab" if response.status == 206 else "wb"
+            with open(part_filename, mode) as fd:
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(READ_SIZE):
+                    buffer += chunk
+                    if len(buffer) >= buffer_size:
+                        await loop.run_in_executor(None, write_block, fd, buffer, mtime)
+                        n_bytes += len(buffer)
+                        buffer = bytearray()
+                await loop.run_in_executor(None, write_block, fd, buffer, mtime)
+                n_bytes += len(buffer)
+
+    if expected_size is not None and part_filename.stat().st_size != expected_size:
+        part_filename.unlink()
+        raise RuntimeError(f"Downloaded {url} does not have the expected size.")
+    os.replace(part_filename, filename)
+    return n_bytes
+
+
+def write_block(fd: IO[bytes], block: bytes, mtime: Optional[float]) -> None:
+    """Append ``block`` to a ``.part`` file and stamp it with ``mtime`` again.
+
+    Stamping after every block leaves the stamp in place when the download is
+    interrupted at any point.
+    """
+    fd.write(block)
+    if mtime is not None:
+        fd.flush()
+        os.utime(fd.fileno(), (mtime, mtime))
+
+
+def stream_year_in_loop(
+    year: int,
+    handle_member: Callable[[str, IO[bytes]], None],
+    data_path: Optional[Path] = None,
+    base_url: URL = BASE_URL,
+    keep: Callable[[ListingEntry], bool] = lambda entry: True,
+) -> None:
+    """Pass the members of the month tars of ``year`` to ``handle_member``.
+
+    The months are streamed one after another in the order of their names, and
+    their members are read straight from the responses, in the order in which they
+    are stored. ``handle_member`` runs in a worker thread, so decoding overlaps with
+    the download. Only months for which ``keep`` is true are streamed. If
+    ``data_path`` is given, the month tars are also stored there, as ``run`` would.
+    """
+
+    async def stream_year():
+        url = base_url / str(year)
+        async with create_session() as session:
+            entries = sorted(extract_listing(await fetch(session, url)))
+            for entry in entries:
+                if not keep(entry):
+                    continue
+                month_url = url / entry.name
+                store_to = None
+                if data_path is not None:
+                    store_to = get_filename(data_path, month_url)
+                logger.info(f"Streaming {month_url}")
+                await stream_tar(session, month_url, handle_member, store_to, entry)
+
+    with closing(asyncio.new_event_loop()) as loop:
+        loop.run_until_complete(stream_year())
+
+
+async def stream_tar(
+    session,
+    url: URL,
+    handle_member: Callable[[str, IO[bytes]], None],
+    store_to: Optional[Path] = None,
+    entry: Optional[ListingEntry] = None,
+) -> None:
+    """Read the tar file at ``url`` member by member while it is downloaded."""
+    loop = asyncio.get_running_loop()
     async with session.get(url) as response:
-        with open(filename, "wb") as fd:
-            while True:
-                chunk = await response.content.read(chunk_size)
-                if not chunk:
-                    break
-                fd.write(chunk)
+        response.raise_for_status()
+        if store_to is None:
+            reader = ResponseReader(response, loop)
+            await loop.run_in_executor(None, read_tar_stream, reader, handle_member)
+            return
+
+        store_to.parent.mkdir(parents=True, exist_ok=True)
+        part_filename = store_to.with_name(store_to.name + ".part")
+        with open(part_filename, "wb") as fd:
+            reader = ResponseReader(response, loop, copy_to=fd)
+            await loop.run_in_executor(None, read_tar_stream, reader, handle_member)
+    os.replace(part_filename, store_to)
+    if entry is not None:
+        os.utime(store_to, (entry.mtime, entry.mtime))
+
+
+class ResponseReader(io.RawIOBase):
+    """Blocking file interface to a response, for use outside of the event loop.
+
+    Everything read is also written to ``copy_to``, if given.
+    """
+
+    def __init__(self, response, loop, copy_to: Optional[IO[bytes]] = None):
+        super().__init__()
+        self.response = response
+        self.loop = loop
+        self.copy_to = copy_to
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        read = self.response.content.read(len(b))
+        data = asyncio.run_coroutine_threadsafe(read, self.loop).result()
+        b[: len(data)] = data
+        if self.copy_to is not None:
+            self.copy_to.write(data)
+        return len(data)
+
+
+def read_tar_stream(
+    reader: ResponseReader, handle_member: Callable[[str, IO[bytes]], None]
+) -> None:
+    fileobj = io.BufferedReader(reader, buffer_size=READ_SIZE)
+    with tarfile.open(fileobj=fileobj, mode="r|") as tf:
+        for member in tf:
+            if member.isfile():
+                handle_member(member.name, tf.extractfile(member))
+    # Read the padding after the last member, to store the complete file.
+    while fileobj.read(READ_SIZE):
+        pass
+
+
+def get_month_url(month: date, base_url: URL = BASE_URL) -> URL:
+    return base_url / str(month.year) / f"RW-{month:%Y%m}.tar"
 
 
 def get_filename(data_path: Path, url: URL) -> Path:
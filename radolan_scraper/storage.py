@@ -0,0 +1,109 @@
+"""On disk layout of the ``rain`` variable.
+
+The RW ascii files contain integer precipitation heights in tenths of a millimeter.
+Storing them as 64 bit integers, as the ``legacy`` profile does, wastes most of the
+space, so the ``compact`` profile packs them into 16 bit integers and declares the
+CF ``scale_factor`` that turns them into mm/h. Reading the data with ``xarray``
+applies the scale factor automatically.
+"""
+from typing import *
+
+import h5netcdf
+import numpy as np
+
+
+class StorageProfile(NamedTuple):
+    dtype: str
+    scale_factor: Optional[float]
+    codec: str
+    shuffle: bool
+
+
+PROFILES = {
+    "legacy": StorageProfile("int64", None, "lzf", False),
+    "compact": StorageProfile("int16", 0.1, "lzf", True),
+}
+
+CODECS = ("none", "lzf", "gzip", "zstd", "blosc")
+
+FILL_VALUE = -1
+
+
+def get_profile(name: str, codec: Optional[str] = None) -> StorageProfile:
+    """Look up a storage profile, optionally overriding its codec."""
+    try:
+        profile = PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage profile {name}, choose one of {tuple(PROFILES)}."
+        )
+    if codec:
+        # Fail early on unknown or unavailable codecs.
+        codec_kwargs(codec)
+        profile = profile._replace(codec=codec)
+    return profile
+
+
+def codec_kwargs(codec: str) -> Dict[str, Any]:
+    """Translate a codec like ``gzip:6`` into ``h5py`` dataset arguments.
+
+    The part after the colon is the compression level. ``zstd`` and ``blosc`` are
+    only available if ``hdf5plugin`` is installed.
+    """
+    name, _, level = codec.partition(":")
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {codec}, choose one of {CODECS}.")
+    if name == "none":
+        return {}
+    if name == "lzf":
+        return {"compression": "lzf"}
+    if name == "gzip":
+        return {"compression": "gzip", "compression_opts": int(level or 4)}
+
+    try:
+        import hdf5plugin
+    except ImportError:
+        raise ValueError(f"The {name} codec requires hdf5plugin to be installed.")
+    if name == "zstd":
+        return dict(hdf5plugin.Zstd(clevel=int(level or 3)))
+    return dict(
+        hdf5plugin.Blosc(
+            cname="lz4", clevel=int(level or 5), shuffle=hdf5plugin.Blosc.NOSHUFFLE
+        )
+    )
+
+
+def create_rain_variable(
+    f: h5netcdf.File, profile: StorageProfile, chunks: Any = True
+) -> h5netcdf.Variable:
+    rain_var = f.create_variable(
+        "rain",
+        dimensions=("time", "y", "x"),
+        dtype=profile.dtype,
+        chunks=chunks,
+        shuffle=profile.shuffle,
+        **codec_kwargs(profile.codec),
+    )
+    rain_var.attrs["units"] = "mm/h"
+    rain_var.attrs["_FillValue"] = np.array(FILL_VALUE, dtype=profile.dtype)
+    if profile.scale_factor is not None:
+        rain_var.attrs["scale_factor"] = np.float32(profile.scale_factor)
+    return rain_var
+
+
+def check_compatible(rain_var: h5netcdf.Variable, profile: StorageProfile) -> None:
+    """Make sure data stored in ``rain_var`` keeps its meaning in ``profile``."""
+    scale_factor = rain_var.attrs.get("scale_factor")
+    if scale_factor is not None:
+        scale_factor = float(scale_factor)
+    if profile.scale_factor is None and scale_factor is None:
+        return
+    if (
+        profile.scale_factor is None
+        or scale_factor is None
+        or not np.isclose(scale_factor, profile.scale_factor)
+    ):
+        raise ValueError(
+            f"Data with scale factor {scale_factor} can not be stored "
+            f"with scale factor {profile.scale_factor}."
+        )
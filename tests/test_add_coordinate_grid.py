@@ -0,0 +1,85 @@
+import h5netcdf
+import numpy as np
+
+import radolan_scraper.add_coordinate_grid
+import radolan_scraper.radolan_grid
+
+
+def write_definitions(path, values, per_line=10):
+    fields = [f"{value:8.4f}" for value in values.flatten()]
+    lines = [
+        "".join(fields[i : i + per_line]) + " \n"
+        for i in range(0, len(fields), per_line)
+    ]
+    path.write_text("".join(lines))
+
+
+def get_signed_areas(xv: np.ndarray, yv: np.ndarray) -> np.ndarray:
+    """Shoelace areas of the cells, positive if their corners run anticlockwise."""
+    return (xv * np.roll(yv, -1, axis=-1) - np.roll(xv, -1, axis=-1) * yv).sum(
+        axis=-1
+    ) / 2
+
+
+def test_parse_fixed_width():
+    data = b" 46.9526 47.0001\n-12.3456  1.0000 \r\n"
+    np.testing.assert_array_equal(
+        radolan_scraper.add_coordinate_grid.parse_fixed_width(data),
+        [46.9526, 47.0001, -12.3456, 1.0],
+    )
+
+
+def test_get_cell_bounds_of_linear_grid():
+    y, x = np.mgrid[0:3, 0:4]
+    centers = 10.0 + 2 * x + 0.5 * y
+    bounds = radolan_scraper.add_coordinate_grid.get_cell_bounds(centers)
+    assert bounds.shape == (3, 4, 4)
+    np.testing.assert_allclose(bounds[0, 0], [9.25, 11.25, 10.75, 8.75])
+    np.testing.assert_allclose(bounds.mean(axis=-1), centers)
+
+
+def test_get_cell_bounds_run_anticlockwise():
+    grid = radolan_scraper.radolan_grid.get_grid((900, 900))
+    xv = radolan_scraper.add_coordinate_grid.get_cell_bounds(grid.xc)
+    yv = radolan_scraper.add_coordinate_grid.get_cell_bounds(grid.yc)
+    assert (get_signed_areas(xv, yv) > 0).all()
+
+
+def test_run_adds_grid_and_caches_definitions(tmp_path):
+    rng = np.random.RandomState(0)
+    longitudes = rng.uniform(3, 15, (900, 900))
+    latitudes = rng.uniform(46, 55, (900, 900))
+    write_definitions(tmp_path / "lambda_center.txt", longitudes)
+    write_definitions(tmp_path / "phi_center.txt", latitudes)
+    add_grid_to = tmp_path / "combined.nc"
+    with h5netcdf.File(add_grid_to, "w") as f:
+        f.dimensions = {"time": 1, "y": 900, "x": 900}
+        f.create_variable("rain", ("time", "y", "x"), dtype="int16")
+
+    for _ in range(2):
+        radolan_scraper.add_coordinate_grid.run(
+            add_grid_to, tmp_path / "phi_center.txt", tmp_path / "lambda_center.txt"
+        )
+
+    assert len(list(tmp_path.glob("*.txt.*.npy"))) == 2
+    with h5netcdf.File(add_grid_to, "r") as f:
+        np.testing.assert_allclose(f["xc"][...], longitudes[::-1], atol=1e-4)
+        np.testing.assert_allclose(f["yc"][...], latitudes[::-1], atol=1e-4)
+        assert f["xv"].shape == (900, 900, 4)
+        assert f["yv"].dimensions == ("y", "x", "nv")
+        assert f["rain"].attrs["coordinates"] == "yc xc"
+
+
+def test_run_computes_grid_without_definitions(tmp_path):
+    add_grid_to = tmp_path / "combined.nc"
+    with h5netcdf.File(add_grid_to, "w") as f:
+        f.dimensions = {"time": 1, "y": 1100, "x": 900}
+        f.create_variable("rain", ("time", "y", "x"), dtype="int16")
+
+    radolan_scraper.add_coordinate_grid.run(add_grid_to)
+
+    with h5netcdf.File(add_grid_to, "r") as f:
+        assert f["xc"].shape == (1100, 900)
+        assert f["yv"].shape == (1100, 900, 4)
+        # The first row is the northernmost one.
+        assert f["yc"][0, 450] > f["yc"][-1, 450]
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import h5netcdf
+import numpy as np
+
+import radolan_scraper.aggregate
+import radolan_scraper.collect
+import radolan_scraper.storage
+
+TIME_UNIT = radolan_scraper.collect.TIME_UNIT
+
+
+def make_combined(path, rain, times):
+    profile = radolan_scraper.storage.get_profile("compact")
+    with h5netcdf.File(path, "w") as f:
+        f.dimensions["time"] = None
+        f.dimensions["y"] = rain.shape[1]
+        f.dimensions["x"] = rain.shape[2]
+        time_var = f.create_variable("time", dimensions=("time",), dtype=int)
+        time_var.attrs["units"] = TIME_UNIT.name
+        radolan_scraper.storage.create_rain_variable(f, profile, (5, 3, 4))
+        f.resize_dimension("time", len(times))
+        f["time"][...] = TIME_UNIT.date2num(times)
+        f["rain"][...] = rain
+
+
+def expected_aggregates(rain, keys):
+    sums, maxima, counts = [], [], []
+    for key in np.unique(keys):
+        period = rain[keys == key]
+        valid = period >= 0
+        count = valid.sum(axis=0)
+        sums.append(np.where(count > 0, np.where(valid, period, 0).sum(axis=0), -1))
+        maxima.append(np.where(count > 0, period.max(axis=0), -1))
+        counts.append(count)
+    return np.stack(sums), np.stack(maxima), np.stack(counts)
+
+
+def check_aggregates(path, rain, times):
+    times = np.array(times, dtype="M8[m]")
+    with h5netcdf.File(path, "r") as f:
+        for name, dim, unit in radolan_scraper.aggregate.LEVELS:
+            keys = times.astype(f"M8[{unit}]")
+            sums, maxima, counts = expected_aggregates(rain, keys)
+            np.testing.assert_array_equal(
+                f[dim][...], np.unique(keys).astype("M8[D]").astype(int)
+            )
+            np.testing.assert_array_equal(f[f"rain_{name}_sum"]._h5ds[...], sums)
+            np.testing.assert_array_equal(f[f"rain_{name}_max"]._h5ds[...], maxima)
+            np.testing.assert_array_equal(f[f"rain_{name}_count"][...], counts)
+
+
+def test_aggregate_and_update(tmp_path, monkeypatch):
+    # Write the periods in several blocks.
+    monkeypatch.setattr(radolan_scraper.aggregate, "CHUNKS", (2, 100, 100))
+    rng = np.random.RandomState(0)
+    # Hourly frames over the turn of a year, with a gap of two days.
+    times = [datetime(2015, 12, 30, 0, 50) + timedelta(hours=h) for h in range(60)]
+    times += [datetime(2016, 1, 3, 0, 50) + timedelta(hours=h) for h in range(30)]
+    rain = rng.randint(0, 30, size=(len(times), 6, 8))
+    rain[rng.rand(*rain.shape) < 0.3] = -1
+    # A pixel that is missing all day long.
+    rain[:24, 0, 0] = -1
+
+    make_combined(tmp_path / "combined.nc", rain[:70], times[:70])
+    radolan_scraper.aggregate.run(
+        tmp_path / "combined.nc", tmp_path / "aggregates.nc", memory_limit=1
+    )
+    check_aggregates(tmp_path / "aggregates.nc", rain[:70], times[:70])
+
+    # New frames continue the last day, month and year.
+    make_combined(tmp_path / "combined.nc", rain, times)
+    n_frames = radolan_scraper.aggregate.run(
+        tmp_path / "combined.nc", tmp_path / "aggregates.nc"
+    )
+    assert n_frames == 20
+    check_aggregates(tmp_path / "aggregates.nc", rain, times)
+    assert (
+        radolan_scraper.aggregate.run(
+            tmp_path / "combined.nc", tmp_path / "aggregates.nc"
+        )
+        == 0
+    )
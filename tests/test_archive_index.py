@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import radolan_scraper.archive_index
+from test_collect import make_frame, make_month_tar
+
+
+def test_index_is_stored_and_invalidated(tmp_path):
+    tar_file = tmp_path / "RW-201601.tar"
+    frames = [make_frame(seed, (20, 30)) for seed in range(5)]
+    make_month_tar(tar_file, "201601", {"02": frames[:3], "01": frames[3:]})
+
+    assert radolan_scraper.archive_index.load(tar_file) is None
+    month_index = radolan_scraper.archive_index.get(tar_file)
+
+    assert month_index.n_frames == 5
+    assert [day.name for day in month_index.days] == [
+        "RW-20160101.tar.gz",
+        "RW-20160102.tar.gz",
+    ]
+    assert radolan_scraper.archive_index.load(tar_file) == month_index
+
+    with open(tar_file, "rb") as raw:
+        day = month_index.days[1]
+        day_bytes = radolan_scraper.archive_index.read_day(raw, day)
+    hour = day.hours[2]
+    data = radolan_scraper.archive_index.hour_bytes(day_bytes, hour)
+    assert hour.name == "RW_20160102-0250.asc"
+    assert data.startswith(b"ncols")
+
+    stat = tar_file.stat()
+    os.utime(tar_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert radolan_scraper.archive_index.load(tar_file) is None
+
+
+def test_concurrent_saves(tmp_path):
+    tar_file = tmp_path / "RW-201601.tar"
+    make_month_tar(tar_file, "201601", {"01": [make_frame(0, (20, 30))]})
+    days = radolan_scraper.archive_index.get(tar_file).days
+
+    with ThreadPoolExecutor(4) as executor:
+        for future in [
+            executor.submit(radolan_scraper.archive_index.save, tar_file, days)
+            for _ in range(50)
+        ]:
+            future.result()
+    assert radolan_scraper.archive_index.load(tar_file).days == days
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "RW-201601.tar",
+        "RW-201601.tar.index.json",
+    ]
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+import h5netcdf
+import numpy as np
+
+import radolan_scraper.climatology
+from test_aggregate import make_combined
+
+
+def longest_dry_spell(series, gaps):
+    longest = current = 0
+    for value, gap in zip(series, gaps):
+        current = current + 1 if value == 0 and not gap else (value == 0) * 1
+        longest = max(longest, current)
+    return longest
+
+
+def test_statistics_match_numpy(tmp_path, monkeypatch):
+    monkeypatch.setattr(radolan_scraper.climatology, "TILE_SIZE", 4)
+    rng = np.random.RandomState(0)
+    times = [datetime(2016, 1, 1, 0, 50) + timedelta(hours=h) for h in range(80)]
+    times += [datetime(2016, 1, 10, 0, 50) + timedelta(hours=h) for h in range(40)]
+    rain = rng.randint(0, 150, size=(len(times), 6, 8))
+    rain[rng.rand(*rain.shape) < 0.6] = 0
+    rain[rng.rand(*rain.shape) < 0.05] = -1
+    rain[:, 0, 0] = -1
+    make_combined(tmp_path / "combined.nc", rain, times)
+
+    radolan_scraper.climatology.run(
+        tmp_path / "combined.nc", n_workers=2, memory_limit=1
+    )
+
+    gaps = np.zeros(len(times), dtype=bool)
+    gaps[80] = True
+    with h5netcdf.File(tmp_path / "combined.nc", "r") as f:
+        p95 = f["rain_p95"]._h5ds[...]
+        above = f["rain_hours_above_1mm"][...]
+        dry = f["rain_longest_dry_spell"][...]
+        valid_hours = f["rain_valid_hours"][...]
+    assert p95[0, 0] == -1
+    for y in range(6):
+        for x in range(8):
+            series = rain[:, y, x]
+            valid = series[series >= 0]
+            assert valid_hours[y, x] == len(valid)
+            assert above[y, x] == (valid > 10).sum()
+            assert dry[y, x] == longest_dry_spell(series, gaps)
+            if len(valid) and valid.max() < 128:
+                assert p95[y, x] == np.percentile(valid, 95, method="inverted_cdf")
+
+
+def test_blocks_and_large_quantiles():
+    rng = np.random.RandomState(1)
+    frames = rng.randint(0, 5000, size=(200, 2, 3))
+    stats = radolan_scraper.climatology.PixelStatistics((2, 3), [10])
+    stats.update(frames[:120], frames[:120] >= 0, np.zeros(120, dtype=bool))
+    stats.update(frames[120:], frames[120:] >= 0, np.zeros(80, dtype=bool))
+
+    exact = np.percentile(frames, 99, axis=0, method="inverted_cdf")
+    approximate = stats.quantile(0.99)
+    assert (approximate <= exact).all()
+    assert (approximate >= exact / 1.02 - 1).all()
+    np.testing.assert_array_equal(stats.exceedances[0], (frames > 10).sum(axis=0))
+
+
+def test_dry_spells_continue_across_blocks():
+    rng = np.random.RandomState(2)
+    frames = rng.randint(0, 3, size=(300, 3, 4))
+    frames[frames == 1] = 0
+    frames[rng.rand(*frames.shape) < 0.02] = -1
+    frames[40:200, 1, 2] = 0
+    gaps = rng.rand(len(frames)) < 0.02
+    gaps[[0, 100]] = True
+    stats = radolan_scraper.climatology.PixelStatistics((3, 4), [10])
+    for start in range(0, len(frames), 50):
+        block = frames[start : start + 50]
+        stats.update(block, block >= 0, gaps[start : start + 50])
+
+    for y in range(3):
+        for x in range(4):
+            expected = longest_dry_spell(frames[:, y, x], gaps)
+            assert stats.longest_dry_spell[y, x] == expected
+
+
+def test_merging_halves_matches_one_pass():
+    rng = np.random.RandomState(3)
+    frames = rng.randint(0, 3, size=(240, 4, 5))
+    frames[frames == 1] = 0
+    frames[rng.rand(*frames.shape) < 0.02] = -1
+    # Spells that run across the middle, one of them through a gap.
+    frames[60:180, 0, 0] = 0
+    frames[:, 1, 1] = 0
+    gaps = rng.rand(len(frames)) < 0.02
+    gaps[0] = True
+
+    def compute(*parts):
+        stats = radolan_scraper.climatology.PixelStatistics((4, 5), [1])
+        for part in parts:
+            part_stats = radolan_scraper.climatology.PixelStatistics((4, 5), [1])
+            part_stats.update(frames[part], frames[part] >= 0, gaps[part])
+            stats.merge(part_stats)
+        return stats
+
+    one_pass = compute(slice(0, 240))
+    for middle in (120, 150):
+        halves = compute(slice(0, middle), slice(middle, 240))
+        for name in ("histogram", "exceedances", "dry_spell", "longest_dry_spell"):
+            np.testing.assert_array_equal(
+                getattr(halves, name), getattr(one_pass, name)
+            )
+    for y in range(4):
+        for x in range(5):
+            expected = longest_dry_spell(frames[:, y, x], gaps)
+            assert one_pass.longest_dry_spell[y, x] == expected
@@ -0,0 +1,238 @@
+from datetime import datetime
+import io
+import tarfile
+
+import h5netcdf
+import numpy as np
+import pytest
+import rasterio
+
+from benchmarks.dwd_server import serve_in_thread
+import radolan_scraper.ascii_grid
+import radolan_scraper.collect
+
+
+def make_frame(seed: int, shape=(900, 900)) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    frame = rng.randint(0, 500, size=shape)
+    frame[rng.rand(*shape) < 0.8] = 0
+    frame[: shape[0] // 20] = -1
+    return frame
+
+
+def to_asc(frame: np.ndarray) -> bytes:
+    header = (
+        f"ncols         {frame.shape[1]}\n"
+        f"nrows         {frame.shape[0]}\n"
+        "xllcorner     -523462\n"
+        "yllcorner     -4658645\n"
+        "cellsize      1000\n"
+        "NODATA_value  -1\n"
+    )
+    body = "\n".join(" ".join(map(str, row)) for row in frame)
+    return (header + body + "\n").encode()
+
+
+def add_member(tar_file: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar_file.addfile(info, io.BytesIO(data))
+
+
+def make_day_tar_gz(frames, day: str = "20160101") -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(mode="w:gz", fileobj=buffer) as day_tar_file:
+        for hour, frame in enumerate(frames):
+            add_member(day_tar_file, f"RW_{day}-{hour:02d}50.asc", to_asc(frame))
+    buffer.seek(0)
+    return buffer
+
+
+def make_month_tar(path, month: str, days) -> None:
+    with tarfile.open(path, "w") as month_tar_file:
+        for day, frames in days.items():
+            add_member(
+                month_tar_file,
+                f"RW-{month}{day}.tar.gz",
+                make_day_tar_gz(frames, month + day).getvalue(),
+            )
+
+
+def test_read_frame_matches_rasterio():
+    data = to_asc(make_frame(0))
+
+    arr, header = radolan_scraper.ascii_grid.read_frame(data)
+
+    with rasterio.open(io.BytesIO(data)) as raster:
+        np.testing.assert_array_equal(arr, raster.read(1))
+        assert header.bounds == tuple(raster.bounds)
+        assert header.nodata_value == raster.nodata
+
+
+def test_collect_day_decoders_agree():
+    frames = [make_frame(seed) for seed in range(3)]
+
+    native_arrs, native_times = radolan_scraper.collect.collect_day(
+        make_day_tar_gz(frames), set(), "native"
+    )
+    rasterio_arrs, rasterio_times = radolan_scraper.collect.collect_day(
+        make_day_tar_gz(frames), set(), "rasterio"
+    )
+
+    assert native_times == rasterio_times
+    np.testing.assert_array_equal(native_arrs, np.stack(rasterio_arrs))
+    np.testing.assert_array_equal(native_arrs, np.stack(frames))
+
+
+def test_collect_year_parallel_keeps_order(tmp_path):
+    shape = (30, 40)
+    frames = [make_frame(seed, shape) for seed in range(16)]
+    make_month_tar(
+        tmp_path / "RW-201601.tar",
+        "201601",
+        {f"{day:02d}": frames[2 * day : 2 * day + 2] for day in range(1, 8)},
+    )
+    make_month_tar(tmp_path / "RW-201602.tar", "201602", {"03": frames[:1]})
+    tar_files = sorted(tmp_path.glob("*.tar"))
+
+    sequential = list(radolan_scraper.collect.collect_year(tar_files))
+    parallel = list(
+        radolan_scraper.collect.collect_year_parallel(
+            tar_files, n_workers=3, max_days_in_flight=2
+        )
+    )
+
+    assert [times for _, times in parallel] == [times for _, times in sequential]
+    for (parallel_arrs, _), (sequential_arrs, _) in zip(parallel, sequential):
+        np.testing.assert_array_equal(parallel_arrs, sequential_arrs)
+
+
+def test_collect_append(tmp_path):
+    frames = [make_frame(seed) for seed in range(3)]
+    raw_data_path = tmp_path / "raw"
+    raw_data_path.mkdir()
+    make_month_tar(raw_data_path / "RW-201601.tar", "201601", {"31": frames[:2]})
+    radolan_scraper.collect.run(tmp_path / "2016.nc", raw_data_path)
+
+    make_month_tar(raw_data_path / "RW-201602.tar", "201602", {"01": frames[2:]})
+    radolan_scraper.collect.run(tmp_path / "2016.nc", raw_data_path, append=True)
+
+    with h5netcdf.File(tmp_path / "2016.nc", "r") as f:
+        np.testing.assert_array_equal(f["rain"][...], np.stack(frames))
+        assert np.all(np.diff(f["time"][...]) > 0)
+
+
+def test_collect_resumes_after_crash(tmp_path, monkeypatch):
+    frames = [make_frame(seed) for seed in range(3)]
+    raw_data_path = tmp_path / "raw"
+    raw_data_path.mkdir()
+    days = {"01": frames[:1], "02": frames[1:2], "03": frames[2:]}
+    make_month_tar(raw_data_path / "RW-201601.tar", "201601", days)
+    collect_to = tmp_path / "2016.nc"
+
+    # Crash after the second day was written, but before it was checkpointed.
+    save_checkpoint = radolan_scraper.collect.save_checkpoint
+    n_checkpoints = 0
+
+    def crash_on_second_checkpoint(*args):
+        nonlocal n_checkpoints
+        n_checkpoints += 1
+        if n_checkpoints == 2:
+            raise KeyboardInterrupt
+        save_checkpoint(*args)
+
+    monkeypatch.setattr(
+        radolan_scraper.collect, "save_checkpoint", crash_on_second_checkpoint
+    )
+    with pytest.raises(KeyboardInterrupt):
+        radolan_scraper.collect.run(collect_to, raw_data_path)
+    assert not collect_to.exists()
+    assert radolan_scraper.collect.load_checkpoint(
+        tmp_path / "2016.nc.part"
+    ) == radolan_scraper.collect.Checkpoint(1, datetime(2016, 1, 1, 0, 50))
+
+    monkeypatch.undo()
+    decoded = []
+    decode_day = radolan_scraper.collect.decode_day
+    monkeypatch.setattr(
+        radolan_scraper.collect,
+        "decode_day",
+        lambda day_bytes, hours, *args: decoded.extend(hours)
+        or decode_day(day_bytes, hours, *args),
+    )
+    radolan_scraper.collect.run(collect_to, raw_data_path)
+    assert [hour.time.day for hour in decoded] == [2, 3]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["2016.nc", "raw"]
+    with h5netcdf.File(collect_to, "r") as f:
+        np.testing.assert_array_equal(f["rain"][...], np.stack(frames))
+
+
+def test_append_recovers_from_crash(tmp_path, monkeypatch):
+    frames = [make_frame(seed) for seed in range(3)]
+    raw_data_path = tmp_path / "raw"
+    raw_data_path.mkdir()
+    make_month_tar(raw_data_path / "RW-201601.tar", "201601", {"31": frames[:1]})
+    collect_to = tmp_path / "2016.nc"
+    radolan_scraper.collect.run(collect_to, raw_data_path)
+
+    # Crash after the time dimension was extended, but before the frames were
+    # written.
+    days = {"01": frames[1:2], "02": frames[2:]}
+    make_month_tar(raw_data_path / "RW-201602.tar", "201602", days)
+
+    def crash(*args):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(radolan_scraper.collect, "write_to_netcdf", crash)
+    with pytest.raises(KeyboardInterrupt):
+        radolan_scraper.collect.run(collect_to, raw_data_path, append=True)
+    with h5netcdf.File(collect_to, "r") as f:
+        assert len(f["time"]) == 2
+    assert radolan_scraper.collect.load_checkpoint(
+        collect_to
+    ) == radolan_scraper.collect.Checkpoint(1, datetime(2016, 1, 31, 0, 50))
+
+    monkeypatch.undo()
+    radolan_scraper.collect.run(collect_to, raw_data_path, append=True)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["2016.nc", "raw"]
+    with h5netcdf.File(collect_to, "r") as f:
+        np.testing.assert_array_equal(f["rain"][...], np.stack(frames))
+        assert np.all(np.diff(f["time"][...]) > 0)
+
+
+def test_run_streaming_matches_run(tmp_path):
+    server_root = tmp_path / "server"
+    (server_root / "2016").mkdir(parents=True)
+    seed = 0
+    for month in ("201601", "201602"):
+        days = {}
+        for day in ("01", "02"):
+            days[day] = [make_frame(seed), make_frame(seed + 1)]
+            seed += 2
+        make_month_tar(server_root / "2016" / f"RW-{month}.tar", month, days)
+    collect_to = tmp_path / "collected.nc"
+    radolan_scraper.collect.run(collect_to, server_root / "2016")
+
+    streamed = tmp_path / "streamed.nc"
+    raw_data_path = tmp_path / "raw"
+    with serve_in_thread(server_root) as server:
+        radolan_scraper.collect.run_streaming(
+            streamed, 2016, raw_data_path=raw_data_path, base_url=server.base_url
+        )
+        # Appending skips the months before the last stored frame.
+        n_requests = len(server.requests)
+        radolan_scraper.collect.run_streaming(
+            streamed, 2016, append=True, base_url=server.base_url
+        )
+        paths = [path for path, _ in server.requests[n_requests:]]
+        assert [path.rsplit("/", 1)[1] for path in paths] == ["", "RW-201602.tar"]
+
+    with h5netcdf.File(collect_to, "r") as expected, h5netcdf.File(
+        streamed, "r"
+    ) as actual:
+        assert len(actual["time"]) == 8
+        np.testing.assert_array_equal(actual["time"][:], expected["time"][:])
+        np.testing.assert_array_equal(actual["rain"][:], expected["rain"][:])
+    for month in ("201601", "201602"):
+        name = f"2016/RW-{month}.tar"
+        assert (raw_data_path / name).read_bytes() == (server_root / name).read_bytes()
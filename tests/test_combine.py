@@ -0,0 +1,100 @@
+import h5netcdf
+import numpy as np
+import pytest
+
+import radolan_scraper.add_coordinate_grid
+import radolan_scraper.combine
+import radolan_scraper.radolan_grid
+import radolan_scraper.storage
+
+
+def make_year(path, rain, time, codec="lzf", chunks=(1, 4, 5)):
+    profile = radolan_scraper.storage.get_profile("compact", codec)
+    with h5netcdf.File(path, "w") as f:
+        f.dimensions["time"] = rain.shape[0]
+        f.dimensions["y"] = rain.shape[1]
+        f.dimensions["x"] = rain.shape[2]
+        f.create_variable("time", dimensions=("time",), data=time)
+        rain_var = radolan_scraper.storage.create_rain_variable(f, profile, chunks)
+        rain_var[...] = rain
+
+
+@pytest.mark.parametrize(
+    "codec,chunks,n_chunk_copies",
+    [
+        ("lzf", (1, 4, 5), 2),
+        ("gzip:2", (1, 4, 5), 1),
+        ("lzf", (3, 8, 10), 0),
+    ],
+)
+def test_combine(tmp_path, monkeypatch, codec, chunks, n_chunk_copies):
+    rng = np.random.RandomState(0)
+    rain = rng.randint(-1, 50, size=(7, 8, 10))
+    make_year(tmp_path / "2015.nc", rain[:3], np.arange(3))
+    make_year(tmp_path / "2016.nc", rain[3:], np.arange(3, 7), codec, chunks)
+
+    copy_chunks = radolan_scraper.combine.copy_chunks
+    copied = []
+    monkeypatch.setattr(
+        radolan_scraper.combine,
+        "copy_chunks",
+        lambda *args: copied.append(args) or copy_chunks(*args),
+    )
+    combine_to = tmp_path / "combined.nc"
+    radolan_scraper.combine.run(
+        combine_to,
+        [tmp_path / "2015.nc", tmp_path / "2016.nc"],
+        radolan_scraper.storage.get_profile("compact"),
+    )
+
+    assert len(copied) == n_chunk_copies
+    with h5netcdf.File(combine_to, "r") as f:
+        np.testing.assert_array_equal(f["rain"][...], rain)
+        np.testing.assert_array_equal(f["time"][...], np.arange(7))
+
+
+def test_combine_virtual(tmp_path, monkeypatch):
+    # The coordinate grid is only known for the shapes of the RADOLAN products.
+    rain = np.random.RandomState(0).randint(-1, 50, size=(7, 900, 900))
+    chunks = (1, 300, 300)
+    make_year(tmp_path / "2015.nc", rain[:3], np.arange(3), chunks=chunks)
+    make_year(tmp_path / "2016.nc", rain[3:], np.arange(3, 7), chunks=chunks)
+
+    combine_to = tmp_path / "combined.nc"
+    radolan_scraper.combine.run(
+        combine_to,
+        [tmp_path / "2015.nc", tmp_path / "2016.nc"],
+        radolan_scraper.storage.get_profile("compact"),
+        mode="virtual",
+    )
+
+    monkeypatch.chdir("/")
+    radolan_scraper.add_coordinate_grid.run(combine_to)
+    grid = radolan_scraper.radolan_grid.get_grid((900, 900))
+    with h5netcdf.File(combine_to, "r") as f:
+        assert f["rain"].dimensions == ("time", "y", "x")
+        assert f["rain"].attrs["scale_factor"] == pytest.approx(0.1)
+        np.testing.assert_array_equal(f["rain"][...], rain)
+        np.testing.assert_array_equal(f["time"][...], np.arange(7))
+        assert f["xc"].dimensions == ("y", "x")
+        assert f["yv"].dimensions == ("y", "x", "nv")
+        np.testing.assert_allclose(f["xc"][...], grid.xc)
+        np.testing.assert_allclose(f["yv"][...], grid.yv)
+
+
+def test_combine_append_skips_stored_frames(tmp_path):
+    rain = np.random.RandomState(0).randint(-1, 50, size=(9, 8, 10))
+    make_year(tmp_path / "2015.nc", rain[:3], np.arange(3))
+    make_year(tmp_path / "2016.nc", rain[3:5], np.arange(3, 5))
+    combine_to = tmp_path / "combined.nc"
+    profile = radolan_scraper.storage.get_profile("compact")
+    files_to_combine = [tmp_path / "2015.nc", tmp_path / "2016.nc"]
+    radolan_scraper.combine.run(combine_to, files_to_combine, profile)
+
+    # The current year got new frames, which are appended after the stored ones.
+    make_year(tmp_path / "2016.nc", rain[3:], np.arange(3, 9))
+    radolan_scraper.combine.run(combine_to, files_to_combine, profile, append=True)
+
+    with h5netcdf.File(combine_to, "r") as f:
+        np.testing.assert_array_equal(f["rain"][...], rain)
+        np.testing.assert_array_equal(f["time"][...], np.arange(9))
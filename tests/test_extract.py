@@ -0,0 +1,33 @@
+import radolan_scraper.extract
+from test_collect import make_frame, make_month_tar, to_asc
+
+
+def test_run_extracts_hours_and_reports_progress(tmp_path):
+    frames = [make_frame(0, (10, 12)), make_frame(1, (10, 12))]
+    tar_files = [tmp_path / "RW-201601.tar", tmp_path / "RW-201602.tar"]
+    make_month_tar(tar_files[0], "201601", {"01": frames, "02": frames[:1]})
+    make_month_tar(tar_files[1], "201602", {"01": frames})
+
+    progress = []
+    extract_to = tmp_path / "extracted"
+    n_files = radolan_scraper.extract.run(
+        extract_to, tar_files, 2, lambda *args: progress.append(args)
+    )
+
+    assert n_files == 5
+    assert progress == [(1, 2), (2, 2)]
+    assert sorted(
+        p.relative_to(extract_to).as_posix()
+        for p in extract_to.rglob("*")
+        if p.is_file()
+    ) == [
+        "01/01/RW_20160101-0050.asc",
+        "01/01/RW_20160101-0150.asc",
+        "01/02/RW_20160102-0050.asc",
+        "02/01/RW_20160201-0050.asc",
+        "02/01/RW_20160201-0150.asc",
+    ]
+    assert (extract_to / "02" / "01" / "RW_20160201-0150.asc").read_bytes() == to_asc(
+        frames[1]
+    )
+    assert not list(extract_to.rglob("*.tar.gz"))
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import radolan_scraper.archive_index
+import radolan_scraper.frame_store
+from test_collect import make_frame, make_month_tar
+
+
+def test_write_and_load(tmp_path):
+    frames = [make_frame(seed) for seed in range(3)]
+    tar_files = [tmp_path / "RW-201601.tar", tmp_path / "RW-201602.tar"]
+    make_month_tar(tar_files[1], "201602", {"01": frames[2:]})
+    make_month_tar(tar_files[0], "201601", {"02": frames[1:2], "01": frames[:1]})
+
+    store_path = tmp_path / "2016.npy"
+    assert radolan_scraper.frame_store.write(store_path, tar_files) == 3
+
+    store = radolan_scraper.frame_store.load(store_path)
+    assert isinstance(store.frames, np.memmap)
+    assert store.frames.dtype == np.int16
+    np.testing.assert_array_equal(store.frames, np.stack(frames))
+    assert list(store.times) == [
+        np.datetime64("2016-01-01T00:50"),
+        np.datetime64("2016-01-02T00:50"),
+        np.datetime64("2016-02-01T00:50"),
+    ]
+    np.testing.assert_array_equal(
+        store.frame_at(datetime(2016, 1, 2, 0, 50)), frames[1]
+    )
+    with pytest.raises(KeyError):
+        store.index_of(datetime(2016, 1, 2, 1, 50))
+    assert sorted(p.name for p in tmp_path.glob("2016*")) == [
+        "2016.npy",
+        "2016.times.npy",
+    ]
+
+
+def test_write_inflates_every_day_once(tmp_path, monkeypatch):
+    tar_file = tmp_path / "RW-201601.tar"
+    make_month_tar(tar_file, "201601", {"01": [make_frame(0)], "02": [make_frame(1)]})
+    inflate_day = radolan_scraper.archive_index.inflate_day
+    inflated = []
+    monkeypatch.setattr(
+        radolan_scraper.archive_index,
+        "inflate_day",
+        lambda data: inflated.append(data) or inflate_day(data),
+    )
+    assert radolan_scraper.frame_store.write(tmp_path / "2016.npy", [tar_file]) == 2
+    assert len(inflated) == 2
+
+
+def test_write_rejects_values_out_of_range(tmp_path):
+    frame = make_frame(0)
+    frame[0, 0] = 40000
+    tar_file = tmp_path / "RW-201601.tar"
+    make_month_tar(tar_file, "201601", {"01": [frame]})
+    with pytest.raises(ValueError, match="do not fit"):
+        radolan_scraper.frame_store.write(tmp_path / "2016.npy", [tar_file])
+    assert list(tmp_path.glob("2016*")) == []
+
+
+def test_write_rejects_frames_of_other_shapes(tmp_path):
+    tar_file = tmp_path / "RW-201601.tar"
+    make_month_tar(tar_file, "201601", {"01": [make_frame(0, shape=(900, 899))]})
+    with pytest.raises(ValueError, match="do not match"):
+        radolan_scraper.frame_store.write(tmp_path / "2016.npy", [tar_file])
+    assert list(tmp_path.glob("2016*")) == []
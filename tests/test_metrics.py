@@ -0,0 +1,87 @@
+import json
+
+import luigi
+import pytest
+
+import radolan_scraper.collect
+import radolan_scraper.metrics
+import radolan_scraper.pipeline
+from test_collect import make_frame, make_month_tar
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_collect_metrics(tmp_path, n_workers):
+    frames = [make_frame(seed) for seed in range(4)]
+    raw_path = tmp_path / "raw"
+    raw_path.mkdir()
+    make_month_tar(raw_path / "RW-201601.tar", "201601", {"01": frames[:3]})
+    make_month_tar(raw_path / "RW-201602.tar", "201602", {"01": frames[3:]})
+
+    progress = []
+    collect_metrics = radolan_scraper.metrics.reset()
+    radolan_scraper.collect.run(
+        tmp_path / "2016.nc",
+        raw_path,
+        n_workers=n_workers,
+        on_progress=lambda n_done, n_frames: progress.append((n_done, n_frames)),
+    )
+    assert progress[-1] == (4, 4)
+    assert collect_metrics.counts["frames"] == 4
+    assert collect_metrics.counts["bytes_read"] > 0
+    assert collect_metrics.counts["bytes_written"] == 4 * frames[0].nbytes
+    assert set(collect_metrics.seconds) == {
+        "gunzip",
+        "decode",
+        "check_bounding_box",
+        "date2num",
+        "hdf5_write",
+        "checkpoint",
+    }
+
+
+def test_write_prometheus(tmp_path):
+    task_metrics = radolan_scraper.metrics.Metrics()
+    with task_metrics.timer("decode"):
+        task_metrics.add("frames", 3)
+    task_metrics.merge({"seconds": {"decode": 1.5}, "counts": {"frames": 2}})
+    snapshot = task_metrics.snapshot()
+    assert snapshot["counts"] == {"frames": 5}
+    assert snapshot["seconds"]["decode"] >= 1.5
+
+    path = tmp_path / "task.prom"
+    radolan_scraper.metrics.write_prometheus(path, snapshot, "Collect")
+    lines = path.read_text().splitlines()
+    assert 'radolan_task_frames_total{task="Collect"} 5' in lines
+    assert any(
+        line.startswith('radolan_task_step_seconds{task="Collect",step="decode"} 1.5')
+        for line in lines
+    )
+
+
+class CountFrames(luigi.Task):
+    path = luigi.Parameter()
+
+    def output(self):
+        return luigi.LocalTarget(self.path)
+
+    def run(self):
+        radolan_scraper.metrics.current().add("frames", 7)
+        with self.output().open("w") as f:
+            f.write("done")
+
+
+def test_task_metrics_are_exported(tmp_path):
+    config = luigi.configuration.get_config()
+    config.set("MetricsConfig", "directory", str(tmp_path))
+    config.set("MetricsConfig", "profile", "true")
+    try:
+        task = CountFrames(str(tmp_path / "done"))
+        assert luigi.build([task], local_scheduler=True)
+    finally:
+        config.remove_section("MetricsConfig")
+
+    task_id = task.task_id
+    with open(tmp_path / f"{task_id}.json") as f:
+        assert json.load(f)["counts"] == {"frames": 7}
+    assert (tmp_path / f"{task_id}.prom").exists()
+    assert (tmp_path / f"{task_id}.pstats").exists()
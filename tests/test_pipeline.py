@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from pathlib import Path
+import shutil
+
+import h5netcdf
+import luigi
+import numpy as np
+
+from benchmarks.dwd_server import PREFIX, publish, serve_in_thread
+import radolan_scraper.collect
+import radolan_scraper.frame_store
+import radolan_scraper.pipeline
+from test_collect import make_frame, make_month_tar
+
+
+def make_year(root, frames):
+    for month, frame in enumerate(frames, 1):
+        tar_file = root / "2016" / f"RW-2016{month:02}.tar"
+        tar_file.parent.mkdir(parents=True, exist_ok=True)
+        make_month_tar(tar_file, f"2016{month:02}", {"01": [frame]})
+
+
+@contextmanager
+def serve_months(server_root):
+    config = luigi.configuration.get_config()
+    with serve_in_thread(server_root) as server:
+        config.set("ScrapeConfig", "base_url", str(server.base_url))
+        try:
+            yield server
+        finally:
+            config.remove_section("ScrapeConfig")
+
+
+def test_year_is_assembled_from_month_shards(tmp_path, monkeypatch):
+    monkeypatch.setenv("BASE_DATA_DIR", str(tmp_path))
+    frames = [make_frame(seed) for seed in range(12)]
+    make_year(tmp_path / "raw", frames)
+    may = tmp_path / "raw" / "2016" / "RW-201605.tar"
+    may_data = may.read_bytes()
+    may.write_bytes(b"not a tar file")
+
+    task = radolan_scraper.pipeline.CreateNetCDFFromTarFiles("2016")
+    with serve_months(tmp_path / "raw"):
+        assert not luigi.build([task], local_scheduler=True, workers=3)
+        shards = [Path(input_.path) for input_ in task.input()]
+    assert [shard.exists() for shard in shards] == [month != 4 for month in range(12)]
+
+    # Only the failed month is collected again.
+    may.write_bytes(may_data)
+    collected = []
+    run = radolan_scraper.collect.run
+    monkeypatch.setattr(
+        radolan_scraper.collect,
+        "run",
+        lambda collect_to, *args, **kwargs: collected.append(collect_to)
+        or run(collect_to, *args, **kwargs),
+    )
+    with serve_months(tmp_path / "raw"):
+        assert luigi.build([task], local_scheduler=True)
+    assert collected == [shards[4]]
+    with h5netcdf.File(task.output().path, "r") as f:
+        np.testing.assert_array_equal(f["rain"][...], np.stack(frames))
+    # The shards are removed once the yearly file is complete.
+    assert not any(shard.exists() for shard in shards)
+
+
+def test_get_months(tmp_path):
+    make_year(tmp_path, [make_frame(seed) for seed in range(2)])
+    with serve_in_thread(tmp_path) as server:
+        months = radolan_scraper.pipeline.get_months(2016, str(server.base_url))
+    assert list(months) == [date(2016, 1, 1), date(2016, 2, 1)]
+    assert months[date(2016, 2, 1)].name == "RW-201602.tar"
+
+
+def test_interrupted_download_is_resumed(tmp_path, monkeypatch):
+    monkeypatch.setenv("BASE_DATA_DIR", str(tmp_path))
+    make_year(tmp_path / "server", [make_frame(0)])
+    data = (tmp_path / "server" / "2016" / "RW-201601.tar").read_bytes()
+    modified = datetime(2019, 6, 28, 12)
+    publish(tmp_path / "server", 2016, "RW-201601.tar", data, modified)
+    publish(tmp_path / "raw", 2016, "RW-201601.tar.part", data[:1000], modified)
+
+    with serve_months(tmp_path / "server") as server:
+        assert luigi.build(
+            [radolan_scraper.pipeline.ScrapeRadolan("2016")], local_scheduler=True
+        )
+    assert server.requests[-1] == (f"{PREFIX}2016/RW-201601.tar", "bytes=1000-")
+    tar_file = tmp_path / "raw" / "2016" / "RW-201601.tar"
+    assert tar_file.read_bytes() == data
+    assert tar_file.stat().st_mtime == modified.replace(tzinfo=timezone.utc).timestamp()
+
+
+def test_partial_year_is_completed(tmp_path, monkeypatch):
+    monkeypatch.setenv("BASE_DATA_DIR", str(tmp_path))
+    frames = [make_frame(seed) for seed in range(3)]
+    make_year(tmp_path / "server", frames)
+    # The download of the year stopped after two months.
+    shutil.copytree(tmp_path / "server", tmp_path / "raw")
+    (tmp_path / "raw" / "2016" / "RW-201603.tar").unlink()
+
+    task = radolan_scraper.pipeline.CreateFrameStore("2016")
+    with serve_months(tmp_path / "server"):
+        assert luigi.build([task], local_scheduler=True)
+
+    store = radolan_scraper.frame_store.load(Path(task.output().path))
+    np.testing.assert_array_equal(store.frames, np.stack(frames))
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import h5netcdf
+import numpy as np
+
+import radolan_scraper.points
+import radolan_scraper.radolan_grid
+from test_reader import make_combined
+
+
+def test_extract_matches_nearest_cells(tmp_path):
+    rng = np.random.RandomState(0)
+    rain = rng.randint(-1, 50, size=(10, 900, 900)).astype(np.int16)
+    make_combined(tmp_path / "combined.nc", rain)
+    lon = np.append(rng.uniform(6, 14, 200), 30.0)
+    lat = np.append(rng.uniform(48, 54, 200), 30.0)
+
+    series = radolan_scraper.points.extract(
+        tmp_path / "combined.nc",
+        lon,
+        lat,
+        start=datetime(2016, 1, 1, 1),
+        memory_limit=3 * 100 * 100 * 2,
+    )
+
+    grid = radolan_scraper.radolan_grid.get_grid()
+    for i in range(0, 200, 37):
+        distance = (grid.xc - lon[i]) ** 2 + ((grid.yc - lat[i]) * 1.6) ** 2
+        assert np.unravel_index(distance.argmin(), distance.shape) == (
+            series.row[i],
+            series.col[i],
+        )
+    assert (series.row[-1], series.col[-1]) == (-1, -1)
+    assert series.rain.shape == (9, 201)
+    assert series.time[0] == np.datetime64("2016-01-01T01:50")
+
+    expected = rain[1:, series.row[:-1], series.col[:-1]]
+    valid = expected >= 0
+    np.testing.assert_allclose(series.rain[:, :-1][valid], 0.1 * expected[valid])
+    assert np.isnan(series.rain[:, :-1][~valid]).all()
+    assert np.isnan(series.rain[:, -1]).all()
+
+    radolan_scraper.points.write_netcdf(tmp_path / "points.nc", series)
+    with h5netcdf.File(tmp_path / "points.nc", "r") as f:
+        assert f["rain"].dimensions == ("time", "point")
+        np.testing.assert_array_equal(f["rain"][...], series.rain)
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import radolan_scraper.add_coordinate_grid
+import radolan_scraper.radolan_grid
+from test_add_coordinate_grid import get_signed_areas
+
+METADATA_DIR = Path(__file__).parents[1] / "metadata"
+
+
+def test_corners_of_rw_grid():
+    grid = radolan_scraper.radolan_grid.get_grid((900, 900))
+    # Corners of the national composite as published by the DWD, as (lat, lon).
+    np.testing.assert_allclose(
+        [grid.yv[-1, 0, 0], grid.xv[-1, 0, 0]], [46.9526, 3.5889], atol=1e-4
+    )
+    np.testing.assert_allclose(
+        [grid.yv[0, 0, 3], grid.xv[0, 0, 3]], [54.5877, 2.0715], atol=1e-4
+    )
+    np.testing.assert_allclose(
+        [grid.yv[0, -1, 2], grid.xv[0, -1, 2]], [54.7405, 15.7208], atol=1e-4
+    )
+    np.testing.assert_allclose(
+        [grid.yv[-1, -1, 1], grid.xv[-1, -1, 1]], [47.0705, 14.6209], atol=1e-4
+    )
+
+
+@pytest.mark.parametrize("shape", [(900, 900), (1100, 900), (1500, 1400)])
+def test_grid_round_trip(shape):
+    grid = radolan_scraper.radolan_grid.get_grid(shape)
+    assert grid.xc.shape == grid.yc.shape == shape
+    assert grid.xv.shape == grid.yv.shape == shape + (4,)
+    # CF expects the corners of every cell to run anticlockwise.
+    assert (get_signed_areas(grid.xv, grid.yv) > 0).all()
+
+    x, y = radolan_scraper.radolan_grid.to_xy(grid.xc, grid.yc)
+    x0, y0 = radolan_scraper.radolan_grid.GRID_ORIGINS[shape]
+    np.testing.assert_allclose(x[0], x0 + 0.5 + np.arange(shape[1]), atol=1e-6)
+    np.testing.assert_allclose(
+        y[:, 0], y0 - 0.5 + np.arange(shape[0], 0, -1), atol=1e-6
+    )
+
+
+def test_unknown_grid():
+    with pytest.raises(ValueError):
+        radolan_scraper.radolan_grid.get_grid((100, 100))
+
+
+@pytest.mark.skipif(
+    not (METADATA_DIR / "phi_center.txt").exists(), reason="metadata not available"
+)
+def test_grid_matches_metadata():
+    grid = radolan_scraper.radolan_grid.get_grid((900, 900))
+    xc = radolan_scraper.add_coordinate_grid.parse_longitude_definitions(
+        METADATA_DIR / "lambda_center.txt"
+    )
+    yc = radolan_scraper.add_coordinate_grid.parse_latitude_definitions(
+        METADATA_DIR / "phi_center.txt"
+    )
+    np.testing.assert_allclose(grid.xc, xc, atol=1e-3)
+    np.testing.assert_allclose(grid.yc, yc, atol=1e-3)
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+import h5netcdf
+import numpy as np
+import pytest
+
+import radolan_scraper.collect
+import radolan_scraper.reader
+import radolan_scraper.storage
+
+TIME_UNIT = radolan_scraper.collect.TIME_UNIT
+
+
+def make_combined(path, rain, chunks=(4, 100, 100)):
+    profile = radolan_scraper.storage.get_profile("compact")
+    first = TIME_UNIT.date2num(datetime(2016, 1, 1, 0, 50))
+    with h5netcdf.File(path, "w") as f:
+        f.dimensions["time"] = rain.shape[0]
+        f.dimensions["y"] = rain.shape[1]
+        f.dimensions["x"] = rain.shape[2]
+        time_var = f.create_variable(
+            "time", dimensions=("time",), data=first + 60 * np.arange(rain.shape[0])
+        )
+        time_var.attrs["units"] = TIME_UNIT.name
+        rain_var = radolan_scraper.storage.create_rain_variable(f, profile, chunks)
+        rain_var[...] = rain
+
+
+@pytest.fixture
+def combined(tmp_path):
+    rng = np.random.RandomState(0)
+    rain = rng.randint(-1, 50, size=(10, 900, 900)).astype(np.int16)
+    make_combined(tmp_path / "combined.nc", rain)
+    return tmp_path / "combined.nc", rain
+
+
+def test_query(combined):
+    path, rain = combined
+    bbox = radolan_scraper.reader.BoundingBox(8.0, 50.0, 9.0, 51.0)
+    with radolan_scraper.reader.Reader(path) as reader:
+        subset = reader.query(datetime(2016, 1, 1, 2), datetime(2016, 1, 1, 5), bbox)
+        lon, lat = reader.grid
+
+    assert list(subset.time) == [
+        np.datetime64("2016-01-01T02:50"),
+        np.datetime64("2016-01-01T03:50"),
+        np.datetime64("2016-01-01T04:50"),
+    ]
+    expected = rain[2:5, subset.y, subset.x]
+    np.testing.assert_allclose(
+        subset.rain[expected >= 0], 0.1 * expected[expected >= 0]
+    )
+    assert np.isnan(subset.rain[expected < 0]).all()
+    # The slices cover the box, and no more.
+    inside = (lon >= 8) & (lon <= 9) & (lat >= 50) & (lat <= 51)
+    assert inside[subset.y, subset.x].sum() == inside.sum()
+    assert inside[subset.y, subset.x].any(axis=0).all()
+    assert inside[subset.y, subset.x].any(axis=1).all()
+
+
+def test_repeated_queries_are_cached(combined):
+    path, rain = combined
+    with radolan_scraper.reader.Reader(
+        path, cache_bytes=8 * 100 * 100 * 4 * 2
+    ) as reader:
+        selection = (slice(3, 7), slice(150, 250), slice(50, 120))
+        np.testing.assert_array_equal(reader.read(selection), rain[selection])
+        # 2 chunks in time, 2 in y and 2 in x.
+        assert (reader.cache.misses, reader.cache.hits) == (8, 0)
+        np.testing.assert_array_equal(reader.read(selection), rain[selection])
+        assert (reader.cache.misses, reader.cache.hits) == (8, 8)
+        assert reader.cache.n_bytes <= reader.cache.max_bytes
+
+        # A small budget evicts the least recently used chunks.
+        reader.cache = radolan_scraper.reader.ChunkCache(4 * 100 * 100 * 2 * 3)
+        np.testing.assert_array_equal(reader.read(selection), rain[selection])
+        assert len(reader.cache._chunks) == 3
+
+
+def test_time_slice_outside_of_data(combined):
+    path, _ = combined
+    with radolan_scraper.reader.Reader(path) as reader:
+        assert reader.time_slice(datetime(2015, 1, 1), datetime(2015, 2, 1)) == slice(
+            0, 0
+        )
+        assert reader.time_slice(datetime(2015, 1, 1), datetime(2017, 1, 1)) == slice(
+            0, 10
+        )
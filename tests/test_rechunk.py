@@ -0,0 +1,41 @@
+import h5netcdf
+import numpy as np
+
+import radolan_scraper.rechunk
+import radolan_scraper.storage
+
+
+def test_rechunk_copies_cube(tmp_path):
+    rain = np.random.RandomState(0).randint(-1, 100, size=(50, 30, 40))
+    src_path = tmp_path / "combined.nc"
+    with h5netcdf.File(src_path, "w") as f:
+        f.dimensions["time"] = 50
+        f.dimensions["y"] = 30
+        f.dimensions["x"] = 40
+        time_var = f.create_variable("time", dimensions=("time",), data=np.arange(50))
+        time_var.attrs["units"] = "minutes since 1970-01-01 00:00:00"
+        rain_var = radolan_scraper.storage.create_rain_variable(
+            f, radolan_scraper.storage.PROFILES["legacy"], chunks=(1, 30, 40)
+        )
+        rain_var[...] = rain
+
+    dst_path = tmp_path / "rechunked.nc"
+    # Half of the memory limit is used for blocks, so they span three chunks.
+    amplification = radolan_scraper.rechunk.run(
+        src_path, dst_path, (64, 8, 8), memory_limit=2 * 3 * (50 * 8 * 8 * 8)
+    )
+
+    with h5netcdf.File(dst_path, "r") as f:
+        assert f["rain"].chunks == (50, 8, 8)
+        np.testing.assert_array_equal(f["rain"][...], rain)
+        np.testing.assert_array_equal(f["time"][...], np.arange(50))
+        assert f["time"].attrs["units"] == "minutes since 1970-01-01 00:00:00"
+    before, after = amplification["point time series"]
+    assert after < before
+
+
+def test_get_block_shape():
+    block_shape = radolan_scraper.rechunk.get_block_shape(
+        (120000, 900, 900), (8760, 32, 32), 2, 8760 * 32 * 32 * 2 * 10
+    )
+    assert block_shape == (8760, 32, 320)
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import h5netcdf
+import numpy as np
+import pytest
+import scipy.sparse
+
+import radolan_scraper.regrid
+from test_aggregate import make_combined
+
+TARGET = radolan_scraper.regrid.LatLonGrid(7.0, 50.0, 9.0, 51.0, 0.05)
+
+
+@pytest.mark.parametrize("method", radolan_scraper.regrid.METHODS)
+def test_weights_reproduce_linear_fields(method):
+    weights = radolan_scraper.regrid.compute_weights((900, 900), TARGET, method)
+    assert weights.shape == (20 * 40, 900 * 900)
+    np.testing.assert_allclose(weights.sum(axis=1), 1, rtol=1e-6)
+
+    # A field that is linear in the projected coordinates is interpolated exactly,
+    # and its cell averages equal the value at the cell centers.
+    x, y = radolan_scraper.radolan_grid.to_xy(*np.meshgrid(TARGET.lon, TARGET.lat))
+    rows, cols = np.mgrid[0:900, 0:900]
+    field = (3 * rows + cols)[np.newaxis]
+    regridded = radolan_scraper.regrid.apply_weights(weights, field, -1)
+    row, col = radolan_scraper.regrid.to_source_index(
+        (900, 900), *np.meshgrid(TARGET.lon, TARGET.lat)
+    )
+    expected = 3 * (row - 0.5) + (col - 0.5)
+    tolerance = 1e-3 if method == "bilinear" else 0.5
+    np.testing.assert_allclose(regridded[0], expected.ravel(), atol=tolerance)
+
+
+def test_missing_values_are_left_out():
+    weights = radolan_scraper.regrid.compute_weights((900, 900), TARGET, "bilinear")
+    field = np.full((1, 900, 900), 20)
+    field[0, :, :450] = -1
+    regridded = radolan_scraper.regrid.apply_weights(weights, field, -1, 0.1)
+    assert np.isnan(regridded).any()
+    np.testing.assert_allclose(regridded[~np.isnan(regridded)], 2.0, rtol=1e-6)
+
+
+def test_cells_at_the_edge_of_the_grid():
+    # Straddles the western edge of the RADOLAN grid.
+    target = radolan_scraper.regrid.LatLonGrid(1.5, 50.0, 3.5, 51.0, 0.05)
+    weights = radolan_scraper.regrid.compute_weights((900, 900), target, "conservative")
+    inside = np.asarray(weights.sum(axis=1)).ravel()
+    assert ((inside > 0) & (inside < 0.5)).any()
+    assert ((inside >= 0.5) & (inside < 1)).any()
+
+    field = np.full((1, 900, 900), 20)
+    regridded = radolan_scraper.regrid.apply_weights(weights, field, -1, 0.1)[0]
+    np.testing.assert_array_equal(np.isnan(regridded), inside < 0.5)
+    np.testing.assert_allclose(regridded[inside >= 0.5], 2.0, rtol=1e-6)
+
+
+def test_load_weights_after_the_file_changed(tmp_path):
+    weights_path = tmp_path / "weights.npz"
+    for n in (2, 3):
+        scipy.sparse.save_npz(weights_path, scipy.sparse.identity(n, format="csr"))
+        assert radolan_scraper.regrid.load_weights(weights_path).shape == (n, n)
+
+
+def test_run(tmp_path):
+    rng = np.random.RandomState(0)
+    times = [datetime(2016, 1, 1, 0, 50) + timedelta(hours=h) for h in range(7)]
+    rain = rng.randint(0, 50, size=(7, 900, 900))
+    make_combined(tmp_path / "combined.nc", rain, times)
+
+    radolan_scraper.regrid.run(
+        tmp_path / "combined.nc",
+        tmp_path / "latlon.nc",
+        TARGET,
+        n_workers=2,
+        memory_limit=1,
+    )
+
+    weights = radolan_scraper.regrid.compute_weights((900, 900), TARGET, "bilinear")
+    expected = radolan_scraper.regrid.apply_weights(weights, rain, -1, 0.1)
+    with h5netcdf.File(tmp_path / "latlon.nc", "r") as f:
+        assert f["rain"].shape == (7, 20, 40)
+        np.testing.assert_allclose(f["rain"][...].reshape(7, -1), expected, rtol=1e-6)
+        np.testing.assert_allclose(f["lat"][...], TARGET.lat)
+    assert len(list(tmp_path.glob("weights_bilinear_900x900_*.npz"))) == 1
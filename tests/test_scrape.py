@@ -1,3 +1,9 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from benchmarks.dwd_server import PREFIX, DWDServer, publish
 import radolan_scraper.scrape
 
 
@@ -39,3 +45,130 @@ def test_extract_filenames():
         "RW-200612.tar",
     ]
 
+
+def test_extract_listing():
+    table = """
+            <a href="RW-200601.tar">RW-200601.tar</a>                                      28-Jun-2019 12:00            15349760
+            <a href="RW-200602.tar">RW-200602.tar</a>                                      01-Jul-2019 08:30            24596480
+            """
+
+    assert radolan_scraper.scrape.extract_listing(table) == [
+        radolan_scraper.scrape.ListingEntry(
+            "RW-200601.tar", datetime(2019, 6, 28, 12), 15349760
+        ),
+        radolan_scraper.scrape.ListingEntry(
+            "RW-200602.tar", datetime(2019, 7, 1, 8, 30), 24596480
+        ),
+    ]
+
+
+def run_scrape(data_path, server_root, years, limit_per_host=8, failing=()):
+    async def scrape():
+        async with DWDServer(server_root, failing) as server:
+            await radolan_scraper.scrape.run(
+                asyncio.get_running_loop(),
+                data_path,
+                years,
+                2,
+                server.base_url,
+                limit_per_host,
+            )
+            return server
+
+    return asyncio.run(scrape())
+
+
+def get_requests(*args, **kwargs):
+    return run_scrape(*args, **kwargs).requests
+
+
+def test_download_skips_up_to_date_files(tmp_path):
+    server_root, data_path = tmp_path / "server", tmp_path / "raw"
+    modified = datetime(2019, 6, 28, 12)
+    publish(server_root, 2006, "RW-200601.tar", b"january" * 100, modified)
+    publish(server_root, 2006, "RW-200602.tar", b"february" * 100, modified)
+
+    requests = get_requests(data_path, server_root, [2006])
+    assert len(requests) == 3
+    assert (data_path / "2006" / "RW-200601.tar").read_bytes() == b"january" * 100
+    assert (data_path / "2006" / "RW-200602.tar").read_bytes() == b"february" * 100
+
+    # Only the listing is fetched when nothing changed on the server.
+    requests = get_requests(data_path, server_root, [2006])
+    assert [path for path, _ in requests] == [f"{PREFIX}2006/"]
+
+    # A republished file is downloaded again.
+    publish(server_root, 2006, "RW-200602.tar", b"march" * 100, datetime(2019, 7, 1))
+    requests = get_requests(data_path, server_root, [2006])
+    assert [path for path, _ in requests] == [
+        f"{PREFIX}2006/",
+        f"{PREFIX}2006/RW-200602.tar",
+    ]
+    assert (data_path / "2006" / "RW-200602.tar").read_bytes() == b"march" * 100
+
+
+def test_download_resumes_partial_files(tmp_path):
+    server_root, data_path = tmp_path / "server", tmp_path / "raw"
+    data = bytes(range(256)) * 40
+    modified = datetime(2019, 6, 28, 12)
+    publish(server_root, 2006, "RW-200601.tar", data, modified)
+    # An interrupted download of the same version of the file.
+    part = publish(data_path, 2006, "RW-200601.tar.part", data[:1000], modified)
+
+    requests = get_requests(data_path, server_root, [2006])
+    assert requests[-1] == (f"{PREFIX}2006/RW-200601.tar", "bytes=1000-")
+    assert (data_path / "2006" / "RW-200601.tar").read_bytes() == data
+    assert not part.exists()
+
+
+def test_download_discards_partial_files_of_other_versions(tmp_path):
+    server_root, data_path = tmp_path / "server", tmp_path / "raw"
+    old_data = b"old" * 1000
+    part = publish(
+        data_path, 2006, "RW-200601.tar.part", old_data[:1000], datetime(2019, 6, 28)
+    )
+    # The file was republished with new content of the same size.
+    new_data = b"new" * 1000
+    publish(server_root, 2006, "RW-200601.tar", new_data, datetime(2019, 7, 1))
+
+    requests = get_requests(data_path, server_root, [2006])
+    assert requests[-1] == (f"{PREFIX}2006/RW-200601.tar", None)
+    assert (data_path / "2006" / "RW-200601.tar").read_bytes() == new_data
+    assert not part.exists()
+
+    # A complete .part file of an old version is not renamed into place either.
+    part = publish(
+        data_path, 2006, "RW-200602.tar.part", old_data, datetime(2019, 6, 28)
+    )
+    publish(server_root, 2006, "RW-200602.tar", new_data, datetime(2019, 7, 1))
+    requests = get_requests(data_path, server_root, [2006])
+    assert requests[-1] == (f"{PREFIX}2006/RW-200602.tar", None)
+    assert (data_path / "2006" / "RW-200602.tar").read_bytes() == new_data
+
+
+def test_download_reuses_connections(tmp_path):
+    server_root, data_path = tmp_path / "server", tmp_path / "raw"
+    for year in (2006, 2007):
+        for month in range(1, 4):
+            name = f"RW-{year}{month:02}.tar"
+            publish(server_root, year, name, name.encode(), datetime(2019, 6, 28))
+
+    server = run_scrape(data_path, server_root, [2006, 2007], limit_per_host=1)
+    assert len(server.requests) == 8
+    assert len(server.peers) == 1
+    assert len(list(data_path.rglob("*.tar"))) == 6
+
+
+def test_download_reports_failed_files(tmp_path):
+    server_root, data_path = tmp_path / "server", tmp_path / "raw"
+    names = [f"RW-2006{month:02}.tar" for month in range(1, 7)]
+    for name in names:
+        publish(server_root, 2006, name, name.encode(), datetime(2019, 6, 28))
+
+    # More failing files than consumers must neither hang nor stop the others.
+    with pytest.raises(RuntimeError, match="3 downloads failed"):
+        run_scrape(data_path, server_root, [2006], failing=names[:3])
+    assert sorted(p.name for p in data_path.rglob("*.tar")) == names[3:]
+
+    run_scrape(data_path, server_root, [2006])
+    assert sorted(p.name for p in data_path.rglob("*.tar")) == names
@@ -0,0 +1,34 @@
+import h5netcdf
+import numpy as np
+import pytest
+
+import radolan_scraper.storage
+
+
+def test_compact_profile_packs_rain(tmp_path):
+    profile = radolan_scraper.storage.get_profile("compact", "gzip:6")
+    path = tmp_path / "rain.nc"
+    with h5netcdf.File(path, "w") as f:
+        f.dimensions["time"] = 2
+        f.dimensions["y"] = 3
+        f.dimensions["x"] = 4
+        rain_var = radolan_scraper.storage.create_rain_variable(f, profile)
+        rain_var[...] = np.arange(24).reshape(2, 3, 4) - 1
+
+    with h5netcdf.File(path, "r") as f:
+        rain_var = f["rain"]
+        assert rain_var.dtype == np.int16
+        assert rain_var.attrs["_FillValue"] == -1
+        assert rain_var.attrs["scale_factor"] == pytest.approx(0.1)
+        np.testing.assert_array_equal(rain_var[0, 0], [-1, 0, 1, 2])
+
+        radolan_scraper.storage.check_compatible(rain_var, profile)
+        with pytest.raises(ValueError):
+            radolan_scraper.storage.check_compatible(
+                rain_var, radolan_scraper.storage.get_profile("legacy")
+            )
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        radolan_scraper.storage.get_profile("compact", "brotli")
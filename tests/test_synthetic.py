@@ -0,0 +1,31 @@
+from datetime import date
+
+import numpy as np
+
+from benchmarks import synthetic
+import radolan_scraper.frame_store
+
+
+def test_generate_archive(tmp_path):
+    tar_files = synthetic.generate_archive(
+        tmp_path / "raw", [date(2016, 2, 1)], days_per_month=2, hours_per_day=3
+    )
+    assert tar_files == [tmp_path / "raw" / "2016" / "RW-201602.tar"]
+    assert synthetic.count_days(date(2016, 2, 1)) == 29
+
+    store_path = tmp_path / "frames.npy"
+    assert radolan_scraper.frame_store.write(store_path, tar_files) == 6
+    store = radolan_scraper.frame_store.load(store_path)
+    assert store.times[0] == np.datetime64("2016-02-01T00:50")
+    assert store.times[-1] == np.datetime64("2016-02-02T02:50")
+
+    # The coverage is the same in every frame and most covered cells are dry.
+    missing = store.frames == -1
+    assert (missing == missing[:1]).all()
+    assert 0.1 < missing.mean() < 0.9
+    assert 0.01 < (store.frames > 0).mean() / (~missing).mean() < 0.5
+    # The same seed generates the same archive.
+    again = synthetic.generate_archive(
+        tmp_path / "again", [date(2016, 2, 1)], days_per_month=2, hours_per_day=3
+    )
+    assert again[0].read_bytes() == tar_files[0].read_bytes()